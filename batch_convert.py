@@ -0,0 +1,194 @@
+"""Headless batch conversion of HTML, RTF and DOCX files into PDFs.
+
+    python batch_convert.py notes/ report.docx -o out/ -j 4 --concat all.pdf
+
+Directories are scanned for ``.html``, ``.htm``, ``.rtf``, ``.docx`` and
+``.txt`` files (``-r`` to recurse).  Files are converted by ``-j`` worker
+processes, each owning its own renderer (one warm Word instance per worker
+with the Word backend, quit when the worker exits), and every file reports
+as it finishes.  A timing
+summary follows; ``--timings`` also writes the per-file times as CSV and
+``--concat`` joins the outputs, in input order, into one PDF.
+
+Outputs mirror the inputs' relative paths with ``.pdf`` as extension; inputs
+that would share an output (``a.html`` and ``a.rtf``) keep their own
+extension instead (``a.html.pdf``, ``a.rtf.pdf``), and the renaming is
+reported.
+"""
+import os, sys, csv, time, argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+EXTENSIONS = (".html", ".htm", ".rtf", ".docx", ".txt")
+
+_renderer = None        # one per worker process
+
+
+def collect_inputs(paths, recursive=False):
+    """``[(input file, path relative to its root)]`` for files and directories"""
+    inputs = []
+    for path in paths:
+        if os.path.isfile(path):
+            inputs.append((path, os.path.basename(path)))
+            continue
+        if not os.path.isdir(path):
+            raise Exception(f"No such file or directory: {path}")
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            if not recursive:
+                dirnames[:] = []
+            for filename in sorted(filenames):
+                if filename.lower().endswith(EXTENSIONS) and not filename.startswith("~$"):
+                    full = os.path.join(dirpath, filename)
+                    inputs.append((full, os.path.relpath(full, path)))
+    return inputs
+
+
+def output_paths(inputs, output_dir, report=print):
+    """One distinct output PDF per input, even where input names collide"""
+    stems = [os.path.splitext(relative)[0] for _, relative in inputs]
+    counts = Counter(os.path.normcase(stem) for stem in stems)
+    taken = set()
+    outputs = []
+    for (input_path, relative), stem in zip(inputs, stems):
+        name = stem if counts[os.path.normcase(stem)] == 1 else relative
+        candidate, number = name, 2
+        while os.path.normcase(candidate) in taken:
+            # Same relative path under two input roots
+            candidate, number = f"{name}_{number}", number + 1
+        taken.add(os.path.normcase(candidate))
+        if candidate != stem:
+            report(f"Output name collision: {input_path} -> {candidate}.pdf")
+        outputs.append(os.path.join(output_dir, candidate + ".pdf"))
+    return outputs
+
+
+def _init_worker(renderer_name):
+    global _renderer
+    from multiprocessing.util import Finalize
+    from renderers import get_renderer
+
+    options = {"pool_size": 1} if renderer_name == "word" else {}
+    _renderer = get_renderer(renderer_name, **options)
+    # Quit the worker's Word instance when the pool shuts the worker down.
+    # Not atexit: forked workers leave through os._exit, which skips it
+    Finalize(_renderer, _renderer.close, exitpriority=10)
+
+
+def _convert(input_path, outfile):
+    """Convert one file in a worker; returns (seconds, pages, bytes)"""
+    from pdf_info import read_pdf_info
+    from pdf_builder import finish_fragment
+
+    start = time.perf_counter()
+    os.makedirs(os.path.dirname(outfile) or ".", exist_ok=True)
+    _renderer.render_file(input_path, outfile)
+    finish_fragment(outfile)
+    elapsed = time.perf_counter() - start
+    return elapsed, read_pdf_info(outfile)["pages"], os.path.getsize(outfile)
+
+
+def convert_all(inputs, output_dir, renderer_name, workers, report=print):
+    """Convert ``inputs`` in parallel; returns one result dict per input, in input order"""
+    results = [None] * len(inputs)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(renderer_name,)) as executor:
+        futures = {}
+        outputs = output_paths(inputs, output_dir, report)
+        for position, ((input_path, _), outfile) in enumerate(zip(inputs, outputs)):
+            futures[executor.submit(_convert, input_path, outfile)] = position
+            results[position] = {"input": input_path, "output": outfile, "ok": False,
+                                 "seconds": 0.0, "pages": 0, "bytes": 0, "error": ""}
+        for done, future in enumerate(as_completed(futures), 1):
+            result = results[futures[future]]
+            try:
+                result["seconds"], result["pages"], result["bytes"] = future.result()
+                result["ok"] = True
+                status = "ok"
+            except Exception as convert_error:
+                result["error"] = str(convert_error)
+                status = "FAILED"
+            width = len(str(len(inputs)))
+            line = f"[{done:>{width}}/{len(inputs)}] {status:<6} {result['seconds']:7.2f}s  {result['input']}"
+            if result["error"]:
+                line += f"  ({result['error']})"
+            report(line)
+    return results
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def print_summary(results, wall_seconds, slowest=5):
+    converted = [r for r in results if r["ok"]]
+    times = [r["seconds"] for r in converted]
+    print()
+    print(f"Converted {len(converted)}/{len(results)} file(s) in {wall_seconds:.2f}s wall time")
+    if times:
+        print(f"  render time: total {sum(times):.2f}s, mean {sum(times) / len(times):.2f}s, "
+              f"median {percentile(times, 0.5):.2f}s, p95 {percentile(times, 0.95):.2f}s, "
+              f"max {max(times):.2f}s")
+        print(f"  output: {sum(r['pages'] for r in converted)} page(s), "
+              f"{sum(r['bytes'] for r in converted) / 1024:.1f} KB")
+        print("  slowest:")
+        for r in sorted(converted, key=lambda r: r["seconds"], reverse=True)[:slowest]:
+            print(f"    {r['seconds']:7.2f}s  {r['pages']:4d} page(s)  {r['input']}")
+    failed = [r for r in results if not r["ok"]]
+    if failed:
+        print(f"  failed ({len(failed)}):")
+        for r in failed:
+            print(f"    {r['input']}: {r['error']}")
+
+
+def write_timings(results, path):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=["input", "output", "ok", "seconds", "pages", "bytes", "error"])
+        writer.writeheader()
+        writer.writerows(results)
+
+
+def main(argv=None):
+    from renderers import RENDERERS, default_renderer_name
+
+    parser = argparse.ArgumentParser(description="Convert HTML, RTF and DOCX files to PDF")
+    parser.add_argument("inputs", nargs="+", help="files or directories to convert")
+    parser.add_argument("-o", "--output-dir", default="pdf_out", help="where PDFs are written (default: pdf_out)")
+    parser.add_argument("-r", "--recursive", action="store_true", help="descend into subdirectories")
+    parser.add_argument("-j", "--workers", type=int, default=min(4, os.cpu_count() or 1),
+                        help="parallel renderer workers (default: min(4, CPUs))")
+    parser.add_argument("--renderer", choices=sorted(RENDERERS), default=default_renderer_name(),
+                        help="rendering backend (default: CLIP2PDF_RENDERER or the platform default)")
+    parser.add_argument("--concat", metavar="PDF", help="also join all outputs, in input order, into this PDF")
+    parser.add_argument("--timings", metavar="CSV", help="write per-file timings to this CSV file")
+    args = parser.parse_args(argv)
+
+    inputs = collect_inputs(args.inputs, args.recursive)
+    if not inputs:
+        print("Nothing to convert")
+        return 1
+    print(f"Converting {len(inputs)} file(s) with {args.workers} {args.renderer} worker(s)")
+
+    start = time.perf_counter()
+    results = convert_all(inputs, args.output_dir, args.renderer, max(1, args.workers))
+    if args.concat:
+        from pdf_builder import concatenate_pdfs
+
+        outputs = [r["output"] for r in results if r["ok"]]
+        if outputs:
+            concat_start = time.perf_counter()
+            concatenate_pdfs(outputs, args.concat)
+            print(f"Concatenated {len(outputs)} PDF(s) into {args.concat} "
+                  f"in {time.perf_counter() - concat_start:.2f}s")
+    print_summary(results, time.perf_counter() - start)
+    if args.timings:
+        write_timings(results, args.timings)
+        print(f"Timings written to {args.timings}")
+    return 0 if all(r["ok"] for r in results) else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,243 @@
+"""Benchmarks for the paste, append, prepend, rebuild and preview paths.
+
+    python benchmark.py                             # all cases, all sizes
+    python benchmark.py --sizes 1 10 100 -o now.json
+    python benchmark.py --compare baseline.json     # flag regressions
+
+Runs anywhere: a ``SyntheticRenderer`` stands in for Word and writes PDFs of a
+given page count with the native engine.  Every case works on a working
+document (``manifest.FragmentDocument``) of that size, as the app does:
+
+* ``paste``   - ``add_clipboard_fragment`` rendering a 1-page paste into it
+* ``append`` / ``prepend`` - adding a 1-page fragment and ``assemble()``,
+  which extends the assembled PDF with an incremental update
+* ``rebuild`` - inserting a 1-page fragment in the middle and ``assemble()``,
+  which rebuilds the assembled PDF from every fragment
+* ``preview`` - ``read_pdf_info``, the parsing ``show_pdf`` does per document
+
+Each case runs ``--repeat`` times on a fresh copy of its document; the
+minimum and median are reported.  ``-o`` writes the results as JSON, and
+``--compare`` checks the median of every case against a stored baseline and
+exits with status 1 when one is more than ``--threshold`` slower.
+"""
+import os, io, sys, json, time, shutil, argparse, platform, tempfile, statistics, contextlib
+
+from renderers import Renderer, RENDERED
+
+SIZES = (1, 10, 100, 1000, 5000)
+CASES = ("paste", "append", "prepend", "rebuild", "preview")
+NOISE_FLOOR = 0.005     # seconds; differences below this are never regressions
+
+
+def _lines_per_page():
+    import native_pdf
+
+    return len(native_pdf.layout([("pre", "\n".join(["x"] * 500))])[0])
+
+
+def write_synthetic_pdf(outfile, pages, label="Synthetic"):
+    """Write a text PDF of exactly ``pages`` pages with the native engine"""
+    import native_pdf
+
+    lines = _lines_per_page()
+    blocks = []
+    for page in range(1, pages + 1):
+        text = [f"{label} page {page} of {pages}"]
+        text += [f"{page:05d}.{line:02d} The quick brown fox jumps over the lazy dog" for line in range(1, lines)]
+        # One preformatted block that exactly fills a page
+        blocks.append(("pre", "\n".join(text)))
+    written = native_pdf.write_pdf(blocks, outfile, title=f"{label} {pages}")
+    if written != pages:
+        raise Exception(f"Synthetic PDF has {written} pages, expected {pages}")
+    return outfile
+
+
+class SyntheticRenderer(Renderer):
+    """Stand-in for the clipboard renderers: writes a PDF of ``pages`` pages"""
+
+    name = "synthetic"
+
+    def __init__(self, pages=1):
+        self.pages = pages
+
+    def render(self, outfile, empty_text, failed_text):
+        write_synthetic_pdf(outfile, self.pages, label="Paste")
+        return RENDERED
+
+    def render_file(self, input_path, outfile):
+        write_synthetic_pdf(outfile, self.pages, label=os.path.basename(input_path))
+
+
+@contextlib.contextmanager
+def _quiet():
+    """Keep the code under test's progress prints out of the report"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def _time(fn):
+    with _quiet():
+        start = time.perf_counter()
+        fn()
+        return time.perf_counter() - start
+
+
+def _template(workdir, pages, fragment):
+    """Directory of an assembled working document: an N-page fragment, then ``fragment``"""
+    from manifest import FragmentDocument
+
+    directory = os.path.join(workdir, f"document_{pages}")
+    if not os.path.exists(directory):
+        document = FragmentDocument.create("bench", root=workdir)
+        for source in (None, fragment):
+            path = document.new_fragment_path()
+            if source is None:
+                write_synthetic_pdf(path, pages)
+            else:
+                shutil.copyfile(source, path)
+            document.add(path)
+        with _quiet():
+            document.assemble()
+        os.rename(document.directory, directory)
+    return directory
+
+
+def _copy(template, target):
+    """A fresh working document copied from ``template``"""
+    from manifest import FragmentDocument
+
+    shutil.copytree(template, target)
+    return FragmentDocument.load(target)
+
+
+def _add(document, fragment, mode, index=None):
+    path = document.new_fragment_path()
+    shutil.copyfile(fragment, path)
+    document.add(path, mode, index)
+
+
+def run_case(case, pages, workdir, repeat):
+    """Time one case ``repeat`` times; returns a result dict"""
+    from pdf_builder import add_clipboard_fragment
+    from pdf_info import read_pdf_info
+
+    fragment = os.path.join(workdir, "fragment_1.pdf")
+    if not os.path.exists(fragment):
+        write_synthetic_pdf(fragment, 1, label="Paste")
+    template = _template(workdir, pages, fragment)
+
+    times = []
+    size = 0
+    for run in range(repeat):
+        document = _copy(template, os.path.join(workdir, f"run_{case}_{pages}_{run}"))
+        target = document.output_path
+        if case == "paste":
+            renderer = SyntheticRenderer(1)
+            outfile = []
+            times.append(_time(lambda: outfile.append(add_clipboard_fragment(document, "append", renderer))))
+            target = outfile[0]
+        elif case in ("append", "prepend"):
+            times.append(_time(lambda: (_add(document, fragment, case), document.assemble())))
+        elif case == "rebuild":
+            times.append(_time(lambda: (_add(document, fragment, "insert", 1), document.assemble())))
+        elif case == "preview":
+            times.append(_time(lambda: read_pdf_info(target)))
+        else:
+            raise ValueError(f"Unknown case '{case}'")
+        size = os.path.getsize(target)
+        shutil.rmtree(document.directory)
+
+    return {
+        "case": case,
+        "pages": pages,
+        "runs": repeat,
+        "min": min(times),
+        "median": statistics.median(times),
+        "bytes": size,
+    }
+
+
+def run_all(cases, sizes, repeat, report=print):
+    results = []
+    workdir = tempfile.mkdtemp(prefix="clip2pdf_bench_")
+    try:
+        # Untimed warm-up so lazy imports are not charged to the first case
+        for case in cases:
+            run_case(case, 1, workdir, 1)
+        for pages in sizes:
+            for case in cases:
+                result = run_case(case, pages, workdir, repeat)
+                results.append(result)
+                report(format_result(result))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def format_result(result):
+    per_page = result["median"] / result["pages"] * 1e6
+    return (f"{result['case']:<8} {result['pages']:>6} pages  median {result['median'] * 1000:10.2f} ms  "
+            f"min {result['min'] * 1000:10.2f} ms  {per_page:10.1f} us/page  {result['bytes'] / 1024:10.1f} KB")
+
+
+def environment():
+    try:
+        from pypdf import __version__ as pypdf_version
+    except ImportError:
+        pypdf_version = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "pypdf": pypdf_version,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def compare(results, baseline, threshold):
+    """Cases whose median is more than ``threshold`` (fraction) slower than the baseline"""
+    previous = {(r["case"], r["pages"]): r for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        old = previous.get((result["case"], result["pages"]))
+        if old is None:
+            continue
+        change = result["median"] / old["median"] - 1 if old["median"] else 0.0
+        slower = result["median"] - old["median"]
+        if change > threshold and slower > NOISE_FLOOR:
+            regressions.append((result, old, change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark paste/append/prepend/rebuild/preview")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES), help="document sizes in pages")
+    parser.add_argument("--cases", nargs="+", choices=CASES, default=list(CASES), help="cases to run")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case (default: 3)")
+    parser.add_argument("-o", "--output", metavar="JSON", help="write the results to this file")
+    parser.add_argument("--compare", metavar="JSON", help="baseline results to check against")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="slowdown that counts as a regression (default: 0.25 = 25%%)")
+    args = parser.parse_args(argv)
+
+    results = run_all(args.cases, args.sizes, max(1, args.repeat))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"environment": environment(), "results": results}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against {args.compare}:")
+            for result, old, change in regressions:
+                print(f"  {result['case']:<8} {result['pages']:>6} pages  "
+                      f"{old['median'] * 1000:.2f} ms -> {result['median'] * 1000:.2f} ms  (+{change:.0%})")
+            return 1
+        print(f"\nNo regressions against {args.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
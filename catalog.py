@@ -0,0 +1,186 @@
+"""Persistent SQLite catalog of generated PDFs with full-text search.
+
+Every working document is recorded with its prefix, last edit mode, page
+count, size and source fragments, and the text of every page goes into an
+FTS5 index.  Sources (fragment PDFs) are indexed once: a source is only
+re-extracted when its size changes, so indexing after a paste costs the new
+fragment, not the document.  Text extraction runs in a process pool.
+
+The database lives at ``CLIP2PDF_CATALOG`` (default
+``%TEMP%/clip2pdf_catalog.sqlite3``).
+"""
+import os, json, time, sqlite3, tempfile, threading
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+DEFAULT_PATH = os.environ.get("CLIP2PDF_CATALOG",
+                              os.path.join(tempfile.gettempdir(), "clip2pdf_catalog.sqlite3"))
+EXTRACT_WORKERS = int(os.environ.get("CLIP2PDF_INDEX_WORKERS", "2"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    name TEXT NOT NULL,
+    prefix TEXT,
+    mode TEXT,
+    pages INTEGER,
+    bytes INTEGER,
+    fragments TEXT,
+    created REAL,
+    updated REAL
+);
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    bytes INTEGER,
+    pages INTEGER,
+    indexed REAL
+);
+CREATE TABLE IF NOT EXISTS document_sources (
+    document_id INTEGER NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+    source TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    page_offset INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS document_sources_source ON document_sources(source);
+CREATE VIRTUAL TABLE IF NOT EXISTS page_text USING fts5(text, source UNINDEXED, page UNINDEXED);
+"""
+
+
+def extract_page_texts(path):
+    """Text of every page of ``path``; runs in a worker process"""
+    from pypdf import PdfReader
+
+    texts = []
+    for page in PdfReader(path).pages:
+        try:
+            texts.append(page.extract_text() or "")
+        except Exception as text_error:
+            print(f"Could not extract text from {path}: {text_error}")
+            texts.append("")
+    return texts
+
+
+def fts_query(text):
+    """Quote every term so user input never hits FTS5 query syntax"""
+    return " ".join('"%s"' % term.replace('"', '""') for term in text.split())
+
+
+class Catalog:
+    """Records documents and searches their page text"""
+
+    def __init__(self, path=DEFAULT_PATH, workers=EXTRACT_WORKERS):
+        self.path = path
+        self.workers = workers
+        self._extractors = None
+        # Indexing is queued here so callers never wait for text extraction
+        self._background = ThreadPoolExecutor(max_workers=1, thread_name_prefix="catalog-index")
+        self._lock = threading.Lock()
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        """Connection committed on success and always closed"""
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA foreign_keys=ON")
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def record_document(self, document, mode=None):
+        """Insert or update a ``manifest.FragmentDocument``'s row and sources"""
+        sources = [(os.path.join(document.directory, f["file"]), f["pages"]) for f in document.fragments]
+        self.record(document.directory, document.name, sources,
+                    prefix=getattr(document, "prefix", None), mode=mode,
+                    size=sum(f["bytes"] for f in document.fragments))
+
+    def record(self, path, name, sources, prefix=None, mode=None, size=None):
+        """Insert or update a document made of ``sources`` (``[(pdf path, pages)]``)"""
+        now = time.time()
+        with self._lock, self._connect() as db:
+            db.execute(
+                "INSERT INTO documents (path, name, prefix, mode, pages, bytes, fragments, created, updated)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT(path) DO UPDATE SET name=excluded.name, prefix=excluded.prefix,"
+                " mode=excluded.mode, pages=excluded.pages, bytes=excluded.bytes,"
+                " fragments=excluded.fragments, updated=excluded.updated",
+                (path, name, prefix, mode, sum(pages for _, pages in sources), size,
+                 json.dumps([os.path.basename(source) for source, _ in sources]), now, now))
+            document_id = db.execute("SELECT id FROM documents WHERE path = ?", (path,)).fetchone()[0]
+            db.execute("DELETE FROM document_sources WHERE document_id = ?", (document_id,))
+            offset = 0
+            rows = []
+            for position, (source, pages) in enumerate(sources):
+                rows.append((document_id, source, position, offset))
+                offset += pages
+            db.executemany("INSERT INTO document_sources VALUES (?, ?, ?, ?)", rows)
+
+    def index(self, paths):
+        """Extract and index the sources in ``paths`` that changed since last time.
+
+        Returns the number of sources indexed.
+        """
+        todo = []
+        with self._connect() as db:
+            for path in paths:
+                row = db.execute("SELECT bytes FROM sources WHERE path = ?", (path,)).fetchone()
+                if os.path.exists(path) and (row is None or row["bytes"] != os.path.getsize(path)):
+                    todo.append(path)
+        if not todo:
+            return 0
+        if self._extractors is None:
+            self._extractors = ProcessPoolExecutor(max_workers=self.workers)
+        now = time.time()
+        for path, texts in zip(todo, self._extractors.map(extract_page_texts, todo)):
+            with self._lock, self._connect() as db:
+                db.execute("DELETE FROM page_text WHERE source = ?", (path,))
+                db.executemany("INSERT INTO page_text (text, source, page) VALUES (?, ?, ?)",
+                               [(text, path, i + 1) for i, text in enumerate(texts)])
+                db.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)",
+                           (path, os.path.getsize(path), len(texts), now))
+        print(f"Catalog: indexed {len(todo)} source(s)")
+        return len(todo)
+
+    def index_document_async(self, document, mode=None):
+        """Record ``document`` now and index its new fragments in the background"""
+        self.record_document(document, mode)
+        paths = [os.path.join(document.directory, f["file"]) for f in document.fragments]
+        return self._background.submit(self._index_logged, paths)
+
+    def _index_logged(self, paths):
+        try:
+            return self.index(paths)
+        except Exception as index_error:
+            print(f"Catalog indexing failed: {index_error}")
+            raise
+
+    def search(self, text, limit=50):
+        """Best matches for ``text``: document, page number and a snippet"""
+        if not text.strip():
+            return []
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT d.name, d.path, d.prefix, ds.page_offset + p.page AS page,"
+                " snippet(page_text, 0, '**', '**', '…', 16) AS snippet"
+                " FROM page_text p"
+                " JOIN document_sources ds ON ds.source = p.source"
+                " JOIN documents d ON d.id = ds.document_id"
+                " WHERE page_text MATCH ? ORDER BY rank LIMIT ?",
+                (fts_query(text), limit)).fetchall()
+        return [dict(row) for row in rows]
+
+    def recent(self, limit=20):
+        """Most recently updated documents"""
+        with self._connect() as db:
+            rows = db.execute("SELECT * FROM documents ORDER BY updated DESC LIMIT ?", (limit,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def close(self):
+        self._background.shutdown(wait=True)
+        if self._extractors is not None:
+            self._extractors.shutdown()
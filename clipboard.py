@@ -0,0 +1,202 @@
+"""Read the system clipboard as raw rich-text payloads.
+
+Word pastes straight from the Windows clipboard, but the native renderer needs
+the formats themselves.  ``read_payload`` returns whatever of HTML, RTF and
+plain text the clipboard currently offers, as a dict keyed by format name.
+``read_formats`` returns every format on the clipboard as raw bytes, for
+fingerprinting content Word would paste (images included);
+``payload_from_formats`` and ``image_from_formats`` pick the rich-text
+payload and the picture back out of such a dict.
+"""
+import os, re, shutil, struct, subprocess
+
+
+def read_payload():
+    """Return ``{"html": str, "rtf": str, "text": str}`` for the formats present"""
+    if os.name == 'nt':
+        return _read_windows()
+    return _read_unix()
+
+
+def read_formats():
+    """Return ``{format name: bytes}`` for every format the clipboard offers"""
+    if os.name == 'nt':
+        return _formats_windows()
+    return _formats_unix()
+
+
+def sequence_number():
+    """A counter that changes whenever the clipboard does, or None if unsupported"""
+    if os.name == 'nt':
+        import win32clipboard  # pip install pywin32
+
+        return win32clipboard.GetClipboardSequenceNumber()
+    return None
+
+
+# Format names per payload key, as Windows and the Unix tools report them
+# (CF_UNICODETEXT is 13, CF_TEXT is 1; ``read_formats`` names them by number)
+FORMAT_NAMES = {
+    "html": ("HTML Format", "text/html"),
+    "rtf": ("Rich Text Format", "text/rtf", "application/rtf"),
+    "text": ("13", "text/plain;charset=utf-8", "UTF8_STRING", "text/plain", "STRING", "1"),
+}
+# Picture formats, best first, with the file extension each is saved as
+IMAGE_FORMATS = (("PNG", ".png"), ("image/png", ".png"), ("JFIF", ".jpg"),
+                 ("image/jpeg", ".jpg"), ("8", ".bmp"), ("image/bmp", ".bmp"))
+CF_DIB = "8"
+
+
+def payload_from_formats(formats):
+    """``read_payload``'s dict, from a ``read_formats`` dict"""
+    payload = {}
+    for key, names in FORMAT_NAMES.items():
+        for name in names:
+            data = formats.get(name)
+            if not data:
+                continue
+            if name == "HTML Format":
+                payload[key] = cf_html_fragment(data)
+            elif key == "rtf":
+                payload[key] = data.decode("latin-1")
+            else:
+                payload[key] = data.decode("utf-8", errors="replace").rstrip("\0")
+            break
+    return payload
+
+
+def image_from_formats(formats):
+    """``(extension, bytes)`` of the best picture in a ``read_formats`` dict, or None"""
+    for name, extension in IMAGE_FORMATS:
+        data = formats.get(name)
+        if not data:
+            continue
+        if name == CF_DIB:
+            data = _dib_to_bmp(data)
+        return extension, data
+    return None
+
+
+def _dib_to_bmp(dib):
+    """Prefix a CF_DIB blob with the BITMAPFILEHEADER that makes it a .bmp file"""
+    header_size, = struct.unpack_from("<I", dib, 0)
+    bit_count, = struct.unpack_from("<H", dib, 14)
+    colors_used, = struct.unpack_from("<I", dib, 32) if header_size >= 36 else (0,)
+    if not colors_used and bit_count <= 8:
+        colors_used = 1 << bit_count
+    compression, = struct.unpack_from("<I", dib, 16)
+    masks = 12 if compression == 3 and header_size == 40 else 0     # BI_BITFIELDS
+    offset = 14 + header_size + masks + colors_used * 4
+    return b"BM" + struct.pack("<IHHI", 14 + len(dib), 0, 0, offset) + dib
+
+
+def _read_windows():
+    import win32clipboard  # pip install pywin32
+
+    payload = {}
+    html_format = win32clipboard.RegisterClipboardFormat("HTML Format")
+    rtf_format = win32clipboard.RegisterClipboardFormat("Rich Text Format")
+    win32clipboard.OpenClipboard()
+    try:
+        if win32clipboard.IsClipboardFormatAvailable(html_format):
+            payload["html"] = cf_html_fragment(win32clipboard.GetClipboardData(html_format))
+        if win32clipboard.IsClipboardFormatAvailable(rtf_format):
+            data = win32clipboard.GetClipboardData(rtf_format)
+            payload["rtf"] = data.decode("latin-1") if isinstance(data, bytes) else data
+        if win32clipboard.IsClipboardFormatAvailable(win32clipboard.CF_UNICODETEXT):
+            payload["text"] = win32clipboard.GetClipboardData(win32clipboard.CF_UNICODETEXT)
+    finally:
+        win32clipboard.CloseClipboard()
+    return payload
+
+
+def cf_html_fragment(data):
+    """Extract the HTML fragment from a Windows ``HTML Format`` clipboard blob"""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    # Offsets in the CF_HTML header are byte offsets into the UTF-8 blob
+    start = re.search(rb"StartFragment:(\d+)", data)
+    end = re.search(rb"EndFragment:(\d+)", data)
+    if start and end:
+        data = data[int(start.group(1)):int(end.group(1))]
+    return data.decode("utf-8", errors="replace")
+
+
+def _formats_windows():
+    import win32clipboard  # pip install pywin32
+
+    formats = {}
+    win32clipboard.OpenClipboard()
+    try:
+        fmt = win32clipboard.EnumClipboardFormats(0)
+        while fmt:
+            try:
+                name = win32clipboard.GetClipboardFormatName(fmt)
+            except Exception:
+                name = str(fmt)         # predefined formats have no name
+            try:
+                data = win32clipboard.GetClipboardData(fmt)
+            except Exception:
+                data = None             # handle-only formats (e.g. CF_BITMAP)
+            if isinstance(data, str):
+                data = data.encode("utf-8")
+            if isinstance(data, bytes):
+                formats[name] = data
+            fmt = win32clipboard.EnumClipboardFormats(fmt)
+    finally:
+        win32clipboard.CloseClipboard()
+    return formats
+
+
+# MIME type per payload key, in the order the tools are asked for them
+_UNIX_TYPES = {"html": "text/html", "rtf": "text/rtf", "text": "text/plain"}
+
+
+def _read_unix():
+    if shutil.which("wl-paste") and os.environ.get("WAYLAND_DISPLAY"):
+        command = ["wl-paste", "--no-newline", "--type"]
+    elif shutil.which("xclip"):
+        command = ["xclip", "-selection", "clipboard", "-o", "-t"]
+    else:
+        return {}
+
+    payload = {}
+    for key, mime in _UNIX_TYPES.items():
+        try:
+            result = subprocess.run(command + [mime], capture_output=True, timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            continue
+        if result.returncode == 0 and result.stdout:
+            payload[key] = result.stdout.decode("utf-8", errors="replace")
+    return payload
+
+
+# X11 selection targets that are not content
+_META_TARGETS = {"TARGETS", "TIMESTAMP", "MULTIPLE", "SAVE_TARGETS", "DELETE", "INCR"}
+
+
+def _formats_unix():
+    if shutil.which("wl-paste") and os.environ.get("WAYLAND_DISPLAY"):
+        list_command = ["wl-paste", "--list-types"]
+        command = ["wl-paste", "--no-newline", "--type"]
+    elif shutil.which("xclip"):
+        list_command = ["xclip", "-selection", "clipboard", "-o", "-t", "TARGETS"]
+        command = ["xclip", "-selection", "clipboard", "-o", "-t"]
+    else:
+        return {}
+
+    try:
+        result = subprocess.run(list_command, capture_output=True, timeout=5)
+    except (OSError, subprocess.TimeoutExpired):
+        return {}
+    formats = {}
+    for mime in result.stdout.decode("utf-8", errors="replace").split():
+        if mime in _META_TARGETS:
+            continue
+        try:
+            data = subprocess.run(command + [mime], capture_output=True, timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            continue
+        if data.returncode == 0 and data.stdout:
+            formats[mime] = data.stdout
+    return formats
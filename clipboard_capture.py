@@ -0,0 +1,255 @@
+"""Snapshot the clipboard once, when the user pastes, and render from the copy.
+
+Word used to read the clipboard itself with ``Paste()`` somewhere inside the
+render, so whatever was copied while Word was starting (or while an earlier
+paste was still rendering) ended up in the PDF.  ``capture`` copies every
+format the clipboard offers (HTML, RTF, text, pictures) into an immutable
+``Snapshot`` at the moment of the paste; renderers then work from the
+snapshot (``Renderer.render_snapshot``), so capturing the next paste never
+waits for the previous render.
+
+``ClipboardWatcher`` is the optional watch mode: a thread that captures a
+snapshot whenever the clipboard content changes.  It stops by itself once
+nobody has drained it for ``CLIP2PDF_WATCH_IDLE`` seconds (default 60), so
+the watcher of a session that was closed does not poll forever.
+``from_browser`` builds a
+snapshot from the formats a browser paste event carries.
+
+``CLIP2PDF_CLIPBOARD_DIR`` replaces the system clipboard with
+``FileClipboard``, a directory holding one file per format
+(``clip.html``, ``clip.rtf``, ``clip.txt``, ``clip.png``, ...), so the whole
+pipeline can be driven on a machine without a clipboard::
+
+    FileClipboard("/tmp/clip").write({"text/html": "<h1>Hi</h1>", "text/plain": "Hi"})
+"""
+import os, time, hashlib, threading
+from collections import deque
+from types import MappingProxyType
+
+import clipboard
+from metrics import span
+
+CLIPBOARD_DIR = os.environ.get("CLIP2PDF_CLIPBOARD_DIR")
+WATCH_INTERVAL = float(os.environ.get("CLIP2PDF_WATCH_INTERVAL", "1.0"))
+WATCH_IDLE = float(os.environ.get("CLIP2PDF_WATCH_IDLE", "60"))
+
+
+class Snapshot:
+    """Every clipboard format at one moment, as read-only bytes"""
+
+    def __init__(self, formats, source="system", captured_at=None):
+        self._formats = MappingProxyType({str(name): bytes(data) for name, data in formats.items()})
+        self._source = source
+        self._captured_at = captured_at or time.time()
+        digest = hashlib.sha256()
+        for name in sorted(self._formats):
+            data = self._formats[name]
+            digest.update(b"\0%d:%s\0%d\0" % (len(name), name.encode("utf-8"), len(data)))
+            digest.update(data)
+        self._key = digest.hexdigest()
+
+    @property
+    def formats(self):
+        """``{format name: bytes}``, read-only"""
+        return self._formats
+
+    @property
+    def source(self):
+        return self._source
+
+    @property
+    def captured_at(self):
+        return self._captured_at
+
+    @property
+    def key(self):
+        """SHA-256 of the content; equal snapshots have equal keys"""
+        return self._key
+
+    @property
+    def size(self):
+        return sum(len(data) for data in self._formats.values())
+
+    def payload(self):
+        """``{"html": str, "rtf": str, "text": str}`` for the formats present"""
+        return clipboard.payload_from_formats(self._formats)
+
+    def image(self):
+        """``(extension, bytes)`` of the best picture, or None"""
+        return clipboard.image_from_formats(self._formats)
+
+    def __bool__(self):
+        return bool(self._formats)
+
+    def __repr__(self):
+        return (f"<Snapshot {self._key[:12]} from {self._source}: "
+                f"{len(self._formats)} format(s), {self.size:,} bytes>")
+
+
+class SystemClipboard:
+    """The real clipboard (``clipboard.read_formats``)"""
+
+    name = "system"
+
+    def read_formats(self):
+        return clipboard.read_formats()
+
+    def sequence(self):
+        """Changes whenever the clipboard does; None when it has to be read to tell"""
+        return clipboard.sequence_number()
+
+
+# File extension <-> format name for the file stand-in
+_EXTENSIONS = {".html": "text/html", ".htm": "text/html", ".rtf": "text/rtf", ".txt": "text/plain",
+               ".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".bmp": "image/bmp"}
+
+
+class FileClipboard:
+    """A directory standing in for the clipboard, one file per format.
+
+    Files with a known extension map to their MIME type (``.html`` to
+    ``text/html``, ...); any other file name is used as the format name.
+    """
+
+    name = "file"
+
+    def __init__(self, directory=CLIPBOARD_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _files(self):
+        for entry in sorted(os.scandir(self.directory), key=lambda e: e.name):
+            if entry.is_file() and not entry.name.startswith(".") and not entry.name.endswith(".tmp"):
+                yield entry
+
+    def read_formats(self):
+        formats = {}
+        for entry in self._files():
+            name = _EXTENSIONS.get(os.path.splitext(entry.name)[1].lower(), entry.name)
+            with open(entry.path, "rb") as f:
+                formats[name] = f.read()
+        return formats
+
+    def sequence(self):
+        return tuple((entry.name, entry.stat().st_mtime_ns, entry.stat().st_size) for entry in self._files())
+
+    def write(self, formats):
+        """Replace the content with ``{format name: str or bytes}`` (like a copy)"""
+        extensions = {mime: extension for extension, mime in reversed(list(_EXTENSIONS.items()))}
+        names = set()
+        for name, data in formats.items():
+            filename = "clip" + extensions[name] if name in extensions else name
+            if isinstance(data, str):
+                data = data.encode("utf-8")
+            temp_path = os.path.join(self.directory, filename + ".tmp")
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, os.path.join(self.directory, filename))
+            names.add(filename)
+        for entry in list(self._files()):
+            if entry.name not in names:
+                os.remove(entry.path)
+
+
+def from_browser(formats, captured_at=None):
+    """Snapshot of a browser paste event's formats (text as str, pictures as base64)"""
+    import base64
+
+    decoded = {}
+    for name, value in formats.items():
+        if name.startswith("image/"):
+            decoded[name] = base64.b64decode(value)
+        else:
+            decoded[name] = value.encode("latin-1" if name == "text/rtf" else "utf-8")
+    return Snapshot(decoded, "browser", captured_at)
+
+
+def get_source():
+    """``FileClipboard`` when ``CLIP2PDF_CLIPBOARD_DIR`` is set, else the system clipboard"""
+    return FileClipboard(CLIPBOARD_DIR) if CLIPBOARD_DIR else SystemClipboard()
+
+
+def capture(source=None):
+    """Snapshot every format on the clipboard (``source`` defaults to ``get_source()``)"""
+    if source is None:
+        source = get_source()
+    with span("capture", source=source.name) as s:
+        snapshot = Snapshot(source.read_formats(), source.name)
+        s.set(formats=len(snapshot.formats), bytes=snapshot.size)
+    return snapshot
+
+
+class ClipboardWatcher(threading.Thread):
+    """Watch mode: capture a snapshot every time the clipboard content changes.
+
+    New snapshots are passed to ``on_capture`` if given, and queued for
+    ``drain`` (at most ``max_pending``, oldest dropped first).  Whatever is
+    on the clipboard when the watcher starts is not captured.  The watcher
+    stops when ``drain`` has not been called for ``idle_timeout`` seconds
+    (0 for never).
+    """
+
+    def __init__(self, source=None, interval=WATCH_INTERVAL, on_capture=None, max_pending=20,
+                 idle_timeout=WATCH_IDLE):
+        super().__init__(name="clipboard-watcher", daemon=True)
+        self.source = source or get_source()
+        self.interval = interval
+        self.on_capture = on_capture
+        self.idle_timeout = idle_timeout
+        self._pending = deque(maxlen=max_pending)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._sequence = None
+        self._last_key = None
+        self._drained = time.monotonic()
+
+    def run(self):
+        self.poll(emit=False)
+        while not self._stopped.wait(self.interval):
+            if self.idle_timeout and time.monotonic() - self._drained > self.idle_timeout:
+                print(f"Clipboard watcher not drained for {self.idle_timeout:g}s, stopping")
+                self._stopped.set()
+                break
+            self.poll()
+
+    def poll(self, emit=True):
+        """Check the clipboard once; returns the new snapshot or None"""
+        try:
+            sequence = self.source.sequence()
+            if sequence is not None and sequence == self._sequence:
+                return None                 # cheap check: nothing changed
+            self._sequence = sequence
+            # Not ``capture``: polls that find nothing new are not worth a span
+            snapshot = Snapshot(self.source.read_formats(), self.source.name)
+        except Exception as watch_error:
+            print(f"Clipboard watch error: {watch_error}")
+            return None
+        if snapshot.key == self._last_key:
+            return None
+        self._last_key = snapshot.key
+        if not snapshot or not emit:
+            return None
+        print(f"Clipboard changed: {snapshot!r}")
+        with self._lock:
+            self._pending.append(snapshot)
+        if self.on_capture is not None:
+            try:
+                self.on_capture(snapshot)
+            except Exception as callback_error:
+                print(f"Clipboard capture callback failed: {callback_error}")
+        return snapshot
+
+    def drain(self):
+        """Snapshots captured since the last call, oldest first"""
+        with self._lock:
+            snapshots = list(self._pending)
+            self._pending.clear()
+            self._drained = time.monotonic()
+        return snapshots
+
+    @property
+    def stopped(self):
+        return self._stopped.is_set()
+
+    def stop(self):
+        self._stopped.set()
@@ -0,0 +1,253 @@
+"""Working documents kept as an ordered manifest of fragment PDFs.
+
+Every paste renders one small fragment PDF into the document's directory;
+appending, prepending or inserting it only edits ``manifest.json``.  The
+complete PDF is assembled lazily by ``assemble()`` when it is needed for
+display or download, and the result is cached: when fragments were only
+added at the ends since the last assembly, the cached file is extended with
+incremental updates instead of being rebuilt.
+
+Layout of a document directory::
+
+    NotebookLM_20250606_190145_3f9c21ab/
+        manifest.json
+        fragment_0001.pdf
+        fragment_0002.pdf
+        NotebookLM_20250606_190145_3f9c21ab.pdf   <- assembled output
+
+Fragments, the manifest and rebuilt assemblies are written to a temporary
+file and renamed into place (``pdf_output``), so they are complete whenever
+they exist.
+"""
+import os, json, tempfile
+from contextlib import contextmanager
+
+DOCUMENTS_DIR = os.path.join(tempfile.gettempdir(), "clip2pdf_documents")
+MANIFEST_NAME = "manifest.json"
+
+
+class FragmentDocument:
+    """An ordered list of fragment PDFs plus a cached assembly"""
+
+    def __init__(self, directory, data):
+        self.directory = directory
+        self.name = data["name"]
+        self.prefix = data.get("prefix")
+        self.fragments = data["fragments"]          # [{"file", "pages", "bytes", "mode"}]
+        self.next_fragment = data.get("next_fragment", 1)
+        self.assembled = data.get("assembled")      # {"file", "fragments", "bytes"}
+
+    @classmethod
+    def create(cls, prefix, root=DOCUMENTS_DIR):
+        """Start a new, empty document named ``{prefix}_{timestamp}_{random}``"""
+        from pdf_output import unique_name
+
+        os.makedirs(root, exist_ok=True)
+        while True:
+            name = unique_name(prefix)
+            directory = os.path.join(root, name)
+            try:
+                os.mkdir(directory)             # never shares another session's directory
+                break
+            except FileExistsError:
+                continue
+        document = cls(directory, {"name": name, "prefix": prefix, "fragments": []})
+        document.save()
+        return document
+
+    @classmethod
+    def load(cls, directory):
+        with open(os.path.join(directory, MANIFEST_NAME), encoding="utf-8") as f:
+            return cls(directory, json.load(f))
+
+    def reload(self):
+        """Re-read the manifest: background jobs may have changed it since ``load``"""
+        with open(os.path.join(self.directory, MANIFEST_NAME), encoding="utf-8") as f:
+            data = json.load(f)
+        self.fragments = data["fragments"]
+        self.next_fragment = data.get("next_fragment", 1)
+        self.assembled = data.get("assembled")
+
+    @contextmanager
+    def _modify(self):
+        """Read-modify-write of the manifest under the document's lock, from its current state"""
+        from pdf_output import locked
+
+        with locked(self.directory):
+            self.reload()
+            yield
+            self.save()
+
+    def _data(self):
+        return {
+            "name": self.name,
+            "prefix": self.prefix,
+            "fragments": self.fragments,
+            "next_fragment": self.next_fragment,
+            "assembled": self.assembled,
+        }
+
+    def save(self):
+        """Write the manifest as it is in memory; edits go through ``_modify``"""
+        from pdf_output import temp_path
+
+        data = self._data()
+
+        path = os.path.join(self.directory, MANIFEST_NAME)
+        temp = temp_path(path, suffix=".tmp")
+        try:
+            with open(temp, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2)
+            os.replace(temp, path)
+        finally:
+            if os.path.exists(temp):
+                os.remove(temp)
+
+    @property
+    def page_count(self):
+        return sum(fragment["pages"] for fragment in self.fragments)
+
+    @property
+    def output_path(self):
+        return os.path.join(self.directory, f"{self.name}.pdf")
+
+    def new_fragment_path(self):
+        """Path a renderer should write the next fragment to"""
+        with self._modify():
+            path = os.path.join(self.directory, f"fragment_{self.next_fragment:04d}.pdf")
+            self.next_fragment += 1
+        return path
+
+    def add(self, fragment_path, mode="append", index=None):
+        """Add a rendered fragment; ``mode`` is append, prepend or insert (at ``index``)"""
+        from pypdf import PdfReader
+
+        entry = {
+            "file": os.path.basename(fragment_path),
+            "pages": len(PdfReader(fragment_path).pages),
+            "bytes": os.path.getsize(fragment_path),
+            "mode": mode,
+        }
+        with self._modify():
+            if mode == "prepend":
+                self.fragments.insert(0, entry)
+            elif mode == "insert" and index is not None:
+                self.fragments.insert(max(0, min(index, len(self.fragments))), entry)
+            else:
+                self.fragments.append(entry)
+
+    def assemble(self, linearize=None):
+        """Path of the complete PDF, (re)building it only if the manifest changed.
+
+        ``linearize=True`` also linearizes it right away.  Otherwise it is
+        not: every incremental extension would undo it and make each paste
+        rewrite the whole file.  ``linearize`` applies ``CLIP2PDF_LINEARIZE``
+        afterwards, from a background job.
+        """
+        from pdf_output import locked
+
+        # One assembler at a time (threads or processes): the file is extended in place
+        with locked(self.directory):
+            return self._assemble(linearize)
+
+    def _assemble(self, linearize):
+        from pdf_incremental import append_incremental
+        from pdf_builder import concatenate_pdfs
+        from pdf_output import atomic_pdf
+
+        self.reload()                               # pastes may have landed since ``load``
+        files = [fragment["file"] for fragment in self.fragments]
+        if not files:
+            raise ValueError("Document has no fragments yet")
+        outfile = self.output_path
+        cached = self.assembled
+        if cached and os.path.exists(outfile) and os.path.getsize(outfile) == cached["bytes"]:
+            done = cached["fragments"]
+            start = _find_run(files, done)
+            if start is not None and len(done) == len(files):
+                return outfile                      # nothing changed
+            if start is not None:
+                # Only additions at the ends: extend the cached file in place
+                # Fonts and images already in the file are referenced, not copied
+                shared = cached.get("shared", {})
+                try:
+                    for name in reversed(files[:start]):
+                        append_incremental(outfile, self._path(name), "prepend", shared)
+                    for name in files[start + len(done):]:
+                        append_incremental(outfile, self._path(name), "append", shared)
+                    self._remember(files, self._optimize(outfile, shared, linearize))
+                    return outfile
+                except Exception as incremental_error:
+                    print(f"Incremental assembly failed ({incremental_error}), rebuilding")
+
+        print(f"Assembling {len(files)} fragment(s) into {outfile}")
+        shared = {}
+        with atomic_pdf(outfile, replace=True) as temp_outfile:
+            concatenate_pdfs([self._path(name) for name in files], temp_outfile, shared)
+        self._remember(files, self._optimize(outfile, shared, linearize))
+        return outfile
+
+    def linearize(self):
+        """Linearize the assembled PDF if ``CLIP2PDF_LINEARIZE`` asks for it (a background job's work).
+
+        Returns the path when the file was rewritten, else None (not wanted,
+        already linearized, or the assembly is out of date).
+        """
+        from pdf_optimize import maybe_linearize
+        from pdf_incremental import resource_index
+        from pdf_output import locked
+
+        with locked(self.directory):
+            self.reload()
+            outfile = self.output_path
+            cached = self.assembled
+            if not cached or not os.path.exists(outfile) or os.path.getsize(outfile) != cached["bytes"]:
+                return None                         # the next assembly comes first
+            if maybe_linearize(outfile) is None:
+                return None
+            try:
+                shared = resource_index(outfile)    # objects were renumbered
+            except Exception as index_error:
+                print(f"Could not index shared resources ({index_error})")
+                shared = {}
+            self._remember(cached["fragments"], shared)
+            return outfile
+
+    def _optimize(self, outfile, shared, linearize=None):
+        """Run the document optimizer if configured (and the linearizer if forced); returns the valid hash index"""
+        from pdf_optimize import maybe_optimize, maybe_linearize
+        from pdf_incremental import resource_index
+
+        optimized = maybe_optimize(outfile, "document")
+        linearized = maybe_linearize(outfile, True) if linearize else None
+        if optimized is None and linearized is None:
+            return shared
+        # Objects were renumbered
+        try:
+            return resource_index(outfile)
+        except Exception as index_error:
+            print(f"Could not index shared resources ({index_error})")
+            return {}
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _remember(self, files, shared):
+        """Record the assembly; the fragment list is left as the manifest has it now"""
+        assembled = {
+            "file": os.path.basename(self.output_path),
+            "fragments": list(files),
+            "bytes": os.path.getsize(self.output_path),
+            "shared": shared,           # content hash -> object number in the file
+        }
+        with self._modify():
+            self.assembled = assembled
+
+
+def _find_run(items, run):
+    """Index where ``run`` occurs as a contiguous slice of ``items``, or None"""
+    # Fragment file names are unique, so the run can only start at one place
+    if not run or run[0] not in items:
+        return None
+    start = items.index(run[0])
+    return start if items[start:start + len(run)] == run else None
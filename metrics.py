@@ -0,0 +1,161 @@
+"""Timing spans, Prometheus metrics and structured logs for the render pipeline.
+
+Wrap a stage in ``span``::
+
+    with span("export", renderer="word") as s:
+        doc.ExportAsFixedFormat(...)
+        s.set(pages=pages, bytes=os.path.getsize(outfile))
+
+Every span feeds a counter and a latency histogram labelled with its stage
+(plus page and byte totals when the span carries them) and logs one JSON
+line with its duration and fields at DEBUG level.  ``REGISTRY.render()`` returns the
+metrics in the Prometheus text format; ``pdf_server`` serves it at
+``/metrics``.
+
+Per-item events inside loops go through ``log_sampled``, which only logs the
+first, the last and every ``CLIP2PDF_LOG_SAMPLE``-th item (default 100), at
+INFO level.
+
+Logs go to the ``clip2pdf`` logger and are off unless the application
+configures ``logging``, or ``CLIP2PDF_LOG`` is ``info`` (or ``1``: the
+sampled events) or ``debug`` (every span too), which prints them to stdout.
+Metrics are always kept.
+"""
+import os, sys, json, time, logging, threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+LOG_LEVEL = {"1": logging.INFO, "info": logging.INFO,
+             "debug": logging.DEBUG}.get(os.environ.get("CLIP2PDF_LOG", "0").lower())
+LOG_SAMPLE = max(1, int(os.environ.get("CLIP2PDF_LOG_SAMPLE", "100")))
+
+# Latency buckets in seconds, from a page copy to a cold Word start
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+logger = logging.getLogger("clip2pdf")
+if LOG_LEVEL is not None:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+
+
+def log(event, level=logging.DEBUG, **fields):
+    """Log one structured (JSON) line at ``level``"""
+    if logger.isEnabledFor(level):
+        logger.log(level, json.dumps(dict(event=event, ts=round(time.time(), 3), **fields), default=str))
+
+
+def log_sampled(event, index, total=None, **fields):
+    """``log`` at INFO for per-item events: only the first, last and every N-th item"""
+    if index == 0 or (total is not None and index == total - 1) or (index + 1) % LOG_SAMPLE == 0:
+        log(event, logging.INFO, index=index, total=total, **fields)
+
+
+class Registry:
+    """Counters and histograms keyed by metric name and label values"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counters = {}             # (name, labels) -> value
+        self._histograms = {}           # (name, labels) -> [bucket counts, sum, count]
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, help="", **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._help.setdefault(name, ("counter", help))
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, help="", **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._help.setdefault(name, ("histogram", help))
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for name in sorted(self._help):
+                kind, help = self._help[name]
+                if help:
+                    lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                if kind == "counter":
+                    for (metric, labels), value in sorted(self._counters.items()):
+                        if metric == name:
+                            lines.append(f"{name}{_labels(labels)} {_number(value)}")
+                    continue
+                for (metric, labels), (counts, total, count) in sorted(self._histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, bucket in zip(self.buckets, counts):
+                        cumulative += bucket
+                        lines.append(f"{name}_bucket{_labels(labels + (('le', _number(bound)),))} {cumulative}")
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {count}")
+                    lines.append(f"{name}_sum{_labels(labels)} {_number(total)}")
+                    lines.append(f"{name}_count{_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+REGISTRY = Registry()
+
+
+class Span:
+    """Fields of a running span; ``set`` adds to them"""
+
+    def __init__(self, stage, fields):
+        self.stage = stage
+        self.fields = fields
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+
+@contextmanager
+def span(stage, registry=REGISTRY, **fields):
+    """Time the enclosed block as ``stage``; record metrics and log it on exit"""
+    current = Span(stage, dict(fields))
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield current
+    except BaseException as error:
+        outcome = "error"
+        current.fields["error"] = str(error)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        registry.inc("clip2pdf_stage_total", help="Pipeline stages run", stage=stage, outcome=outcome)
+        registry.observe("clip2pdf_stage_seconds", elapsed, help="Pipeline stage latency", stage=stage)
+        for field in ("pages", "bytes"):
+            if isinstance(current.fields.get(field), (int, float)):
+                registry.inc(f"clip2pdf_stage_{field}_total", current.fields[field],
+                             help=f"Document {field} handled by pipeline stages", stage=stage)
+        log("span", stage=stage, outcome=outcome, seconds=round(elapsed, 6), **current.fields)
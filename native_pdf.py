@@ -0,0 +1,372 @@
+"""Pure-Python HTML/RTF to PDF engine.
+
+This is the renderer used where Word is not available.  It does not try to be
+a browser: clipboard HTML and RTF are reduced to a flow of headings,
+paragraphs, list items and preformatted blocks, which are laid out on A4
+pages with the standard PDF fonts.  No third-party packages are needed.
+"""
+import os, re, zlib, zipfile
+from html.parser import HTMLParser
+from xml.etree import ElementTree
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842      # A4 in points
+MARGIN = 56
+
+# (font resource, size) for every block style
+STYLES = {
+    "h1": ("F2", 18),
+    "h2": ("F2", 15),
+    "h3": ("F2", 13),
+    "p": ("F1", 11),
+    "li": ("F1", 11),
+    "pre": ("F3", 9.5),
+}
+FONTS = {"F1": "Helvetica", "F2": "Helvetica-Bold", "F3": "Courier"}
+LIST_INDENT = 14
+
+# Glyph widths (1/1000 em) for WinAnsi characters 32..126
+_HELVETICA = [
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+]
+_HELVETICA_BOLD = [
+    278, 333, 474, 556, 556, 889, 722, 238, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 333, 333, 584, 584, 584, 611,
+    975, 722, 722, 722, 722, 667, 611, 778, 722, 278, 556, 722, 611, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 333, 278, 333, 584, 556,
+    333, 556, 611, 556, 611, 556, 333, 611, 611, 278, 278, 556, 278, 889, 611, 611,
+    611, 611, 389, 556, 333, 611, 556, 778, 556, 556, 500, 389, 280, 389, 584,
+]
+_WIDTHS = {"F1": _HELVETICA, "F2": _HELVETICA_BOLD}
+
+
+def text_width(text, font, size):
+    """Width of ``text`` in points when set in ``font`` at ``size``"""
+    if font == "F3":
+        return len(text) * 600 * size / 1000
+    widths = _WIDTHS[font]
+    total = 0
+    for ch in text:
+        code = ord(ch)
+        total += widths[code - 32] if 32 <= code <= 126 else 556
+    return total * size / 1000
+
+
+# ---------------------------------------------------------------------------
+# Payload parsing
+# ---------------------------------------------------------------------------
+
+_BLOCK_TAGS = {"p", "div", "section", "article", "blockquote", "tr", "table", "ul", "ol",
+               "header", "footer", "h4", "h5", "h6", "dt", "dd", "figure", "hr"}
+_SKIP_TAGS = {"script", "style", "head", "title", "noscript"}
+
+
+class _BlockParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.blocks = []
+        self.style = "p"
+        self.parts = []
+        self.skip = 0
+        self.pre = 0
+
+    def flush(self):
+        text = "".join(self.parts)
+        if not self.pre:
+            text = re.sub(r"[ \t\r\f\v]+", " ", text)
+            text = "\n".join(line.strip() for line in text.split("\n")).strip()
+        else:
+            text = text.strip("\n")
+        if text:
+            self.blocks.append((self.style, text))
+        self.parts = []
+        self.style = "p"
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIP_TAGS:
+            self.skip += 1
+        elif tag in ("h1", "h2", "h3"):
+            self.flush()
+            self.style = tag
+        elif tag == "li":
+            self.flush()
+            self.style = "li"
+        elif tag == "pre":
+            self.flush()
+            self.style = "pre"
+            self.pre += 1
+        elif tag in _BLOCK_TAGS:
+            self.flush()
+        elif tag == "br":
+            self.parts.append("\n")
+        elif tag in ("td", "th"):
+            self.parts.append("   ")
+
+    def handle_endtag(self, tag):
+        if tag in _SKIP_TAGS:
+            self.skip = max(0, self.skip - 1)
+        elif tag == "pre":
+            self.flush()
+            self.pre = max(0, self.pre - 1)
+        elif tag in ("h1", "h2", "h3", "li") or tag in _BLOCK_TAGS:
+            self.flush()
+
+    def handle_data(self, data):
+        if not self.skip:
+            self.parts.append(data if self.pre else data.replace("\n", " "))
+
+
+def html_to_blocks(html):
+    """Reduce an HTML fragment to ``[(style, text), ...]`` blocks"""
+    parser = _BlockParser()
+    parser.feed(html)
+    parser.close()
+    parser.flush()
+    return parser.blocks
+
+
+_RTF_DESTINATIONS = {"fonttbl", "colortbl", "stylesheet", "info", "pict", "header", "footer",
+                     "headerl", "headerr", "footerl", "footerr", "listtable",
+                     "listoverridetable", "rsidtbl", "generator", "xmlnstbl", "themedata",
+                     "colorschememapping", "datastore", "latentstyles", "object"}
+_RTF_TOKEN = re.compile(r"\\([a-z]{1,32})(-?\d{1,10})? ?|\\'([0-9a-f]{2})|\\([^a-z])|([{}])|[\r\n]+|(.)",
+                        re.IGNORECASE | re.DOTALL)
+
+
+def rtf_to_text(rtf):
+    """Strip RTF markup down to its plain text, keeping paragraph breaks"""
+    stack = []
+    skip = False            # inside an ignorable destination
+    uc_skip = 1             # characters to drop after a \uN escape
+    pending_skip = 0
+    out = []
+    for word, arg, hexcode, symbol, brace, char in _RTF_TOKEN.findall(rtf):
+        if brace == "{":
+            stack.append((skip, uc_skip))
+        elif brace == "}":
+            if stack:
+                skip, uc_skip = stack.pop()
+        elif symbol:
+            if symbol == "*":
+                skip = True
+            elif symbol in "\\{}" and not skip:
+                out.append(symbol)
+            elif symbol == "~" and not skip:
+                out.append("\xa0")
+        elif word:
+            if word in _RTF_DESTINATIONS:
+                skip = True
+            elif word == "uc":
+                uc_skip = int(arg or 1)
+            elif skip:
+                pass
+            elif word in ("par", "line", "row"):
+                out.append("\n")
+            elif word in ("tab", "cell"):
+                out.append("\t")
+            elif word == "u":
+                code = int(arg)
+                out.append(chr(code + 65536 if code < 0 else code))
+                pending_skip = uc_skip
+        elif hexcode:
+            if pending_skip:
+                pending_skip -= 1
+            elif not skip:
+                out.append(bytes([int(hexcode, 16)]).decode("cp1252", errors="replace"))
+        elif char:
+            if pending_skip:
+                pending_skip -= 1
+            elif not skip:
+                out.append(char)
+    return "".join(out)
+
+
+def text_to_blocks(text):
+    """Split plain text into paragraph blocks on blank lines"""
+    paragraphs = re.split(r"\n\s*\n", text.replace("\r\n", "\n"))
+    return [("p", p.strip("\n")) for p in paragraphs if p.strip()]
+
+
+def payload_to_blocks(payload):
+    """Pick the richest format in a clipboard payload and reduce it to blocks"""
+    if payload.get("html"):
+        blocks = html_to_blocks(payload["html"])
+        if blocks:
+            return blocks
+    if payload.get("rtf"):
+        blocks = text_to_blocks(rtf_to_text(payload["rtf"]))
+        if blocks:
+            return blocks
+    return text_to_blocks(payload.get("text", ""))
+
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+def docx_to_blocks(path):
+    """Paragraphs of a .docx file as blocks; Heading 1-3 and list paragraphs keep their style"""
+    with zipfile.ZipFile(path) as docx:
+        root = ElementTree.fromstring(docx.read("word/document.xml"))
+    blocks = []
+    for paragraph in root.iter(_W + "p"):
+        parts = []
+        for node in paragraph.iter():
+            if node.tag == _W + "t" and node.text:
+                parts.append(node.text)
+            elif node.tag == _W + "tab":
+                parts.append("\t")
+            elif node.tag in (_W + "br", _W + "cr"):
+                parts.append("\n")
+        text = "".join(parts).strip()
+        if not text:
+            continue
+        style = "p"
+        properties = paragraph.find(_W + "pPr")
+        if properties is not None:
+            style_node = properties.find(_W + "pStyle")
+            name = style_node.get(_W + "val", "") if style_node is not None else ""
+            if name in ("Heading1", "Title"):
+                style = "h1"
+            elif name == "Heading2":
+                style = "h2"
+            elif name.startswith("Heading"):
+                style = "h3"
+            elif properties.find(_W + "numPr") is not None:
+                style = "li"
+        blocks.append((style, text))
+    return blocks
+
+
+def file_to_blocks(path):
+    """Blocks for an .html/.htm, .rtf, .docx or plain text file"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".docx":
+        return docx_to_blocks(path)
+    with open(path, "rb") as f:
+        data = f.read()
+    if extension == ".rtf":
+        return text_to_blocks(rtf_to_text(data.decode("latin-1")))
+    text = data.decode("utf-8", errors="replace")
+    if extension in (".html", ".htm"):
+        return html_to_blocks(text)
+    return text_to_blocks(text)
+
+
+# ---------------------------------------------------------------------------
+# Layout and PDF output
+# ---------------------------------------------------------------------------
+
+def _wrap(text, font, size, width):
+    lines = []
+    for raw in text.split("\n"):
+        if font == "F3":
+            # Preformatted text keeps its spacing and breaks at the margin
+            per_line = max(1, int(width // (600 * size / 1000)))
+            raw = raw.expandtabs(4)
+            lines.extend(raw[i:i + per_line] for i in range(0, max(len(raw), 1), per_line))
+            continue
+        line = ""
+        for word in raw.split(" "):
+            candidate = f"{line} {word}" if line else word
+            if text_width(candidate, font, size) <= width:
+                line = candidate
+                continue
+            if line:
+                lines.append(line)
+            # Break words that are wider than the whole line, in one pass
+            if text_width(word, font, size) > width:
+                start, used = 0, 0
+                for i, ch in enumerate(word):
+                    advance = text_width(ch, font, size)
+                    if used + advance > width and i > start:
+                        lines.append(word[start:i])
+                        start, used = i, 0
+                    used += advance
+                word = word[start:]
+            line = word
+        lines.append(line)
+    return lines
+
+
+def layout(blocks):
+    """Lay blocks out on pages; returns one list of ``(font, size, x, y, text)`` per page"""
+    pages = [[]]
+    y = PAGE_HEIGHT - MARGIN
+    for style, text in blocks:
+        font, size = STYLES.get(style, STYLES["p"])
+        leading = size * 1.35
+        indent = LIST_INDENT if style == "li" else 0
+        if style.startswith("h"):
+            y -= size * 0.5             # extra space above headings
+        for i, line in enumerate(_wrap(text, font, size, PAGE_WIDTH - 2 * MARGIN - indent)):
+            if y - leading < MARGIN:
+                pages.append([])
+                y = PAGE_HEIGHT - MARGIN
+            y -= leading
+            if style == "li" and i == 0:
+                pages[-1].append((font, size, MARGIN + 2, y, "\u2022"))
+            pages[-1].append((font, size, MARGIN + indent, y, line))
+        y -= size * 0.5                 # paragraph spacing
+    return pages
+
+
+def _pdf_string(text):
+    data = text.encode("cp1252", errors="replace")
+    return b"(" + data.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+
+def _content_stream(lines):
+    ops = []
+    for font, size, x, y, text in lines:
+        ops.append(b"BT /%s %g Tf %.2f %.2f Td %s Tj ET" % (font.encode(), size, x, y, _pdf_string(text)))
+    return zlib.compress(b"\n".join(ops))
+
+
+def write_pdf(blocks, outfile, title=None):
+    """Write ``blocks`` as a PDF to ``outfile``; returns the page count"""
+    pages = layout(blocks)
+    # Object numbers: 1 catalog, 2 page tree, 3-5 fonts, 6 info, then page/content pairs
+    objects = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+    }
+    font_refs = []
+    for number, (resource, base_font) in enumerate(FONTS.items(), start=3):
+        objects[number] = (b"<< /Type /Font /Subtype /Type1 /BaseFont /%s /Encoding /WinAnsiEncoding >>"
+                           % base_font.encode())
+        font_refs.append(b"/%s %d 0 R" % (resource.encode(), number))
+    info = b"<< /Producer (richtext2pdf native renderer)"
+    if title:
+        info += b" /Title " + _pdf_string(title)
+    objects[6] = info + b" >>"
+
+    kids = []
+    for i, lines in enumerate(pages):
+        page_number, content_number = 7 + 2 * i, 8 + 2 * i
+        kids.append(b"%d 0 R" % page_number)
+        objects[page_number] = (
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] "
+            b"/Resources << /Font << %s >> >> /Contents %d 0 R >>"
+            % (PAGE_WIDTH, PAGE_HEIGHT, b" ".join(font_refs), content_number))
+        stream = _content_stream(lines)
+        objects[content_number] = (b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(stream)
+                                   + stream + b"\nendstream")
+    objects[2] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(kids), len(kids))
+
+    with open(outfile, "wb") as f:
+        f.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        offsets = {}
+        for number in sorted(objects):
+            offsets[number] = f.tell()
+            f.write(b"%d 0 obj\n" % number + objects[number] + b"\nendobj\n")
+        xref_offset = f.tell()
+        size = max(objects) + 1
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % size)
+        for number in range(1, size):
+            f.write(b"%010d 00000 n \n" % offsets[number])
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R /Info 6 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+                % (size, xref_offset))
+    return len(pages)
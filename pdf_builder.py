@@ -0,0 +1,250 @@
+"""Build PDFs from clipboard content: render a fragment and merge it in."""
+from renderers import get_renderer
+from metrics import span, log_sampled
+from pdf_optimize import maybe_optimize, maybe_linearize
+from pdf_images import downsample_images
+from pdf_output import unique_name, atomic_pdf, verify_pdf, locked, OUTPUT_DIR
+
+_default_renderer = None
+
+
+def default_renderer():
+    """Renderer used when ``create_pdf`` is called without one, created once"""
+    global _default_renderer
+    if _default_renderer is None:
+        from render_cache import cached
+
+        _default_renderer = cached(get_renderer())
+    return _default_renderer
+
+
+def finish_fragment(path):
+    """Post-process a freshly rendered fragment: shrink its images, then optimize it"""
+    import os
+
+    try:
+        downsample_images(path)
+    except Exception as image_error:
+        print(f"Image downsampling of {os.path.basename(path)} skipped: {image_error}")
+        if os.path.exists(path + ".img"):
+            os.remove(path + ".img")
+    maybe_optimize(path, "fragment")
+
+
+def create_pdf(prefix="clipboard", mode="new", existing_pdf_path=None, renderer=None, linearize=None):
+    """Render the clipboard to a new PDF, or append/prepend it to an existing one.
+
+    ``renderer`` is any ``renderers.Renderer``; the configured default backend
+    is created when it is omitted.  ``linearize`` forces linearized ("fast web
+    view") output on or off; by default ``CLIP2PDF_LINEARIZE`` decides.
+    Returns the path of the written PDF; new files get a unique name and
+    only appear once complete and verified.
+
+    A standalone entry point for scripts: the app itself pastes through
+    ``add_clipboard_fragment`` and ``manifest.FragmentDocument.assemble``.
+    """
+    import os, tempfile
+
+    if renderer is None:
+        renderer = default_renderer()
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    
+    try:
+        if mode == "new" or not existing_pdf_path or not os.path.exists(existing_pdf_path):
+            # Create new PDF
+            outfile = os.path.join(OUTPUT_DIR, unique_name(prefix) + ".pdf")
+            
+            with atomic_pdf(outfile) as temp_outfile:
+                renderer.render(
+                    temp_outfile,
+                    "No content found in clipboard. This is a test PDF.",
+                    "Failed to paste clipboard content. This is a test PDF.")
+                finish_fragment(temp_outfile)
+                maybe_linearize(temp_outfile, linearize)
+            
+        else:
+            # Name used if the merged PDF has to be rewritten as a new file
+            outfile = os.path.join(OUTPUT_DIR, unique_name(f"{prefix}_{mode}") + ".pdf")
+            
+            # Create temporary PDF with new clipboard content
+            handle, temp_pdf_path = tempfile.mkstemp(prefix="temp_clipboard_", suffix=".pdf", dir=OUTPUT_DIR)
+            os.close(handle)
+            
+            try:
+                # Render the new clipboard content
+                renderer.render(
+                    temp_pdf_path,
+                    "No new content found in clipboard.",
+                    "Failed to paste new clipboard content.")
+                
+                # Verify temporary PDF was created
+                try:
+                    verify_pdf(temp_pdf_path)
+                except Exception as verify_error:
+                    raise Exception(f"Failed to create temporary PDF with new content: {verify_error}")
+                finish_fragment(temp_pdf_path)
+                
+                # Validate existing PDF
+                if not os.path.exists(existing_pdf_path) or os.path.getsize(existing_pdf_path) == 0:
+                    raise Exception("Existing PDF file is invalid or empty")
+                
+                try:
+                    # One writer at a time per document
+                    with locked(existing_pdf_path):
+                        try:
+                            # Incremental update: only the new pages are written, at
+                            # the end of the existing file
+                            from pdf_incremental import append_incremental
+                            added = append_incremental(existing_pdf_path, temp_pdf_path, mode)
+                            outfile = existing_pdf_path
+                            print(f"Added {added} new page(s) ({mode} mode, incremental update)")
+                        except Exception as incremental_error:
+                            # e.g. encrypted or damaged input, fall back to rewriting everything
+                            print(f"Incremental update failed ({incremental_error}), rewriting the whole PDF")
+                            with atomic_pdf(outfile) as temp_outfile:
+                                merge_pdfs(existing_pdf_path, temp_pdf_path, temp_outfile, mode)
+                        maybe_optimize(outfile, "document")
+                        maybe_linearize(outfile, linearize)
+                    
+                except Exception as merge_error:
+                    print(f"PDF merge error: {merge_error}")
+                    raise Exception(f"Failed to merge PDFs: {merge_error}")
+            
+            finally:
+                # Clean up temporary file
+                try:
+                    with span("cleanup"):
+                        if os.path.exists(temp_pdf_path):
+                            os.remove(temp_pdf_path)
+                            print("Temporary PDF cleaned up")
+                except Exception as cleanup_error:
+                    print(f"Warning: Could not clean up temporary file: {cleanup_error}")
+        
+        print("Saved:", outfile)
+        return outfile
+        
+    except Exception as e:
+        print(f"Error in create_pdf: {e}")
+        raise e
+
+
+def add_clipboard_fragment(document, mode="append", renderer=None, index=None, checkpoint=None,
+                           snapshot=None):
+    """Render the clipboard as a new fragment of a ``manifest.FragmentDocument``.
+
+    Only the fragment is rendered and the manifest edited; the full PDF is
+    assembled later by ``document.assemble()``.  ``snapshot`` (a
+    ``clipboard_capture.Snapshot``) is rendered instead of the live clipboard
+    when given.  ``checkpoint`` is called between rendering and editing the
+    manifest; if it raises (e.g. a cancelled background job), the fragment
+    is discarded.
+    """
+    import os
+
+    if renderer is None:
+        renderer = default_renderer()
+    
+    fragment_path = document.new_fragment_path()
+    if document.fragments:
+        texts = ("No new content found in clipboard.",
+                 "Failed to paste new clipboard content.")
+    else:
+        texts = ("No content found in clipboard. This is a test PDF.",
+                 "Failed to paste clipboard content. This is a test PDF.")
+    # The fragment appears under its name only once it is a valid PDF
+    with atomic_pdf(fragment_path) as temp_path:
+        if snapshot is not None:
+            renderer.render_snapshot(snapshot, temp_path, *texts)
+        else:
+            renderer.render(temp_path, *texts)
+        finish_fragment(temp_path)
+    
+    if checkpoint is not None:
+        try:
+            checkpoint()
+        except Exception:
+            os.remove(fragment_path)
+            raise
+    
+    document.add(fragment_path, mode, index)
+    print(f"Fragment {os.path.basename(fragment_path)} added ({mode} mode)")
+    return fragment_path
+
+
+def merge_pdfs(existing_pdf_path, new_pdf_path, outfile, mode="append"):
+    """Write ``existing_pdf_path`` and ``new_pdf_path`` into one new file.
+
+    The full-rewrite path: every page is copied.  ``mode="prepend"`` puts the
+    new pages first.
+    """
+    if mode == "prepend":
+        print("Adding new content first (prepend mode)")
+        concatenate_pdfs([new_pdf_path, existing_pdf_path], outfile)
+    else:
+        print("Adding existing content first (append mode)")
+        concatenate_pdfs([existing_pdf_path, new_pdf_path], outfile)
+
+
+def concatenate_pdfs(paths, outfile, shared=None):
+    """Write the pages of every PDF in ``paths``, in order, to ``outfile``.
+
+    Identical fonts and images across the inputs are stored once.  When
+    ``shared`` is a dict it receives the result's content-hash index (see
+    ``pdf_incremental.resource_index``).
+    """
+    import os
+
+    try:
+        from pdf_incremental import merge_files
+        pages = merge_files(paths, outfile, shared)
+        print(f"Merged {pages} page(s) from {len(paths)} PDF(s): {outfile}")
+        return
+    except Exception as merge_error:
+        # e.g. encrypted input, or pypdf missing: PdfWriter (or PyPDF2) below
+        print(f"Direct merge failed ({merge_error}), merging with PdfWriter")
+
+    try:
+        from pypdf import PdfReader, PdfWriter
+    except ImportError:
+        try:
+            from PyPDF2 import PdfReader, PdfWriter
+        except ImportError:
+            raise ImportError("Please install pypdf or PyPDF2: pip install pypdf")
+    
+    # Create merged PDF
+    writer = PdfWriter()
+    
+    with span("pdf_read", files=len(paths)) as s:
+        readers = [PdfReader(path) for path in paths]
+        s.set(pages=sum(len(reader.pages) for reader in readers),
+              bytes=sum(os.path.getsize(path) for path in paths))
+    
+    with span("merge", files=len(paths)) as s:
+        for path, reader in zip(paths, readers):
+            count = len(reader.pages)
+            for i, page in enumerate(reader.pages):
+                writer.add_page(page)
+                log_sampled("page_added", i, count, file=os.path.basename(path))
+        s.set(pages=len(writer.pages))
+    
+    # Keep one of every identical object where pypdf can
+    if hasattr(writer, "compress_identical_objects"):
+        with span("dedupe", pages=len(writer.pages)):
+            writer.compress_identical_objects()
+    
+    # Save merged PDF
+    with span("write", pages=len(writer.pages)) as s:
+        with open(outfile, 'wb') as output_file:
+            writer.write(output_file)
+        s.set(bytes=os.path.getsize(outfile))
+    
+    # Verify merged PDF was created successfully
+    if not os.path.exists(outfile) or os.path.getsize(outfile) == 0:
+        raise Exception("Failed to create merged PDF")
+    
+    if shared is not None:
+        from pdf_incremental import resource_index
+        shared.clear()
+        shared.update(resource_index(outfile))
+    
+    print(f"Merged PDF created successfully: {outfile}")
@@ -0,0 +1,185 @@
+"""Downsample and recompress oversized images in pasted fragments.
+
+Screenshots pasted into Word are exported at full resolution, usually as
+lossless images, which makes fragments of several megabytes that every later
+merge, download and preview has to carry.  ``downsample_images`` runs on a
+fragment before it joins the working document:
+
+* the size every image is drawn at is read from the page content streams,
+  so its effective resolution is known; images above
+  ``CLIP2PDF_IMAGE_DPI`` (default 150) are resampled down to it, and any
+  image is kept under ``CLIP2PDF_IMAGE_MAX_PIXELS`` (default 4 million),
+* photos (many distinct colours) are stored as JPEG at
+  ``CLIP2PDF_JPEG_QUALITY`` (default 85), line art and text screenshots as
+  lossless Flate,
+* an image is only replaced when the new stream is smaller.
+
+Resampling is Pillow's C implementation (``reduce`` by an integer factor,
+then Lanczos), so even a full-screen screenshot takes a fraction of a
+second.  Needs pikepdf and Pillow; without them, or with both limits set to
+0, images are left alone.
+"""
+import io, os, math, zlib
+
+from metrics import span
+
+TARGET_DPI = int(os.environ.get("CLIP2PDF_IMAGE_DPI", "150"))
+MAX_PIXELS = int(os.environ.get("CLIP2PDF_IMAGE_MAX_PIXELS", "4000000"))
+JPEG_QUALITY = int(os.environ.get("CLIP2PDF_JPEG_QUALITY", "85"))
+LINE_ART_COLORS = 256   # at most this many distinct colours: store losslessly
+MIN_PIXELS = 64 * 64    # smaller images are not worth touching
+
+
+def _identity():
+    return (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+
+
+def _multiply(m, n):
+    """Matrix product ``m x n`` for PDF 3x2 matrices ``(a b c d e f)``"""
+    a, b, c, d, e, f = m
+    A, B, C, D, E, F = n
+    return (a * A + b * C, a * B + b * D,
+            c * A + d * C, c * B + d * D,
+            e * A + f * C + E, e * B + f * D + F)
+
+
+def drawn_sizes(pdf):
+    """``{image objgen: (width, height)}`` largest size in points each image is drawn at"""
+    import pikepdf
+
+    sizes = {}
+
+    def walk(container, resources, ctm, depth):
+        xobjects = resources.get("/XObject", {}) if resources is not None else {}
+        stack = []
+        for operands, operator in pikepdf.parse_content_stream(container):
+            op = str(operator)
+            if op == "q":
+                stack.append(ctm)
+            elif op == "Q" and stack:
+                ctm = stack.pop()
+            elif op == "cm" and len(operands) == 6:
+                ctm = _multiply(tuple(float(v) for v in operands), ctm)
+            elif op == "Do" and operands:
+                xobject = xobjects.get(str(operands[0]))
+                if xobject is None:
+                    continue
+                subtype = xobject.get("/Subtype")
+                if subtype == "/Image":
+                    # The unit square is mapped through the CTM
+                    width = math.hypot(ctm[0], ctm[1])
+                    height = math.hypot(ctm[2], ctm[3])
+                    # A soft mask is drawn wherever its image is
+                    for image in (xobject, xobject.get("/SMask")):
+                        if isinstance(image, pikepdf.Stream):
+                            old = sizes.get(image.objgen, (0, 0))
+                            sizes[image.objgen] = (max(old[0], width), max(old[1], height))
+                elif subtype == "/Form" and depth < 4:
+                    matrix = tuple(float(v) for v in xobject.get("/Matrix", _identity()))
+                    walk(xobject, xobject.get("/Resources", resources), _multiply(matrix, ctm), depth + 1)
+
+    for page in pdf.pages:
+        walk(page, page.obj.get("/Resources"), _identity(), 0)
+    return sizes
+
+
+def _target_size(width, height, drawn, dpi, max_pixels):
+    """Pixel size an image should be stored at, or None to keep it"""
+    scale = 1.0
+    if drawn and drawn[0] > 0 and drawn[1] > 0 and dpi:
+        # Pixels needed for ``dpi`` at the drawn size, with 10% slack
+        needed = max(drawn[0] / 72 * dpi / width, drawn[1] / 72 * dpi / height)
+        if needed < 0.9:
+            scale = needed
+    if width * height * scale * scale > max_pixels:
+        scale = math.sqrt(max_pixels / (width * height))
+    if scale >= 0.9:
+        return None
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _resample(image, size):
+    from PIL import Image
+
+    lanczos = getattr(Image, "Resampling", Image).LANCZOS
+    # reducing_gap: integer box reduction first, Lanczos only for the rest
+    return image.resize(size, lanczos, reducing_gap=2.0)
+
+
+def _encode(image, quality):
+    """``(data, filter name)`` for an RGB or L image"""
+    if image.getcolors(LINE_ART_COLORS) is None:
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=quality, optimize=True)
+        return buffer.getvalue(), "/DCTDecode"
+    return zlib.compress(image.tobytes(), 6), "/FlateDecode"
+
+
+def _replace(obj, image, data, filter_name):
+    import pikepdf
+
+    obj.write(data, filter=pikepdf.Name(filter_name))
+    obj.Width = image.width
+    obj.Height = image.height
+    obj.BitsPerComponent = 8
+    obj.ColorSpace = pikepdf.Name("/DeviceRGB" if image.mode == "RGB" else "/DeviceGray")
+    for key in ("/DecodeParms", "/Decode"):
+        if key in obj:
+            del obj[key]
+
+
+def downsample_images(path, dpi=TARGET_DPI, max_pixels=MAX_PIXELS, quality=JPEG_QUALITY):
+    """Resample and recompress the images of ``path`` in place; returns bytes saved"""
+    if not dpi and not max_pixels:
+        return 0
+    try:
+        import pikepdf
+        from PIL import Image  # noqa: F401
+    except ImportError:
+        return 0
+
+    before = os.path.getsize(path)
+    with span("images", bytes=before) as s:
+        changed = 0
+        with pikepdf.open(path) as pdf:
+            sizes = drawn_sizes(pdf)
+            for obj in list(pdf.objects):
+                # Every image once, wherever (and however often) it is used
+                if not isinstance(obj, pikepdf.Stream) or obj.get("/Subtype") != "/Image":
+                    continue
+                if obj.get("/ImageMask") or obj.get("/SMaskInData"):
+                    continue
+                width, height = int(obj.get("/Width", 0)), int(obj.get("/Height", 0))
+                if width * height < MIN_PIXELS:
+                    continue
+                size = _target_size(width, height, sizes.get(obj.objgen), dpi, max_pixels)
+                if size is None:
+                    continue
+                try:
+                    image = pikepdf.PdfImage(obj).as_pil_image()
+                except Exception as decode_error:
+                    print(f"Skipping image {obj.objgen}: {decode_error}")
+                    continue
+                # A soft mask is an image of its own, handled separately
+                if image.mode in ("RGBA", "P"):
+                    image = image.convert("RGB")
+                elif image.mode == "LA":
+                    image = image.convert("L")
+                if image.mode not in ("RGB", "L"):
+                    continue                            # CMYK, bilevel, 16-bit: keep
+                old_length = len(obj.read_raw_bytes())
+                image = _resample(image, size)
+                data, filter_name = _encode(image, quality)
+                if len(data) >= old_length:
+                    continue
+                _replace(obj, image, data, filter_name)
+                changed += 1
+            if changed:
+                pdf.save(path + ".img")
+        if changed:
+            os.replace(path + ".img", path)
+        after = os.path.getsize(path)
+        s.set(images=changed, saved=before - after)
+    if changed:
+        print(f"Downsampled {changed} image(s) in {os.path.basename(path)}: {before:,} -> {after:,} bytes")
+    return before - after
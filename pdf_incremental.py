@@ -0,0 +1,487 @@
+"""Append or prepend pages to a PDF with an incremental update.
+
+A full merge re-reads every page of the working document and rewrites the
+whole file, so each paste gets slower as the document grows.  An incremental
+update (PDF 1.7, section 7.5.6) leaves the existing bytes untouched and adds
+a new section at the end of the file holding
+
+* the fragment's pages and everything they reference, renumbered after the
+  existing objects,
+* a new revision of the root page tree node with the extended ``/Kids``,
+* a cross-reference section for just those objects, chained to the previous
+  one through ``/Prev``.
+
+The work done and the bytes written therefore scale with the pasted content,
+not with the size of the working document.
+
+``merge_files`` uses the same copier to write a complete new file from
+several PDFs, for the cases an incremental update cannot cover.
+
+Shared resources are stored once: every stream (font programs, images,
+forms) and every font dictionary is identified by a hash of its content,
+and a fragment whose font or logo is already in the document refers to the
+existing object instead of adding another copy.
+"""
+import os, re, zlib, hashlib
+
+from pypdf import PdfReader
+from pypdf.generic import (ArrayObject, DictionaryObject, IndirectObject, NameObject,
+                           NumberObject, StreamObject)
+
+from metrics import span
+
+# Page attributes that may be inherited from the page tree (PDF 1.7, table 30)
+INHERITABLE = ("/Resources", "/MediaBox", "/CropBox", "/Rotate")
+
+# Dictionaries worth sharing besides streams
+SHARED_TYPES = ("/Font", "/FontDescriptor")
+
+# Pages merged between releases of a source's parsed objects in ``merge_files``
+RELEASE_EVERY = 64
+
+# Most content hashes an ``ObjectCopier`` remembers; the least recently used go first
+SHARED_LIMIT = 4096
+
+
+class ObjectCopier:
+    """Copies objects from source PDFs into an output stream under new numbers.
+
+    Objects are written as soon as they are copied; only the byte offset of
+    every written object is kept so a cross-reference section can be built
+    afterwards with ``write_xref``.  What else is remembered about copied
+    objects can be dropped with ``release`` once nothing refers to them.
+    """
+
+    def __init__(self, stream, next_number, shared=None, shared_limit=SHARED_LIMIT):
+        self.stream = stream
+        self.next_number = next_number
+        self.offsets = {}       # object number -> (offset, generation)
+        self.shared = shared if shared is not None else {}   # content hash -> number
+        self.shared_limit = shared_limit
+        self.deduplicated = 0   # references served from ``shared``
+        self._numbers = {}      # (source reader, idnum, generation) -> new number
+        self._pinned = {}       # the same, for pages and aliases; kept by ``release``
+        self._pending = []      # (source reference, new number) not written yet
+        self._hashes = {}       # (source reader, idnum, generation) -> content hash
+
+    def alias(self, source_ref, target_ref):
+        """Make every reference to ``source_ref`` point at ``target_ref`` instead"""
+        key = self._key(source_ref)
+        self._numbers[key] = self._pinned[key] = target_ref.idnum
+
+    def ref(self, source_ref):
+        """New reference for ``source_ref``, queueing the object to be copied"""
+        key = self._key(source_ref)
+        number = self._numbers.get(key)
+        if number is None:
+            digest = content_hash(source_ref, self._hashes)
+            number = self.shared.pop(digest, None) if digest else None
+            if number is not None:
+                self.deduplicated += 1          # identical object already written
+            else:
+                number = self.allocate()
+                self._pending.append((source_ref, number))
+            if digest:
+                self.shared[digest] = number    # most recently used last
+                if len(self.shared) > self.shared_limit:
+                    del self.shared[next(iter(self.shared))]
+            self._numbers[key] = number
+        return IndirectObject(number, 0, None)
+
+    def reserve(self, source_ref):
+        """New reference for ``source_ref`` that the caller writes itself"""
+        key = self._key(source_ref)
+        if key not in self._pinned:
+            self._pinned[key] = self.allocate()
+        self._numbers[key] = self._pinned[key]
+        return IndirectObject(self._pinned[key], 0, None)
+
+    def allocate(self):
+        number = self.next_number
+        self.next_number += 1
+        return number
+
+    def copy_page(self, page, parent_ref):
+        """Copy one page under ``parent_ref`` and return its new reference.
+
+        Inherited attributes are written onto the page itself because it
+        leaves its original page tree behind.
+        """
+        page_ref = self.reserve(page.indirect_reference)
+        copied = DictionaryObject()
+        for key, value in dict.items(page):
+            if key != "/Parent":
+                copied[NameObject(key)] = self.remap(value)
+        node = page.get("/Parent")
+        while node is not None:
+            node = node.get_object()
+            for key in INHERITABLE:
+                if key not in copied and key in node:
+                    copied[NameObject(key)] = self.remap(dict.__getitem__(node, key))
+            node = node.get("/Parent")
+        copied[NameObject("/Parent")] = parent_ref
+        self.write(page_ref.idnum, copied)
+        self.flush()
+        return page_ref
+
+    def remap(self, obj):
+        """Copy of ``obj`` with every indirect reference renumbered"""
+        if isinstance(obj, IndirectObject):
+            return self.ref(obj)
+        if isinstance(obj, StreamObject):
+            copied = obj.__class__()
+            copied._data = obj._data            # keep the stream encoded as-is
+            for key, value in dict.items(obj):
+                copied[NameObject(key)] = self.remap(value)
+            return copied
+        if isinstance(obj, DictionaryObject):
+            copied = DictionaryObject()
+            for key, value in dict.items(obj):
+                copied[NameObject(key)] = self.remap(value)
+            return copied
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(self.remap(value) for value in list.__iter__(obj))
+        return obj
+
+    def flush(self):
+        """Write every object queued by ``ref`` (and what they reference)"""
+        while self._pending:
+            source_ref, number = self._pending.pop()
+            self.write(number, self.remap(source_ref.get_object()))
+
+    def write(self, number, obj, generation=0):
+        self.offsets[number] = (self.stream.tell(), generation)
+        self.stream.write(b"%d %d obj\n" % (number, generation))
+        obj.write_to_stream(self.stream)
+        self.stream.write(b"\nendobj\n")
+
+    def release(self):
+        """Forget the objects copied so far, keeping pages, aliases and ``shared``.
+
+        Call it between pages, when nothing is pending.  A later reference to
+        a forgotten object is resolved again: shareable objects are found in
+        ``shared``, anything else is written once more.
+        """
+        self._numbers = dict(self._pinned)
+        self._hashes.clear()
+
+    def forget_sources(self):
+        """Drop the per-source bookkeeping once a source file is done.
+
+        Keys contain ``id(reader)``, which a later reader may reuse; the
+        content-hash index in ``shared`` is kept.
+        """
+        self._numbers.clear()
+        self._pinned.clear()
+        self._hashes.clear()
+
+    @staticmethod
+    def _key(ref):
+        return (id(ref.pdf), ref.idnum, ref.generation)
+
+
+def content_hash(ref, memo):
+    """SHA-256 identifying a shareable object by content, or None.
+
+    Streams and font dictionaries qualify.  References inside them are
+    hashed by what they point to, so equal objects from different files get
+    equal hashes; ``memo`` caches hashes per source object.
+    """
+    key = ObjectCopier._key(ref)
+    if key in memo:
+        return memo[key]
+    obj = ref.get_object()
+    if not isinstance(obj, StreamObject) and not (
+            isinstance(obj, DictionaryObject) and obj.get("/Type") in SHARED_TYPES):
+        memo[key] = None
+        return None
+    memo[key] = None                    # cycles are never shared
+    digest = hashlib.sha256()
+    try:
+        _hash_into(digest, obj, memo)
+    except RecursionError:
+        return None                     # e.g. a form linking back to its page
+    memo[key] = digest.hexdigest()
+    return memo[key]
+
+
+def _hash_into(digest, obj, memo, depth=0):
+    if depth > 32:
+        raise RecursionError("Object graph too deep to hash")
+    if isinstance(obj, IndirectObject):
+        target = obj.get_object()
+        nested = content_hash(obj, memo)
+        if nested:
+            digest.update(b"R" + nested.encode())
+        elif isinstance(target, (DictionaryObject, ArrayObject)):
+            _hash_into(digest, target, memo, depth + 1)
+        else:
+            digest.update(b"V" + repr(target).encode())
+    elif isinstance(obj, DictionaryObject):
+        digest.update(b"<<")
+        for key in sorted(dict.keys(obj)):
+            if key == "/Length" and isinstance(obj, StreamObject):
+                continue                # derived from the data
+            if key == "/Parent":
+                continue                # never part of a resource's content
+            digest.update(key.encode())
+            _hash_into(digest, dict.__getitem__(obj, key), memo, depth + 1)
+        digest.update(b">>")
+        if isinstance(obj, StreamObject):
+            digest.update(b"stream%d:" % len(obj._data))
+            digest.update(obj._data)
+    elif isinstance(obj, ArrayObject):
+        digest.update(b"[")
+        for value in list.__iter__(obj):
+            _hash_into(digest, value, memo, depth + 1)
+        digest.update(b"]")
+    else:
+        digest.update(b"%s:%s;" % (type(obj).__name__.encode(), repr(obj).encode()))
+
+
+def resource_index(path):
+    """``{content hash: object number}`` of the shareable objects in ``path``"""
+    shared = {}
+    memo = {}
+    with open(path, "rb") as f:
+        reader = PdfReader(f)
+        # Only generation 0: copied references are always written as ``n 0 R``
+        numbers = list(reader.xref.get(0, {})) + list(getattr(reader, "xref_objStm", {}))
+        for number in numbers:
+            try:
+                digest = content_hash(IndirectObject(number, 0, reader), memo)
+            except Exception:
+                continue                # free or damaged entry
+            if digest and digest not in shared:
+                shared[digest] = number
+    return shared
+
+
+def write_xref(stream, offsets, trailer, as_stream=False):
+    """Write a cross-reference section for ``offsets`` followed by the trailer.
+
+    ``trailer`` is a DictionaryObject; its ``/Size`` is raised to cover every
+    object in ``offsets``.  With ``as_stream`` the section is written as a cross-reference
+    stream, for files whose previous sections are streams too.
+    """
+    size = max(max(offsets) + 1, int(trailer.get("/Size", 0)))
+    trailer[NameObject("/Size")] = NumberObject(size)
+    # Group object numbers into runs of consecutive numbers
+    runs = []
+    for number in sorted(offsets):
+        if runs and runs[-1][0] + len(runs[-1][1]) == number:
+            runs[-1][1].append(number)
+        else:
+            runs.append((number, [number]))
+
+    xref_offset = stream.tell()
+    if as_stream:
+        xref_number = size
+        trailer[NameObject("/Size")] = NumberObject(size + 1)
+        offsets = dict(offsets)
+        offsets[xref_number] = (xref_offset, 0)
+        if runs and runs[-1][0] + len(runs[-1][1]) == xref_number:
+            runs[-1][1].append(xref_number)
+        else:
+            runs.append((xref_number, [xref_number]))
+        rows = b"".join(b"\x01" + offsets[n][0].to_bytes(4, "big") + offsets[n][1].to_bytes(2, "big")
+                        for _, numbers in runs for n in numbers)
+        xref = StreamObject()
+        xref._data = zlib.compress(rows)
+        xref.update(trailer)
+        xref[NameObject("/Type")] = NameObject("/XRef")
+        xref[NameObject("/Filter")] = NameObject("/FlateDecode")
+        xref[NameObject("/W")] = ArrayObject([NumberObject(1), NumberObject(4), NumberObject(2)])
+        xref[NameObject("/Index")] = ArrayObject(
+            NumberObject(v) for first, numbers in runs for v in (first, len(numbers)))
+        stream.write(b"%d 0 obj\n" % xref_number)
+        xref.write_to_stream(stream)
+        stream.write(b"\nendobj\n")
+    else:
+        stream.write(b"xref\n")
+        # Every section repeats the head of the free list; readers take a
+        # section that does not start at object 0 for a broken table
+        stream.write(b"0 1\n0000000000 65535 f \n")
+        for first, numbers in runs:
+            stream.write(b"%d %d\n" % (first, len(numbers)))
+            for n in numbers:
+                stream.write(b"%010d %05d n \n" % offsets[n])
+        stream.write(b"trailer\n")
+        trailer.write_to_stream(stream)
+        stream.write(b"\n")
+    stream.write(b"startxref\n%d\n%%%%EOF\n" % xref_offset)
+
+
+def last_startxref(f):
+    """Offset of the last cross-reference section of an open PDF file"""
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    f.seek(max(0, size - 2048))
+    tail = f.read()
+    matches = re.findall(rb"startxref\s+(\d+)", tail)
+    if not matches:
+        raise ValueError("No startxref found, file is not a complete PDF")
+    return int(matches[-1])
+
+
+def page_tree_nodes(pages_ref):
+    """References of every intermediate (``/Pages``) node of a page tree"""
+    nodes = [pages_ref]
+    for kid in pages_ref.get_object().get("/Kids", []):
+        if kid.get("/Type") == "/Pages":
+            nodes.extend(page_tree_nodes(kid.indirect_reference))
+    return nodes
+
+
+def append_incremental(existing_pdf_path, fragment_pdf_path, mode="append", shared=None):
+    """Add the fragment's pages to the end (or start, with ``mode="prepend"``)
+    of ``existing_pdf_path`` in place.  Returns the number of pages added.
+
+    ``shared`` is the document's ``{content hash: object number}`` index of
+    shareable objects (see ``resource_index``); fragment objects found in it
+    are not written again, and it is updated with the new ones on success.
+    """
+    with span("pdf_read", mode=mode) as s:
+        fragment = PdfReader(fragment_pdf_path)
+        # Read the working document through a file handle so pypdf only seeks to
+        # the objects we need instead of loading the whole file
+        with open(existing_pdf_path, "rb") as source:
+            existing = PdfReader(source)
+            if existing.is_encrypted:
+                raise ValueError("Incremental updates of encrypted PDFs are not supported")
+            pages_ref = existing.trailer["/Root"].raw_get("/Pages")
+            pages = pages_ref.get_object()
+            old_kids = list(list.__iter__(pages["/Kids"]))
+            old_count = int(pages["/Count"])
+            pages = DictionaryObject(dict.items(pages))
+            trailer = DictionaryObject()
+            for key in ("/Root", "/Info", "/ID"):
+                if key in existing.trailer:
+                    trailer[NameObject(key)] = existing.trailer.raw_get(key)
+            size = int(existing.trailer["/Size"])
+        s.set(pages=old_count, bytes=os.path.getsize(existing_pdf_path))
+
+    with open(existing_pdf_path, "r+b") as f:
+        original_size = f.seek(0, os.SEEK_END)
+        try:
+            prev = last_startxref(f)
+            f.seek(prev)
+            xref_is_stream = not f.read(4).startswith(b"xref")
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) not in (b"\n", b"\r"):
+                f.write(b"\n")
+
+            with span("merge", mode=mode) as s:
+                copier = ObjectCopier(f, size, dict(shared) if shared else {})
+                # Stray references to the fragment's page tree resolve to ours
+                for node in page_tree_nodes(fragment.trailer["/Root"].raw_get("/Pages")):
+                    copier.alias(node, pages_ref)
+                # Reserve page numbers first so links between fragment pages resolve
+                for page in fragment.pages:
+                    copier.reserve(page.indirect_reference)
+                new_kids = [copier.copy_page(page, pages_ref) for page in fragment.pages]
+
+                kids = new_kids + old_kids if mode == "prepend" else old_kids + new_kids
+                pages[NameObject("/Kids")] = ArrayObject(kids)
+                pages[NameObject("/Count")] = NumberObject(old_count + len(new_kids))
+                copier.write(pages_ref.idnum, pages, pages_ref.generation)
+                s.set(pages=len(new_kids), bytes=f.tell() - original_size,
+                      deduplicated=copier.deduplicated)
+
+            with span("write", mode=mode) as s:
+                trailer[NameObject("/Size")] = NumberObject(copier.next_number)
+                trailer[NameObject("/Prev")] = NumberObject(prev)
+                write_xref(f, copier.offsets, trailer, as_stream=xref_is_stream)
+                s.set(pages=old_count + len(new_kids), bytes=f.tell())
+        except BaseException:
+            # Leave the working document exactly as it was
+            f.truncate(original_size)
+            raise
+
+    if shared is not None:
+        shared.update(copier.shared)
+    return len(new_kids)
+
+
+def page_refs(pages_ref, nodes=None):
+    """References of every page (leaf) of a page tree, in order.
+
+    Pages are not left parsed in the reader, so a tree of thousands of pages
+    is walked without holding them all; the intermediate nodes are added to
+    ``nodes`` if given.
+    """
+    refs = []
+    stack = [pages_ref]
+    while stack:
+        ref = stack.pop()
+        node = ref.get_object()
+        if "/Kids" in node:
+            stack.extend(reversed(list(node.raw_get("/Kids"))))
+            if nodes is not None:
+                nodes.append(ref)
+        else:
+            refs.append(ref)
+            ref.pdf.resolved_objects.pop((ref.generation, ref.idnum), None)
+    return refs
+
+
+def merge_files(paths, outfile, shared=None):
+    """Write the pages of every PDF in ``paths``, in order, to a new ``outfile``.
+
+    Pages are streamed: each is written, with what it references, as soon as
+    it is copied, and every ``RELEASE_EVERY`` pages the reader's parsed
+    objects and the copier's per-object bookkeeping are released.  What still
+    grows with the inputs is small: the source's cross-reference table, one
+    reference per page and one offset per written object, a few dozen bytes
+    each.  Identical fonts and images are written once; ``shared`` collects
+    the content-hash index of the result, at most ``SHARED_LIMIT`` entries.
+    Returns the page count.
+    """
+    shared = {} if shared is None else shared
+    with open(outfile, "wb") as f:
+        f.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+        root_ref = IndirectObject(1, 0, None)
+        pages_ref = IndirectObject(2, 0, None)
+        copier = ObjectCopier(f, 3, shared)
+        kids = []
+        with span("merge", files=len(paths)) as s:
+            for path in paths:
+                with open(path, "rb") as source:
+                    reader = PdfReader(source)
+                    if reader.is_encrypted:
+                        raise ValueError(f"Cannot merge encrypted PDF {os.path.basename(path)}")
+                    root_pages = reader.trailer["/Root"].raw_get("/Pages")
+                    nodes = []
+                    refs = page_refs(root_pages, nodes)
+                    for node in nodes:
+                        copier.alias(node, pages_ref)
+                    # Page tree nodes are read again for every page's inherited attributes
+                    keep = {(node.generation, node.idnum): node.get_object() for node in nodes}
+                    for ref in refs:
+                        copier.reserve(ref)
+                    for index, ref in enumerate(refs):
+                        if index % RELEASE_EVERY == 0:
+                            # Parsed pages, content streams and images are not needed again
+                            reader.resolved_objects.clear()
+                            reader.resolved_objects.update(keep)
+                            copier.release()
+                        kids.append(copier.copy_page(ref.get_object(), pages_ref))
+                copier.forget_sources()
+            s.set(pages=len(kids), deduplicated=copier.deduplicated)
+
+        with span("write", pages=len(kids)) as s:
+            pages = DictionaryObject()
+            pages[NameObject("/Type")] = NameObject("/Pages")
+            pages[NameObject("/Kids")] = ArrayObject(kids)
+            pages[NameObject("/Count")] = NumberObject(len(kids))
+            copier.write(pages_ref.idnum, pages)
+            root = DictionaryObject()
+            root[NameObject("/Type")] = NameObject("/Catalog")
+            root[NameObject("/Pages")] = pages_ref
+            copier.write(root_ref.idnum, root)
+            trailer = DictionaryObject()
+            trailer[NameObject("/Root")] = root_ref
+            trailer[NameObject("/Size")] = NumberObject(copier.next_number)
+            write_xref(f, copier.offsets, trailer)
+            s.set(bytes=f.tell())
+    return len(kids)
@@ -0,0 +1,64 @@
+"""What the viewer shows about a PDF, parsed in a single pass.
+
+``show_pdf`` runs on every Streamlit rerun, so it caches the result of
+``read_pdf_info`` keyed by ``(path, mtime, size)``; an unchanged document is
+never parsed twice.
+"""
+import os
+
+PREVIEW_CHARS = 500
+
+
+def file_key(path):
+    """``(path, mtime, size)``: changes whenever the file's content may have"""
+    stat = os.stat(path)
+    return (os.fspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+def read_pdf_info(path):
+    """Header check, page count, title/author and first-page text preview.
+
+    Returns a dict; parsing problems are reported in ``pages_error`` and
+    ``preview_error`` instead of being raised.
+    """
+    info = {
+        "valid": False,
+        "pages": None,
+        "title": None,
+        "author": None,
+        "preview": "",
+        "pages_error": None,
+        "preview_error": None,
+    }
+    with open(path, "rb") as f:
+        # Check if it's a valid PDF by looking at the header
+        info["valid"] = f.read(10).startswith(b'%PDF-')
+        if not info["valid"]:
+            return info
+        f.seek(0)
+
+        try:
+            from pypdf import PdfReader
+            reader = PdfReader(f)
+            info["pages"] = len(reader.pages)
+            if reader.metadata:
+                # Plain str so the result pickles cleanly into st.cache_data
+                for key in ('/Title', '/Author'):
+                    if reader.metadata.get(key):
+                        info[key[1:].lower()] = str(reader.metadata[key])
+        except Exception as info_error:
+            info["pages_error"] = str(info_error)
+            info["preview_error"] = str(info_error)
+            return info
+
+        # Try to extract text from first page for preview
+        try:
+            if info["pages"]:
+                first_page_text = reader.pages[0].extract_text()
+                # Show first 500 characters
+                info["preview"] = first_page_text[:PREVIEW_CHARS]
+                if len(first_page_text) > PREVIEW_CHARS:
+                    info["preview"] += "..."
+        except Exception as text_error:
+            info["preview_error"] = str(text_error)
+    return info
@@ -0,0 +1,183 @@
+"""Optional structural optimization pass for exported and merged PDFs.
+
+Word's exports and our merges use classic xref tables, one object per
+``obj``/``endobj`` and whatever compression the producer chose.  The pass
+rewrites a file with
+
+* objects packed into compressed object streams (and an xref stream),
+* every stream recompressed at ``CLIP2PDF_OPTIMIZE_LEVEL`` (zlib 1-9),
+* unreferenced objects and unused page resources dropped,
+
+and keeps the result only if it is smaller.  Every run reports the bytes
+saved and the time spent (log line and ``optimize`` metrics span), so a
+deployment can pick its trade-off with ``CLIP2PDF_OPTIMIZE``:
+
+* ``off`` (default) - never run
+* ``fragments`` - each pasted fragment right after export (cheap, keeps
+  incremental appends to the working document)
+* ``all`` - fragments and the assembled document after every merge
+  (smallest files, but every paste then rewrites the whole document)
+
+Separately, ``maybe_linearize`` writes linearized ("fast web view") output,
+where page 1 and an index of the rest come first, so a viewer reading the
+file by byte ranges shows the first page before the download finishes.
+``CLIP2PDF_LINEARIZE`` chooses when:
+
+* ``off`` (default) - never
+* ``auto`` - documents of at least ``CLIP2PDF_LINEARIZE_MB`` (default 5)
+  megabytes
+* ``on`` - always
+
+Linearizing rewrites the whole file and an incremental update undoes it, so
+working documents are linearized by a background job after assembly
+(``FragmentDocument.linearize``), never on the paste path.
+
+pikepdf (``pip install pikepdf``) is used when installed, otherwise the
+``qpdf`` command line tool.
+"""
+import os, re, time, shutil, subprocess
+
+from metrics import span, REGISTRY
+
+POLICY = os.environ.get("CLIP2PDF_OPTIMIZE", "off").lower()
+DEFAULT_LEVEL = int(os.environ.get("CLIP2PDF_OPTIMIZE_LEVEL", "6"))
+LINEARIZE = os.environ.get("CLIP2PDF_LINEARIZE", "off").lower()
+LINEARIZE_MIN_BYTES = int(float(os.environ.get("CLIP2PDF_LINEARIZE_MB", "5")) * 1024 * 1024)
+
+# Which stages each policy optimizes
+_STAGES = {"off": (), "fragments": ("fragment",), "all": ("fragment", "document")}
+
+
+def enabled(stage):
+    """True when the configured policy optimizes ``stage`` (fragment or document)"""
+    return stage in _STAGES.get(POLICY, ())
+
+
+def optimize_pdf(path, level=DEFAULT_LEVEL, object_streams=True):
+    """Optimize ``path`` in place; returns ``{before, after, saved, seconds, engine}``.
+
+    The file is only replaced when the optimized copy is smaller.
+    """
+    before = os.path.getsize(path)
+    temp_path = path + ".opt"
+    start = time.perf_counter()
+    with span("optimize", bytes=before) as s:
+        try:
+            engine = _with_pikepdf(path, temp_path, level, object_streams)
+        except ImportError:
+            engine = _with_qpdf(path, temp_path, level, object_streams)
+        after = os.path.getsize(temp_path)
+        if after < before:
+            os.replace(temp_path, path)
+        else:
+            os.remove(temp_path)
+            after = before
+        s.set(engine=engine, saved=before - after)
+    seconds = time.perf_counter() - start
+    REGISTRY.inc("clip2pdf_optimize_saved_bytes_total", before - after, help="Bytes saved by the optimizer")
+    print(f"Optimized {os.path.basename(path)}: {before:,} -> {after:,} bytes "
+          f"({(before - after) / before:.0%} saved) in {seconds:.2f}s with {engine}")
+    return {"before": before, "after": after, "saved": before - after, "seconds": seconds, "engine": engine}
+
+
+def maybe_optimize(path, stage):
+    """Run ``optimize_pdf`` if the policy covers ``stage``; never raises"""
+    if not enabled(stage):
+        return None
+    try:
+        return optimize_pdf(path)
+    except Exception as optimize_error:
+        print(f"Optimization of {os.path.basename(path)} skipped: {optimize_error}")
+        if os.path.exists(path + ".opt"):
+            os.remove(path + ".opt")
+        return None
+
+
+def is_linearized(path):
+    """True if ``path`` starts with a linearization dictionary that still matches its length"""
+    with open(path, "rb") as f:
+        head = f.read(1024)
+    match = re.search(rb"/Linearized\s[^>]*?/L\s+(\d+)", head)
+    # An incremental update appends to the file, so /L no longer matches
+    return bool(match) and int(match.group(1)) == os.path.getsize(path)
+
+
+def linearize_pdf(path):
+    """Rewrite ``path`` linearized, in place; returns ``{before, after, seconds, engine}``"""
+    before = os.path.getsize(path)
+    temp_path = path + ".lin"
+    start = time.perf_counter()
+    with span("linearize", bytes=before) as s:
+        try:
+            engine = _linearize_with_pikepdf(path, temp_path)
+        except ImportError:
+            engine = _linearize_with_qpdf(path, temp_path)
+        os.replace(temp_path, path)
+        after = os.path.getsize(path)
+        s.set(engine=engine)
+    seconds = time.perf_counter() - start
+    print(f"Linearized {os.path.basename(path)} ({after:,} bytes) in {seconds:.2f}s with {engine}")
+    return {"before": before, "after": after, "seconds": seconds, "engine": engine}
+
+
+def maybe_linearize(path, force=None):
+    """Linearize ``path`` if ``force`` (or, when None, the policy) asks for it; never raises"""
+    if force is None:
+        force = LINEARIZE == "on" or (LINEARIZE == "auto" and os.path.getsize(path) >= LINEARIZE_MIN_BYTES)
+    if not force:
+        return None
+    try:
+        if is_linearized(path):
+            return None
+        return linearize_pdf(path)
+    except Exception as linearize_error:
+        print(f"Linearization of {os.path.basename(path)} skipped: {linearize_error}")
+        if os.path.exists(path + ".lin"):
+            os.remove(path + ".lin")
+        return None
+
+
+def _with_pikepdf(path, outfile, level, object_streams):
+    import pikepdf
+
+    pikepdf.settings.set_flate_compression_level(level)
+    with pikepdf.open(path) as pdf:
+        pdf.remove_unreferenced_resources()
+        # qpdf only writes objects reachable from the trailer
+        pdf.save(outfile,
+                 object_stream_mode=(pikepdf.ObjectStreamMode.generate if object_streams
+                                     else pikepdf.ObjectStreamMode.preserve),
+                 compress_streams=True,
+                 recompress_flate=True)
+    return "pikepdf"
+
+
+def _with_qpdf(path, outfile, level, object_streams):
+    if not shutil.which("qpdf"):
+        raise Exception("Install pikepdf (pip install pikepdf) or qpdf to optimize PDFs")
+    command = ["qpdf", f"--compression-level={level}", "--recompress-flate",
+               "--compress-streams=y", "--remove-unreferenced-resources=yes",
+               f"--object-streams={'generate' if object_streams else 'preserve'}", path, outfile]
+    result = subprocess.run(command, capture_output=True, timeout=300)
+    # Exit status 3 means success with warnings
+    if result.returncode not in (0, 3):
+        raise Exception(result.stderr.decode("utf-8", errors="replace").strip() or "qpdf failed")
+    return "qpdf"
+
+
+def _linearize_with_pikepdf(path, outfile):
+    import pikepdf
+
+    with pikepdf.open(path) as pdf:
+        pdf.save(outfile, linearize=True, object_stream_mode=pikepdf.ObjectStreamMode.preserve)
+    return "pikepdf"
+
+
+def _linearize_with_qpdf(path, outfile):
+    if not shutil.which("qpdf"):
+        raise Exception("Install pikepdf (pip install pikepdf) or qpdf to linearize PDFs")
+    result = subprocess.run(["qpdf", "--linearize", "--object-streams=preserve", path, outfile],
+                            capture_output=True, timeout=300)
+    if result.returncode not in (0, 3):
+        raise Exception(result.stderr.decode("utf-8", errors="replace").strip() or "qpdf failed")
+    return "qpdf"
@@ -0,0 +1,163 @@
+"""Unique output names, and PDFs that only appear once they are complete and valid.
+
+* ``unique_name`` adds a random token to the timestamp, and ``publish``
+  never replaces an existing file unless asked to, so one name is never
+  handed out twice, even for two renders in the same second;
+* ``atomic_pdf`` has the PDF written to a temporary file next to its
+  destination, checks it with ``verify_pdf`` and only then renames it into
+  place - one atomic step, so a reader sees no file (or the previous
+  version) or the complete new one, never a partial or broken one;
+* ``locked`` serializes in-place updates of one file or working document
+  (incremental appends, assembly, manifest edits) across threads and
+  processes, through a lock file.
+"""
+import os, time, uuid, tempfile, datetime, threading
+from contextlib import contextmanager
+
+# Standalone PDFs from ``create_pdf``; only this app writes here
+OUTPUT_DIR = os.path.join(tempfile.gettempdir(), "clip2pdf_outputs")
+TEMP_SUFFIX = ".tmp.pdf"        # renderers (Word) expect a .pdf extension
+LOCK_NAME = ".lock"             # lock file inside a document directory
+_held = threading.local()       # lock files this thread holds, for re-entry
+
+
+def unique_name(prefix):
+    """``{prefix}_{YYYYmmdd_HHMMSS}_{random}``: sorts by time, unique within a second"""
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"{prefix}_{timestamp}_{uuid.uuid4().hex[:8]}"
+
+
+def temp_path(path, suffix=TEMP_SUFFIX):
+    """A new, empty, uniquely named hidden file in ``path``'s directory (so renaming it is atomic)"""
+    directory, name = os.path.split(path)
+    handle, temp = tempfile.mkstemp(prefix=f".{os.path.splitext(name)[0]}_", suffix=suffix,
+                                    dir=directory or ".")
+    os.close(handle)
+    return temp
+
+
+def verify_pdf(path):
+    """Raise unless ``path`` is a complete PDF with at least one page; returns the page count"""
+    size = os.path.getsize(path)
+    if size == 0:
+        raise Exception(f"{os.path.basename(path)} is empty")
+    with open(path, "rb") as f:
+        if not f.read(1024).lstrip().startswith(b"%PDF-"):
+            raise Exception(f"{os.path.basename(path)} is not a PDF")
+        f.seek(max(0, size - 1024))
+        if b"%%EOF" not in f.read():
+            raise Exception(f"{os.path.basename(path)} is truncated")
+        try:
+            from pypdf import PdfReader
+        except ImportError:
+            return None
+        f.seek(0)
+        pages = len(PdfReader(f).pages)
+    if not pages:
+        raise Exception(f"{os.path.basename(path)} has no pages")
+    return pages
+
+
+def publish(temp, path, replace=False):
+    """Rename the finished ``temp`` to ``path`` atomically.
+
+    Raises ``FileExistsError`` (and removes ``temp``) if ``path`` exists,
+    unless ``replace``.
+    """
+    try:
+        if replace:
+            os.replace(temp, path)
+        elif os.name == 'nt':
+            os.rename(temp, path)           # never replaces on Windows
+        else:
+            try:
+                os.link(temp, path)         # fails if path exists, unlike rename
+            except FileExistsError:
+                raise
+            except OSError:
+                # No hard links on this filesystem
+                if os.path.exists(path):
+                    raise FileExistsError(path)
+                os.replace(temp, path)
+                return path
+            os.remove(temp)
+    except FileExistsError:
+        os.remove(temp)
+        raise
+    return path
+
+
+@contextmanager
+def atomic_pdf(path, replace=False):
+    """Yield a temporary path to write a PDF to; it becomes ``path`` only if it verifies"""
+    temp = temp_path(path)
+    try:
+        yield temp
+        try:
+            verify_pdf(temp)
+        except Exception as verify_error:
+            raise Exception(f"Rejected output for {os.path.basename(path)}: {verify_error}")
+        publish(temp, path, replace)
+    finally:
+        if os.path.exists(temp):
+            os.remove(temp)
+
+
+def lock_path(path):
+    """Lock file guarding ``path``: ``.lock`` inside a directory, ``.{name}.lock`` beside a file"""
+    if os.path.isdir(path):
+        return os.path.join(path, LOCK_NAME)
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".{name}.lock")
+
+
+@contextmanager
+def locked(path):
+    """Hold the exclusive lock for updating ``path`` (a file or document directory).
+
+    The lock is an OS lock on a lock file, so it holds between processes as
+    well as threads; a thread already holding it may enter it again.
+    """
+    key = os.path.realpath(lock_path(path))
+    held = _held.__dict__.setdefault("paths", set())
+    if key in held:
+        yield
+        return
+    with open(key, "a+b") as f:
+        _lock_file(f)
+        held.add(key)
+        try:
+            yield
+        finally:
+            held.discard(key)
+            _unlock_file(f)
+
+
+def _lock_file(f):
+    if os.name == 'nt':
+        import msvcrt
+
+        f.seek(0)
+        while True:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                return
+            except OSError:
+                time.sleep(0.05)            # held by another thread or process
+    else:
+        import fcntl
+
+        # Every ``open`` is its own lock owner, so threads exclude each other too
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+
+def _unlock_file(f):
+    if os.name == 'nt':
+        import msvcrt
+
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        import fcntl
+
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
@@ -0,0 +1,190 @@
+"""Small HTTP file route that serves generated PDFs straight from disk.
+
+Passing PDF bytes to ``st.download_button`` keeps a copy of every document in
+every session's memory.  Instead, ``viewapp`` registers the file here and
+links to it.  The server supports
+
+* ``Range`` requests (single range, ``206 Partial Content``), so browser PDF
+  viewers can fetch pages progressively,
+* ``ETag`` / ``If-None-Match`` validation (``304 Not Modified``),
+* zero-copy transfer with ``socket.sendfile`` (``sendfile(2)`` where the OS
+  has it).
+
+Only registered files are served, under an opaque token, never arbitrary
+paths.  ``/metrics`` exposes the pipeline metrics (``metrics.py``) in the
+Prometheus text format.  Configuration: ``CLIP2PDF_FILE_HOST`` / ``CLIP2PDF_FILE_PORT`` for
+the listening address (default ``127.0.0.1:8765``) and ``CLIP2PDF_FILE_URL``
+for the public base URL when the server sits behind a proxy.
+"""
+import os, re, hashlib, threading, urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_HOST = os.environ.get("CLIP2PDF_FILE_HOST", "127.0.0.1")
+DEFAULT_PORT = int(os.environ.get("CLIP2PDF_FILE_PORT", "8765"))
+
+_RANGE = re.compile(r"bytes=(\d*)-(\d*)$")
+
+
+class FileServer:
+    """Background HTTP server for registered files"""
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, base_url=None):
+        self._files = {}
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.file_server = self
+        host, port = self.httpd.server_address[:2]
+        self.base_url = (base_url or os.environ.get("CLIP2PDF_FILE_URL")
+                         or f"http://{'localhost' if host in ('0.0.0.0', '127.0.0.1') else host}:{port}")
+        self.base_url = self.base_url.rstrip("/")
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="pdf-file-server",
+                                        daemon=True)
+        self._thread.start()
+        print(f"PDF file server listening on {self.base_url}")
+
+    def register(self, path):
+        """Make ``path`` downloadable; returns its URL"""
+        path = os.path.realpath(path)
+        token = hashlib.sha1(path.encode("utf-8")).hexdigest()[:16]
+        with self._lock:
+            self._files[token] = path
+        return f"{self.base_url}/pdf/{token}/{urllib.parse.quote(os.path.basename(path))}"
+
+    def lookup(self, token):
+        with self._lock:
+            return self._files.get(token)
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def etag_for(stat):
+    """Strong validator derived from the file's mtime and size"""
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def parse_range(header, size):
+    """``(start, end)`` inclusive byte range for a single-range header.
+
+    Returns None when the header should be ignored (absent, multi-range or
+    malformed) and raises ValueError when the range cannot be satisfied.
+    """
+    match = _RANGE.match(header.strip()) if header else None
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:                       # suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "richtext2pdf"
+
+    def do_OPTIONS(self):
+        # CORS preflight: the in-page viewer runs on the Streamlit origin
+        self.send_response(204)
+        self._cors_headers()
+        self.send_header("Access-Control-Allow-Methods", "GET, HEAD, OPTIONS")
+        self.send_header("Access-Control-Allow-Headers", "Range, If-None-Match, If-Range")
+        self.send_header("Access-Control-Max-Age", "86400")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _cors_headers(self):
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Access-Control-Expose-Headers",
+                         "Accept-Ranges, Content-Range, Content-Length, ETag")
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        if urllib.parse.urlsplit(self.path).path == "/metrics":
+            self._metrics()
+            return
+        self._serve(send_body=True)
+
+    def _metrics(self):
+        from metrics import REGISTRY
+
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _serve(self, send_body):
+        url = urllib.parse.urlsplit(self.path)
+        parts = url.path.split("/")
+        path = self.server.file_server.lookup(parts[2]) if len(parts) >= 3 and parts[1] == "pdf" else None
+        if not path or not os.path.isfile(path):
+            self.send_error(404, "Not registered")
+            return
+
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            size = stat.st_size
+            etag = etag_for(stat)
+
+            if etag in [tag.strip() for tag in self.headers.get("If-None-Match", "").split(",")]:
+                self.send_response(304)
+                self._cors_headers()
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            # If-Range: only honour the range when the client's copy is current
+            range_header = self.headers.get("Range")
+            if_range = self.headers.get("If-Range")
+            if if_range and if_range.strip() != etag:
+                range_header = None
+            try:
+                byte_range = parse_range(range_header, size)
+            except ValueError:
+                self.send_response(416)
+                self._cors_headers()
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            start, end = byte_range if byte_range else (0, size - 1)
+            length = max(0, end - start + 1)
+            self.send_response(206 if byte_range else 200)
+            self._cors_headers()
+            if byte_range:
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            self.send_header("Content-Type", "application/pdf")
+            self.send_header("Content-Length", str(length))
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+            query = urllib.parse.parse_qs(url.query)
+            disposition = "attachment" if query.get("download") else "inline"
+            filename = urllib.parse.quote(os.path.basename(path))
+            self.send_header("Content-Disposition", f"{disposition}; filename*=UTF-8''{filename}")
+            self.end_headers()
+
+            if send_body and length:
+                self.wfile.flush()
+                # Kernel-side copy from the file to the socket where available
+                self.connection.sendfile(f, start, length)
+
+    def log_message(self, format, *args):
+        pass                            # keep the Streamlit console readable
@@ -0,0 +1,173 @@
+"""Content-addressed cache of rendered clipboard fragments.
+
+Pasting the same clipboard twice (a repeated Ctrl+V, one answer pasted into
+several documents) used to pay for a full Word paste and export each time.
+``CachingRenderer`` hashes every format on the clipboard together with the
+renderer's settings and the placeholder texts; on a hit the cached fragment
+PDF is copied to the output and the renderer is not called at all.
+
+Fragments are stored as ``<sha256>.pdf`` under ``CLIP2PDF_RENDER_CACHE_DIR``
+(default ``%TEMP%/clip2pdf_render_cache``), capped at
+``CLIP2PDF_RENDER_CACHE_MB`` (default 512); the least recently used entries
+are evicted first.  ``CLIP2PDF_RENDER_CACHE=0`` turns the cache off.
+Snapshots (``render_snapshot``) are keyed on the formats they hold.  Only
+real renderings are stored: a placeholder rendered because the clipboard
+read or the paste failed (or came out empty) is never cached.
+"""
+import os, json, shutil, hashlib, tempfile, threading
+
+from renderers import Renderer, RENDERED
+
+CACHE_DIR = os.environ.get("CLIP2PDF_RENDER_CACHE_DIR",
+                           os.path.join(tempfile.gettempdir(), "clip2pdf_render_cache"))
+MAX_CACHE_BYTES = int(os.environ.get("CLIP2PDF_RENDER_CACHE_MB", "512")) * 1024 * 1024
+ENABLED = os.environ.get("CLIP2PDF_RENDER_CACHE", "1") != "0"
+
+# Bump when a change to the renderers makes old fragments stale
+CACHE_VERSION = 1
+
+
+def payload_key(formats, settings):
+    """SHA-256 over every clipboard format (name and bytes) and the render settings"""
+    digest = hashlib.sha256()
+    digest.update(json.dumps({"version": CACHE_VERSION, "settings": settings},
+                             sort_keys=True, default=str).encode("utf-8"))
+    for name in sorted(formats):
+        data = formats[name]
+        digest.update(b"\0%d:%s\0%d\0" % (len(name), name.encode("utf-8"), len(data)))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+class RenderCache:
+    """Size-capped directory of fragment PDFs named by payload hash"""
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._total = None              # bytes in the cache, counted lazily
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".pdf")
+
+    def get(self, key, outfile):
+        """Copy the fragment cached under ``key`` to ``outfile``; False on a miss"""
+        path = self._path(key)
+        try:
+            shutil.copyfile(path, outfile)
+        except FileNotFoundError:
+            return False
+        try:
+            os.utime(path)              # mark as recently used
+        except OSError:
+            pass
+        return True
+
+    def put(self, key, pdf_path):
+        """Store a copy of ``pdf_path`` under ``key``"""
+        path = self._path(key)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        shutil.copyfile(pdf_path, temp_path)
+        os.replace(temp_path, path)
+        with self._lock:
+            if self._total is not None:
+                self._total += os.path.getsize(path)
+        self._evict(keep=(path,))
+
+    def _evict(self, keep=()):
+        """Delete least recently used fragments until under the cap, except ``keep``"""
+        with self._lock:
+            if self._total is not None and self._total <= self.max_bytes:
+                return
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and entry.name.endswith(".pdf"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            # Least recently used first, down to 90% so eviction is not run per paste
+            target = self.max_bytes * 0.9 if total > self.max_bytes else total
+            for _, size, path in sorted(entries):
+                if total <= target:
+                    break
+                if path in keep:
+                    continue
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+            self._total = total
+
+
+class CachingRenderer(Renderer):
+    """Wraps a renderer and serves repeated clipboard content from a ``RenderCache``"""
+
+    def __init__(self, renderer, cache=None):
+        self.renderer = renderer
+        self.cache = cache or RenderCache()
+        self.name = renderer.name
+
+    def render(self, outfile, empty_text, failed_text):
+        from clipboard_capture import get_source
+
+        source = get_source()
+        try:
+            formats = source.read_formats()
+        except Exception as read_error:
+            print(f"Clipboard fingerprint failed ({read_error}), rendering without cache")
+            formats = {}
+        if not formats:
+            # Nothing to key on (or an empty clipboard): always render
+            return self.renderer.render(outfile, empty_text, failed_text)
+
+        key = payload_key(formats, dict(self.renderer.settings(), empty=empty_text, failed=failed_text))
+        if self.cache.get(key, outfile):
+            print(f"Render cache hit {key[:12]}")
+            return RENDERED
+        outcome = self.renderer.render(outfile, empty_text, failed_text)
+        if outcome != RENDERED:
+            print(f"Not caching the {outcome or 'unreported'} render of {key[:12]}")
+            return outcome
+        try:
+            # Only store the fragment if the clipboard did not change while rendering
+            if source.read_formats() == formats:
+                self.cache.put(key, outfile)
+        except Exception as cache_error:
+            print(f"Could not store fragment in render cache: {cache_error}")
+        return outcome
+
+    def render_snapshot(self, snapshot, outfile, empty_text, failed_text):
+        if not snapshot:
+            return self.renderer.render_snapshot(snapshot, outfile, empty_text, failed_text)
+
+        key = payload_key(snapshot.formats, dict(self.renderer.settings(), empty=empty_text, failed=failed_text))
+        if self.cache.get(key, outfile):
+            print(f"Render cache hit {key[:12]}")
+            return RENDERED
+        outcome = self.renderer.render_snapshot(snapshot, outfile, empty_text, failed_text)
+        if outcome != RENDERED:
+            print(f"Not caching the {outcome or 'unreported'} render of {key[:12]}")
+            return outcome
+        # A snapshot cannot change while rendering: safe to store
+        try:
+            self.cache.put(key, outfile)
+        except Exception as cache_error:
+            print(f"Could not store fragment in render cache: {cache_error}")
+        return outcome
+
+    def render_file(self, input_path, outfile):
+        self.renderer.render_file(input_path, outfile)
+
+    def settings(self):
+        return self.renderer.settings()
+
+    def close(self):
+        self.renderer.close()
+
+
+def cached(renderer):
+    """``renderer`` behind the render cache, unless ``CLIP2PDF_RENDER_CACHE=0``"""
+    return CachingRenderer(renderer) if ENABLED else renderer
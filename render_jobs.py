@@ -0,0 +1,158 @@
+"""Background job queue for renders, so the Streamlit script never blocks on Word.
+
+A job is a callable ``fn(job)`` run on a worker thread.  Jobs are tracked by
+ID through ``queued -> running -> done | failed | cancelled``; the UI keeps
+the IDs in its session and polls ``get``.  Jobs that share a ``key`` (the
+working document) run one after another in submission order, so two pastes
+into one document never race on its manifest, while jobs of different
+documents (other sessions) overlap.
+
+Cancelling a queued job drops it.  A running render cannot be interrupted
+inside Word, so cancelling a running job sets a flag the job checks at its
+next checkpoint (``job.check_cancelled()``).  A job that gets past its last
+checkpoint has done its work (the fragment is in the document) and is
+reported done even if a cancel arrives afterwards.
+
+``CLIP2PDF_RENDER_WORKERS`` sets the number of worker threads (default: the
+Word pool size, so every worker has an instance to paste into).
+"""
+import os, time, uuid, threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+DEFAULT_WORKERS = int(os.environ.get("CLIP2PDF_RENDER_WORKERS")
+                      or os.environ.get("CLIP2PDF_WORD_POOL_SIZE") or "2")
+KEEP_FINISHED = 200     # finished jobs remembered for polling
+
+
+class JobCancelled(Exception):
+    """Raised at a checkpoint of a job whose cancellation was requested"""
+
+
+class Job:
+    """State of one submitted job"""
+
+    def __init__(self, description="", key=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.description = description
+        self.key = key
+        self.state = QUEUED
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+        self._cancel = threading.Event()
+
+    @property
+    def cancel_requested(self):
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        """Checkpoint: raise ``JobCancelled`` if the job was cancelled"""
+        if self._cancel.is_set():
+            raise JobCancelled(f"Job {self.id} cancelled")
+
+    @property
+    def elapsed(self):
+        """Seconds spent queued and running so far"""
+        return (self.finished or time.time()) - self.created
+
+    def __repr__(self):
+        return f"<Job {self.id} {self.state} {self.description!r}>"
+
+
+class JobQueue:
+    """Runs jobs on a thread pool, serialized per key"""
+
+    def __init__(self, workers=DEFAULT_WORKERS, keep=KEEP_FINISHED):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="render-job")
+        self._jobs = {}                 # id -> Job, in submission order
+        self._waiting = {}              # key -> deque of (job, fn) behind the running one
+        self._lock = threading.Lock()
+        self.keep = keep
+
+    def submit(self, fn, description="", key=None):
+        """Queue ``fn(job)``; returns the ``Job``"""
+        job = Job(description, key)
+        with self._lock:
+            self._jobs[job.id] = job
+            if key is not None:
+                if key in self._waiting:
+                    # Another job of this key is queued or running: go behind it
+                    self._waiting[key].append((job, fn))
+                    return job
+                self._waiting[key] = deque()
+        self._executor.submit(self._run, job, fn)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self, ids=None):
+        """Jobs with the given IDs (all jobs when omitted), unknown IDs skipped"""
+        with self._lock:
+            if ids is None:
+                return list(self._jobs.values())
+            return [self._jobs[i] for i in ids if i in self._jobs]
+
+    def cancel(self, job_id):
+        """Request cancellation; returns False when the job already finished.
+
+        A running job only stops at a checkpoint still ahead of it.
+        """
+        job = self.get(job_id)
+        if job is None or job.state in FINISHED:
+            return False
+        job._cancel.set()
+        return True
+
+    def _run(self, job, fn):
+        state = CANCELLED
+        try:
+            if job.cancel_requested:
+                return
+            job.started = time.time()
+            job.state = RUNNING
+            try:
+                job.result = fn(job)
+                state = DONE            # a cancel arriving this late came too late
+            except JobCancelled:
+                pass
+            except Exception as job_error:
+                print(f"Job {job.id} ({job.description}) failed: {job_error}")
+                job.error = str(job_error)
+                state = FAILED
+        finally:
+            # Pollers read ``state``: everything else must be set before it
+            job.finished = time.time()
+            job.state = state
+            self._start_next(job.key)
+            self._prune()
+
+    def _start_next(self, key):
+        if key is None:
+            return
+        with self._lock:
+            waiting = self._waiting.get(key)
+            if not waiting:
+                self._waiting.pop(key, None)
+                return
+            job, fn = waiting.popleft()
+        self._executor.submit(self._run, job, fn)
+
+    def _prune(self):
+        with self._lock:
+            finished = [job_id for job_id, job in self._jobs.items() if job.state in FINISHED]
+            for job_id in finished[:max(0, len(finished) - self.keep)]:
+                del self._jobs[job_id]
+
+    def shutdown(self, wait=True):
+        for job in self.jobs():
+            if job.state == QUEUED:
+                job._cancel.set()
+        self._executor.shutdown(wait=wait)
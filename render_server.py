@@ -0,0 +1,427 @@
+"""Standalone render server: one process owns the renderers, sessions send it work.
+
+Word's COM objects live in single-threaded apartments, and every Streamlit
+session used to drive them from inside the app process.  The render server
+moves rendering into its own process:
+
+    python render_server.py --address 127.0.0.1:8766 --workers 2
+    python render_server.py --stand-in --delay 0.5       # no Office needed
+    python render_server.py --host gpu-box:8766 --host 10.0.0.7:8766
+
+Clients connect over a local socket (``multiprocessing.connection``, so a
+TCP port, a Unix socket path or a Windows named pipe) and send a clipboard
+snapshot or an input file; the finished PDF comes back in the reply.
+Requests are queued per session and served round-robin, so one session
+pasting twenty times does not starve another pasting once.  A request gets
+the same time limit as a render in the app (``render_watchdog.job_timeout``)
+once a slot picks it up, and an error reply when it runs out; at most
+``CLIP2PDF_RENDER_MAX_CONNECTIONS`` (default 64) connections are served at
+a time, further clients wait to be accepted.
+
+Work is done by worker slots: ``--workers`` local slots rendering in this
+process (the configured renderer, or with ``--stand-in`` the native engine,
+optionally slowed down by ``--delay`` to mimic Word), plus ``--host-slots``
+slots per ``--host``, another render server that the request is forwarded to.
+
+``RenderClient`` is the client side and a ``Renderer``: set
+``CLIP2PDF_RENDERER=server`` and the app (or ``batch_convert``) renders
+through the server at ``CLIP2PDF_RENDER_SERVER`` (default
+``127.0.0.1:8766``).  Messages are pickled, so whoever knows the shared
+secret can run code on the other side.  It is ``CLIP2PDF_RENDER_AUTHKEY``
+if set; otherwise the server generates a random one into ``AUTHKEY_FILE``
+(``CLIP2PDF_RENDER_AUTHKEY_FILE``, default ``~/.clip2pdf_render_authkey``),
+readable only by its owner, and clients of the same user read it from there.
+"""
+import os, sys, stat, time, argparse, secrets, tempfile, threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from multiprocessing.connection import Listener, Client
+
+from metrics import span, REGISTRY
+from renderers import Renderer
+
+SERVER_ADDRESS = os.environ.get("CLIP2PDF_RENDER_SERVER", "127.0.0.1:8766")
+AUTHKEY_FILE = (os.environ.get("CLIP2PDF_RENDER_AUTHKEY_FILE")
+                or os.path.join(os.path.expanduser("~"), ".clip2pdf_render_authkey"))
+MAX_CONNECTIONS = int(os.environ.get("CLIP2PDF_RENDER_MAX_CONNECTIONS", "64"))
+RECV_TIMEOUT = 30       # seconds a connected client has to send its request
+
+
+def parse_address(address):
+    """``"host:port"`` -> ``(host, port)``; anything else is a socket path or pipe name"""
+    if isinstance(address, str):
+        host, _, port = address.rpartition(":")
+        if host and port.isdigit() and not address.startswith("\\\\"):
+            return host, int(port)
+    return address
+
+
+def load_authkey(create=False):
+    """The shared secret: ``CLIP2PDF_RENDER_AUTHKEY``, else the key in ``AUTHKEY_FILE``.
+
+    With ``create`` (the server) a random key is written to the file first
+    if it does not exist yet.
+    """
+    from pdf_output import publish
+
+    configured = os.environ.get("CLIP2PDF_RENDER_AUTHKEY", "")
+    if configured:
+        return configured.encode("utf-8")
+    if create and not os.path.exists(AUTHKEY_FILE):
+        # mkstemp creates the file readable by its owner only
+        handle, temp = tempfile.mkstemp(prefix=".clip2pdf_authkey_", dir=os.path.dirname(AUTHKEY_FILE))
+        with os.fdopen(handle, "w") as f:
+            f.write(secrets.token_hex(32))
+        try:
+            publish(temp, AUTHKEY_FILE)
+            print(f"Render server key written to {AUTHKEY_FILE}")
+        except FileExistsError:
+            pass                        # another server wrote it first
+    try:
+        with open(AUTHKEY_FILE, encoding="utf-8") as f:
+            if os.name != 'nt' and stat.S_IMODE(os.fstat(f.fileno()).st_mode) & 0o077:
+                raise Exception(f"{AUTHKEY_FILE} is readable by other users; chmod 600 it")
+            key = f.read().strip()
+    except FileNotFoundError:
+        key = ""
+    if not key:
+        raise Exception(f"No render server key: set CLIP2PDF_RENDER_AUTHKEY, or start the "
+                        f"render server, which writes one to {AUTHKEY_FILE}")
+    return key.encode("utf-8")
+
+
+def call(address, request, authkey=None):
+    """Send one request to a render server; returns its reply, raises on errors"""
+    with Client(parse_address(address), authkey=authkey or load_authkey()) as conn:
+        conn.send(request)
+        reply = conn.recv()
+    if not reply.get("ok"):
+        raise Exception(reply.get("error") or "Render server request failed")
+    return reply
+
+
+class FairQueue:
+    """One FIFO per session, served round-robin across sessions"""
+
+    def __init__(self):
+        self._queues = OrderedDict()    # session -> deque, in serving order
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def put(self, session, item):
+        with self._cond:
+            self._queues.setdefault(session, deque()).append(item)
+            self._cond.notify()
+
+    def get(self):
+        """Next item, taking turns between sessions; None once closed"""
+        with self._cond:
+            while not self._queues and not self._closed:
+                self._cond.wait()
+            if not self._queues:
+                return None
+            session, queue = next(iter(self._queues.items()))
+            item = queue.popleft()
+            if queue:
+                self._queues.move_to_end(session)       # the session goes to the back
+            else:
+                del self._queues[session]
+            return item
+
+    def depths(self):
+        with self._cond:
+            return {session: len(queue) for session, queue in self._queues.items()}
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class LocalWorker:
+    """Renders requests in this process with ``renderer``"""
+
+    def __init__(self, renderer):
+        self.renderer = renderer
+        self.name = f"local:{renderer.name}"
+
+    def process(self, request):
+        from clipboard_capture import Snapshot
+
+        handle, outfile = tempfile.mkstemp(suffix=".pdf", prefix="clip2pdf_server_")
+        os.close(handle)
+        input_path = None
+        outcome = None
+        try:
+            if request["op"] == "render_file":
+                suffix = os.path.splitext(request["input_name"])[1]
+                handle, input_path = tempfile.mkstemp(suffix=suffix, prefix="clip2pdf_input_")
+                with os.fdopen(handle, "wb") as f:
+                    f.write(request["input_data"])
+                self.renderer.render_file(input_path, outfile)
+            elif request.get("formats") is None:
+                outcome = self.renderer.render(outfile, request["empty"], request["failed"])
+            else:
+                snapshot = Snapshot(request["formats"], request.get("source", "client"))
+                outcome = self.renderer.render_snapshot(snapshot, outfile, request["empty"], request["failed"])
+            with open(outfile, "rb") as f:
+                return {"ok": True, "data": f.read(), "outcome": outcome}
+        finally:
+            for path in (outfile, input_path):
+                if path and os.path.exists(path):
+                    os.remove(path)
+
+    def settings(self):
+        return self.renderer.settings()
+
+
+class StandInWorker(LocalWorker):
+    """Local stand-in for testing: the native engine, optionally slowed to Word's pace"""
+
+    def __init__(self, delay=0.0):
+        from renderers import NativeRenderer
+
+        super().__init__(NativeRenderer())
+        self.delay = delay
+        self.name = "stand-in"
+
+    def process(self, request):
+        if self.delay:
+            time.sleep(self.delay)
+        return super().process(request)
+
+
+class RemoteWorker:
+    """Forwards requests to the render server at ``address``"""
+
+    def __init__(self, address, authkey=None):
+        """``authkey`` defaults to this server's own: the other server must share it"""
+        self.address = address
+        self.authkey = authkey
+        self.name = f"host:{address}"
+
+    def process(self, request):
+        return call(self.address, request, self.authkey)
+
+    def settings(self):
+        return call(self.address, {"op": "settings"}, self.authkey)["settings"]
+
+
+class RenderServer:
+    """Accepts render requests and hands them to worker slots, fairly per session"""
+
+    def __init__(self, workers, address=SERVER_ADDRESS, authkey=None, max_connections=MAX_CONNECTIONS):
+        """``workers`` is a list of worker objects, one per slot (an object may fill several)"""
+        if not workers:
+            raise ValueError("A render server needs at least one worker")
+        self.workers = workers
+        self.queue = FairQueue()
+        self.listener = Listener(parse_address(address), authkey=authkey or load_authkey(create=True))
+        self.address = self.listener.address
+        self.served = {}                # session -> requests completed
+        self._lock = threading.Lock()
+        self._connections = threading.BoundedSemaphore(max(1, max_connections))
+        self._threads = [threading.Thread(target=self._work, args=(worker,), daemon=True,
+                                          name=f"render-slot-{i}") for i, worker in enumerate(workers)]
+        for thread in self._threads:
+            thread.start()
+        self._accept_thread = threading.Thread(target=self._accept, name="render-server", daemon=True)
+        self._accept_thread.start()
+        print(f"Render server listening on {self.address} with {len(workers)} slot(s): "
+              f"{', '.join(sorted(set(worker.name for worker in workers)))}")
+
+    def _accept(self):
+        while True:
+            # At the limit, further clients wait in the listen backlog
+            self._connections.acquire()
+            try:
+                conn = self.listener.accept()
+            except OSError:
+                self._connections.release()
+                break                   # listener closed
+            except Exception as accept_error:
+                self._connections.release()
+                print(f"Render server: rejected connection ({accept_error})")
+                continue
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        try:
+            with conn:
+                if not conn.poll(RECV_TIMEOUT):
+                    return              # connected but never asked for anything
+                request = conn.recv()
+                conn.send(self.handle(request))
+        except (EOFError, OSError):
+            pass                        # client went away
+        finally:
+            self._connections.release()
+
+    def handle(self, request):
+        """Reply to one request (blocks until a render is done or its time is up)"""
+        op = request.get("op")
+        if op == "ping":
+            return {"ok": True}
+        if op == "settings":
+            return {"ok": True, "settings": self.workers[0].settings()}
+        if op == "stats":
+            with self._lock:
+                served = dict(self.served)
+            return {"ok": True, "queued": self.queue.depths(), "served": served,
+                    "workers": [worker.name for worker in self.workers]}
+        if op not in ("render", "render_file"):
+            return {"ok": False, "error": f"Unknown operation {op!r}"}
+
+        from render_watchdog import job_timeout
+
+        session = request.get("session") or "default"
+        future = Future()
+        started = threading.Event()
+        self.queue.put(session, (request, future, started, time.perf_counter()))
+        REGISTRY.inc("clip2pdf_server_requests_total", help="Render server requests", op=op)
+        timeout = job_timeout("open", "export") if op == "render_file" else job_timeout("paste", "export")
+        if timeout is None:
+            return future.result()
+        # Requests ahead: the others queued, and one on every (possibly busy) slot
+        ahead = max(0, sum(self.queue.depths().values()) - 1)
+        queue_wait = (-(-ahead // len(self.workers)) + 1) * timeout
+        if not started.wait(queue_wait) and future.cancel():
+            return {"ok": False, "error": f"No render slot was free within {queue_wait:g}s"}
+        try:
+            return future.result(timeout)
+        except FutureTimeout:
+            REGISTRY.inc("clip2pdf_server_timeouts_total", help="Render server requests that ran out of time")
+            return {"ok": False, "error": f"Render did not finish within {timeout:g}s"}
+
+    def _work(self, worker):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            request, future, started, queued_at = item
+            if not future.set_running_or_notify_cancel():
+                continue                # its client stopped waiting
+            started.set()
+            session = request.get("session") or "default"
+            REGISTRY.observe("clip2pdf_server_queue_seconds", time.perf_counter() - queued_at,
+                             help="Time requests wait for a worker slot")
+            try:
+                with span("server_render", worker=worker.name, session=session, op=request["op"]) as s:
+                    reply = worker.process(request)
+                    s.set(bytes=len(reply.get("data") or b""))
+            except Exception as render_error:
+                reply = {"ok": False, "error": str(render_error)}
+            with self._lock:
+                self.served[session] = self.served.get(session, 0) + 1
+            future.set_result(reply)
+
+    def shutdown(self):
+        self.queue.close()
+        self.listener.close()
+        for thread in self._threads:
+            thread.join()
+
+
+class RenderClient(Renderer):
+    """``Renderer`` that sends the clipboard snapshot to a render server"""
+
+    name = "server"
+
+    def __init__(self, address=SERVER_ADDRESS, session=None, authkey=None):
+        """``authkey`` defaults to ``load_authkey()``, read per request (the server may start later)"""
+        self.address = address
+        self.session = session
+        self.authkey = authkey
+        self._settings = None
+
+    def _render(self, request, outfile):
+        request["session"] = self.session
+        reply = call(self.address, request, self.authkey)
+        with open(outfile, "wb") as f:
+            f.write(reply["data"])
+        return reply.get("outcome")
+
+    def render(self, outfile, empty_text, failed_text):
+        from clipboard_capture import capture
+
+        # Capture here: the clipboard belongs to the client's machine
+        try:
+            snapshot = capture()
+        except Exception as capture_error:
+            print(f"Clipboard capture failed ({capture_error}), the server reads its own clipboard")
+            snapshot = None
+        return self.render_snapshot(snapshot, outfile, empty_text, failed_text)
+
+    def render_snapshot(self, snapshot, outfile, empty_text, failed_text):
+        request = {"op": "render", "formats": None, "empty": empty_text, "failed": failed_text}
+        if snapshot is not None:
+            request.update(formats=dict(snapshot.formats), source=snapshot.source)
+        return self._render(request, outfile)
+
+    def render_file(self, input_path, outfile):
+        with open(input_path, "rb") as f:
+            data = f.read()
+        self._render({"op": "render_file", "input_name": os.path.basename(input_path),
+                      "input_data": data}, outfile)
+
+    def settings(self):
+        if self._settings is None:
+            try:
+                self._settings = dict(call(self.address, {"op": "settings"}, self.authkey)["settings"],
+                                      server=self.address)
+            except Exception as settings_error:
+                # Not cached, so the next call asks the server again
+                print(f"Render server settings unavailable: {settings_error}")
+                return {"renderer": self.name, "server": self.address}
+        return self._settings
+
+
+def main(argv=None):
+    from renderers import RENDERERS, get_renderer, default_renderer_name
+
+    parser = argparse.ArgumentParser(description="Serve clipboard and file renders over a local socket")
+    parser.add_argument("--address", default=SERVER_ADDRESS,
+                        help="host:port, socket path or pipe name (default: CLIP2PDF_RENDER_SERVER)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="local worker slots (default: the Word pool size, 0 with --host)")
+    parser.add_argument("--renderer", choices=sorted(set(RENDERERS) - {"server"}), default=None,
+                        help="local rendering backend (default: CLIP2PDF_RENDERER or the platform default)")
+    parser.add_argument("--stand-in", action="store_true",
+                        help="render locally with the native engine, for testing without Office")
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds the stand-in waits per render")
+    parser.add_argument("--host", action="append", default=[], metavar="ADDRESS",
+                        help="another render server to forward work to (repeatable)")
+    parser.add_argument("--host-slots", type=int, default=2, help="concurrent requests per --host (default: 2)")
+    args = parser.parse_args(argv)
+
+    from render_jobs import DEFAULT_WORKERS
+    from render_watchdog import guarded
+
+    slots = args.workers if args.workers is not None else (0 if args.host else DEFAULT_WORKERS)
+    workers = []
+    if slots > 0:
+        if args.stand_in:
+            workers += [StandInWorker(args.delay)] * slots
+        else:
+            name = args.renderer or default_renderer_name()
+            if name == "server":
+                # The app's setting when it talks to this server; render for real here
+                name = "word" if os.name == 'nt' else "native"
+            options = {"pool_size": slots} if name == "word" else {}
+            # One circuit breaker for all slots: they share the renderer
+            workers += [LocalWorker(guarded(get_renderer(name, **options)))] * slots
+    for host in args.host:
+        workers += [RemoteWorker(host)] * max(1, args.host_slots)
+
+    server = RenderServer(workers, args.address)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print("Shutting down render server")
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
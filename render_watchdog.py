@@ -0,0 +1,244 @@
+"""Watchdog for render stages that hang, and a circuit breaker for failing renderers.
+
+Renderer stages run under ``deadline(stage)``.  One watchdog thread tracks
+every deadline; when one passes it calls the kill function the renderer
+registered for its thread with ``kill_with`` (for Word: terminate that
+instance's WINWORD process, which may be stuck in ``Content.Paste()`` or
+``ExportAsFixedFormat`` behind a dialog nobody sees), the blocked call
+fails, ``deadline`` raises ``RenderTimeout`` and the Word pool starts a
+fresh instance.
+
+``CircuitBreaker`` wraps a renderer: after ``CLIP2PDF_BREAKER_FAILURES``
+(default 3, 0 disables) failures in a row it rejects renders at once with
+``CircuitOpen`` for ``CLIP2PDF_BREAKER_COOLDOWN`` seconds (default 30,
+doubled after every failed trial, up to ``MAX_COOLDOWN``), then lets one
+trial render through; a success closes it again.
+
+Stage limits in seconds, 0 for none: ``CLIP2PDF_TIMEOUT_PASTE`` (default 60),
+``CLIP2PDF_TIMEOUT_EXPORT`` (120) and ``CLIP2PDF_TIMEOUT_OPEN`` (120, opening
+input files).  ``renderers.HangingRenderer`` (``CLIP2PDF_RENDERER=hang``)
+hangs on purpose so all of this can be exercised without Word.
+"""
+import os, time, heapq, itertools, threading
+from contextlib import contextmanager
+
+from metrics import REGISTRY
+from renderers import Renderer
+
+STAGE_TIMEOUTS = {
+    "paste": float(os.environ.get("CLIP2PDF_TIMEOUT_PASTE", "60")),
+    "export": float(os.environ.get("CLIP2PDF_TIMEOUT_EXPORT", "120")),
+    "open": float(os.environ.get("CLIP2PDF_TIMEOUT_OPEN", "120")),
+}
+KILL_GRACE = 30         # seconds a killed stage gets to return before its caller gives up
+BREAKER_FAILURES = int(os.environ.get("CLIP2PDF_BREAKER_FAILURES", "3"))
+BREAKER_COOLDOWN = float(os.environ.get("CLIP2PDF_BREAKER_COOLDOWN", "30"))
+MAX_COOLDOWN = 600
+
+
+class RenderTimeout(Exception):
+    """A renderer stage overran its deadline and the renderer was killed"""
+
+
+class CircuitOpen(Exception):
+    """The renderer failed repeatedly and is not being called for now"""
+
+
+class _Deadline:
+    def __init__(self, stage, timeout, kill):
+        self.stage = stage
+        self.timeout = timeout
+        self.kill = kill
+        self.expires = time.monotonic() + timeout
+        self.fired = False
+        self.disarmed = False
+        self._lock = threading.Lock()
+
+    def fire(self):
+        with self._lock:
+            if self.disarmed:
+                return
+            self.fired = True
+        REGISTRY.inc("clip2pdf_stage_timeouts_total", help="Stages stopped by the watchdog", stage=self.stage)
+        if self.kill is None:
+            print(f"Watchdog: {self.stage} exceeded {self.timeout:g}s and there is nothing to kill")
+            return
+        print(f"Watchdog: {self.stage} exceeded {self.timeout:g}s, killing the renderer")
+        try:
+            self.kill()
+        except Exception as kill_error:
+            print(f"Watchdog: could not kill the renderer: {kill_error}")
+
+    def disarm(self):
+        """Stop watching; True if the deadline had already fired"""
+        with self._lock:
+            self.disarmed = True
+            return self.fired
+
+
+class Watchdog:
+    """A single thread enforcing every armed deadline"""
+
+    def __init__(self):
+        self._heap = []                 # (expires, sequence, _Deadline)
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def arm(self, stage, timeout, kill=None):
+        armed = _Deadline(stage, timeout, kill)
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="render-watchdog", daemon=True)
+                self._thread.start()
+            heapq.heappush(self._heap, (armed.expires, next(self._sequence), armed))
+            self._cond.notify()
+        return armed
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    while self._heap and self._heap[0][2].disarmed:
+                        heapq.heappop(self._heap)
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    wait = self._heap[0][0] - time.monotonic()
+                    if wait <= 0:
+                        expired = heapq.heappop(self._heap)[2]
+                        break
+                    self._cond.wait(wait)
+            expired.fire()
+
+
+WATCHDOG = Watchdog()
+_local = threading.local()
+
+
+@contextmanager
+def kill_with(kill):
+    """Deadlines of stages run on this thread call ``kill()`` when they pass"""
+    previous = getattr(_local, "kill", None)
+    _local.kill = kill
+    try:
+        yield
+    finally:
+        _local.kill = previous
+
+
+@contextmanager
+def deadline(stage, timeout=None):
+    """Kill this thread's renderer if the block takes longer than the stage limit"""
+    if timeout is None:
+        timeout = STAGE_TIMEOUTS.get(stage, 0)
+    if not timeout:
+        yield
+        return
+    armed = WATCHDOG.arm(stage, timeout, getattr(_local, "kill", None))
+    message = f"Renderer hung in {stage} for more than {timeout:g}s and was stopped"
+    try:
+        yield
+    except Exception as stage_error:
+        if armed.disarm():
+            raise RenderTimeout(message) from stage_error
+        raise
+    if armed.disarm():
+        raise RenderTimeout(message)
+
+
+def job_timeout(*stages):
+    """Longest a job made of ``stages`` can take before its caller gives up; None if unlimited"""
+    limits = [STAGE_TIMEOUTS.get(stage, 0) for stage in stages]
+    if not all(limits):
+        return None
+    return sum(limits) + KILL_GRACE
+
+
+class CircuitBreaker(Renderer):
+    """Wraps a renderer and stops calling it while it keeps failing"""
+
+    def __init__(self, renderer, failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN):
+        self.renderer = renderer
+        self.name = renderer.name
+        self.failures = max(1, failures)
+        self.base_cooldown = cooldown
+        self._cooldown = cooldown
+        self._failed = 0                # failures in a row
+        self._open_until = None         # monotonic time, None while closed
+        self._trial = False             # a trial render is running
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._open_until is None:
+                return "closed"
+            return "half-open" if self._trial or time.monotonic() >= self._open_until else "open"
+
+    def _call(self, fn, *args):
+        self._admit()
+        try:
+            result = fn(*args)
+        except Exception as render_error:
+            self._record_failure(render_error)
+            raise
+        self._record_success()
+        return result
+
+    def _admit(self):
+        with self._lock:
+            if self._open_until is None:
+                return
+            remaining = self._open_until - time.monotonic()
+            if self._trial:
+                raise CircuitOpen(f"The {self.name} renderer keeps failing; a trial render is running")
+            if remaining > 0:
+                raise CircuitOpen(f"The {self.name} renderer failed {self._failed} times in a row; "
+                                  f"retrying in {remaining:.0f}s")
+            self._trial = True          # this call is the trial
+
+    def _record_failure(self, error):
+        with self._lock:
+            self._failed += 1
+            if self._trial:
+                self._trial = False
+                self._cooldown = min(self._cooldown * 2, MAX_COOLDOWN)
+            elif self._open_until is not None or self._failed < self.failures:
+                return
+            self._open_until = time.monotonic() + self._cooldown
+            cooldown = self._cooldown
+        REGISTRY.inc("clip2pdf_breaker_open_total", help="Times a renderer circuit breaker opened",
+                     renderer=self.name)
+        print(f"Circuit breaker: {self.name} renderer failed {self._failed} times in a row ({error}), "
+              f"pausing it for {cooldown:g}s")
+
+    def _record_success(self):
+        with self._lock:
+            reopened = self._open_until is not None
+            self._failed = 0
+            self._open_until = None
+            self._trial = False
+            self._cooldown = self.base_cooldown
+        if reopened:
+            print(f"Circuit breaker: {self.name} renderer works again")
+
+    def render(self, outfile, empty_text, failed_text):
+        return self._call(self.renderer.render, outfile, empty_text, failed_text)
+
+    def render_snapshot(self, snapshot, outfile, empty_text, failed_text):
+        return self._call(self.renderer.render_snapshot, snapshot, outfile, empty_text, failed_text)
+
+    def render_file(self, input_path, outfile):
+        self._call(self.renderer.render_file, input_path, outfile)
+
+    def settings(self):
+        return self.renderer.settings()
+
+    def close(self):
+        self.renderer.close()
+
+
+def guarded(renderer):
+    """``renderer`` behind a circuit breaker, unless ``CLIP2PDF_BREAKER_FAILURES=0``"""
+    return CircuitBreaker(renderer) if BREAKER_FAILURES > 0 else renderer
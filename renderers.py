@@ -0,0 +1,333 @@
+"""Rendering backends that turn the current clipboard content into a PDF.
+
+``create_pdf`` only talks to the ``Renderer`` interface.  ``WordRenderer``
+pastes into Microsoft Word through COM (Windows only, best fidelity) and
+``NativeRenderer`` renders the clipboard's HTML/RTF payload with the
+pure-Python engine in ``native_pdf`` (any OS, no Office needed).  Both can
+also render a ``clipboard_capture.Snapshot`` taken earlier instead of the
+live clipboard.
+
+The backend is picked with ``CLIP2PDF_RENDERER`` (``word``, ``native`` or
+``server``, which hands the work to ``render_server``); by default Word is
+used on Windows and the native engine everywhere else.  ``hang`` is a test
+double that hangs like a stuck Word (see ``render_watchdog``).
+"""
+import os, sys, tempfile, threading
+
+from metrics import span
+
+WD_STATISTIC_PAGES = 2                  # wdStatisticPages for Document.ComputeStatistics
+
+# What a render produced: the content, or one of the placeholder texts
+RENDERED, EMPTY, FAILED = "rendered", "empty", "failed"
+
+
+class Renderer:
+    """Interface every rendering backend implements"""
+
+    name = "base"
+
+    def render(self, outfile, empty_text, failed_text):
+        """Render the clipboard content into a PDF at ``outfile``.
+
+        ``empty_text`` is rendered instead when the clipboard holds nothing
+        usable and ``failed_text`` when reading it fails.  Returns
+        ``RENDERED``, ``EMPTY`` or ``FAILED`` accordingly (placeholders must
+        not be cached as the content's rendering).
+        """
+        raise NotImplementedError
+
+    def render_snapshot(self, snapshot, outfile, empty_text, failed_text):
+        """Render a ``clipboard_capture.Snapshot`` instead of the live clipboard.
+
+        Backends that cannot do this render the live clipboard instead.
+        Returns like ``render``.
+        """
+        return self.render(outfile, empty_text, failed_text)
+
+    def render_file(self, input_path, outfile):
+        """Convert an HTML, RTF or DOCX file into a PDF at ``outfile``"""
+        raise NotImplementedError
+
+    def settings(self):
+        """Everything besides the clipboard that affects the output, for cache keys"""
+        return {"renderer": self.name}
+
+    def close(self):
+        """Release the backend's resources"""
+
+
+class WordRenderer(Renderer):
+    """Paste into a pooled Word instance and export with ExportAsFixedFormat"""
+
+    name = "word"
+
+    def __init__(self, pool=None, pool_size=None):
+        from word_pool import WordPool
+
+        if pool is None:
+            pool = WordPool(pool_size) if pool_size else WordPool()
+        self.pool = pool
+
+    def render(self, outfile, empty_text, failed_text):
+        from render_watchdog import job_timeout
+
+        return self.pool.run(lambda word, doc: _paste_to_pdf(doc, outfile, empty_text, failed_text),
+                             timeout=job_timeout("paste", "export"))
+
+    def render_snapshot(self, snapshot, outfile, empty_text, failed_text):
+        from render_watchdog import job_timeout
+
+        return self.pool.run(lambda word, doc: _insert_to_pdf(doc, snapshot, outfile, empty_text, failed_text),
+                             timeout=job_timeout("paste", "export"))
+
+    def render_file(self, input_path, outfile):
+        from render_watchdog import job_timeout
+
+        self.pool.run(lambda word, doc: _open_to_pdf(word, input_path, outfile),
+                      timeout=job_timeout("open", "export"))
+
+    def close(self):
+        self.pool.shutdown()
+
+
+def _paste_to_pdf(doc, outfile, empty_text, failed_text):
+    """Paste the clipboard into a pooled template document and export it"""
+    from word_pool import WD_FORMAT_PDF
+    from render_watchdog import deadline, RenderTimeout
+
+    outcome = RENDERED
+    try:
+        with deadline("paste"), span("paste", renderer="word") as s:
+            doc.Content.Paste()                  # paste *as Word sees it* (text + pictures)
+            content_length = len(doc.Content.Text)
+            s.set(characters=content_length)
+        print(f"Content pasted, length: {content_length}")
+
+        if content_length <= 1:  # Empty or just paragraph mark
+            # Add some default text if clipboard is empty
+            doc.Content.Text = empty_text
+            outcome = EMPTY
+
+    except RenderTimeout:
+        raise                                   # Word was killed, nothing left to export
+    except Exception as paste_error:
+        print(f"Paste error: {paste_error}")
+        # Add default text if paste fails
+        doc.Content.Text = failed_text
+        outcome = FAILED
+
+    _export(doc, outfile, WD_FORMAT_PDF)
+    return outcome
+
+
+def _insert_to_pdf(doc, snapshot, outfile, empty_text, failed_text):
+    """Insert a clipboard snapshot into a pooled template document and export it"""
+    from word_pool import WD_FORMAT_PDF
+    from render_watchdog import deadline, RenderTimeout
+
+    outcome = RENDERED
+    try:
+        with deadline("paste"), span("paste", renderer="word", source="snapshot") as s:
+            if not _insert_snapshot(doc, snapshot):
+                # Only formats we cannot write to a file (e.g. Office's own): paste live
+                doc.Content.Paste()
+            content_length = len(doc.Content.Text)
+            s.set(characters=content_length)
+        print(f"Content inserted, length: {content_length}")
+
+        if content_length <= 1 and not doc.InlineShapes.Count:
+            doc.Content.Text = empty_text
+            outcome = EMPTY
+
+    except RenderTimeout:
+        raise
+    except Exception as paste_error:
+        print(f"Insert error: {paste_error}")
+        doc.Content.Text = failed_text
+        outcome = FAILED
+
+    _export(doc, outfile, WD_FORMAT_PDF)
+    return outcome
+
+
+def _insert_snapshot(doc, snapshot):
+    """Insert the snapshot's richest format into ``doc``; False if it has none"""
+    payload = snapshot.payload()
+    if payload.get("rtf"):
+        content, suffix = payload["rtf"].encode("latin-1"), ".rtf"
+    elif payload.get("html"):
+        content, suffix = ('<meta charset="utf-8">' + payload["html"]).encode("utf-8"), ".html"
+    else:
+        image = snapshot.image()
+        if image is None:
+            if payload.get("text"):
+                doc.Content.Text = payload["text"]
+                return True
+            return False
+        suffix, content = image
+
+    # Word reads formats from files, not from memory
+    handle, path = tempfile.mkstemp(suffix=suffix, prefix="clip2pdf_snapshot_")
+    try:
+        with os.fdopen(handle, "wb") as f:
+            f.write(content)
+        if suffix in (".rtf", ".html"):
+            doc.Content.InsertFile(path, ConfirmConversions=False)
+        else:
+            doc.InlineShapes.AddPicture(path, LinkToFile=False, SaveWithDocument=True)
+    finally:
+        os.remove(path)
+    return True
+
+
+def _export(doc, outfile, file_format):
+    from render_watchdog import deadline
+
+    with deadline("export"), span("export", renderer="word") as s:
+        doc.ExportAsFixedFormat(outfile, file_format)
+        s.set(pages=doc.ComputeStatistics(WD_STATISTIC_PAGES), bytes=os.path.getsize(outfile))
+
+
+def _open_to_pdf(word, input_path, outfile):
+    """Open a document file read-only in Word and export it"""
+    from word_pool import WD_FORMAT_PDF
+    from render_watchdog import deadline
+
+    with deadline("open"):
+        doc = word.Documents.Open(os.path.abspath(input_path), ConfirmConversions=False,
+                                  ReadOnly=True, AddToRecentFiles=False)
+    try:
+        _export(doc, os.path.abspath(outfile), WD_FORMAT_PDF)
+    finally:
+        try:
+            doc.Close(False)
+        except Exception as close_error:
+            # Word may have been killed by the watchdog: keep the original error
+            print(f"Could not close {os.path.basename(input_path)}: {close_error}")
+
+
+class NativeRenderer(Renderer):
+    """Render the clipboard's HTML/RTF/text payload without Office"""
+
+    name = "native"
+
+    def render(self, outfile, empty_text, failed_text):
+        from clipboard_capture import capture
+
+        try:
+            snapshot = capture()
+        except Exception as read_error:
+            print(f"Clipboard read error: {read_error}")
+            snapshot = None
+        return self.render_snapshot(snapshot, outfile, empty_text, failed_text)
+
+    def render_snapshot(self, snapshot, outfile, empty_text, failed_text):
+        import native_pdf
+
+        outcome = RENDERED
+        if snapshot is None:
+            blocks = [("p", failed_text)]
+            outcome = FAILED
+        else:
+            try:
+                with span("paste", renderer="native") as s:
+                    blocks = native_pdf.payload_to_blocks(snapshot.payload())
+                    s.set(blocks=len(blocks))
+                print(f"Content read, blocks: {len(blocks)}")
+                if not blocks:
+                    blocks = [("p", empty_text)]
+                    outcome = EMPTY
+            except Exception as read_error:
+                print(f"Clipboard read error: {read_error}")
+                blocks = [("p", failed_text)]
+                outcome = FAILED
+
+        with span("export", renderer="native") as s:
+            s.set(pages=native_pdf.write_pdf(blocks, outfile), bytes=os.path.getsize(outfile))
+        return outcome
+
+    def render_file(self, input_path, outfile):
+        import native_pdf
+
+        blocks = native_pdf.file_to_blocks(input_path) or [("p", "")]
+        with span("export", renderer="native") as s:
+            s.set(pages=native_pdf.write_pdf(blocks, outfile, title=os.path.basename(input_path)),
+                  bytes=os.path.getsize(outfile))
+
+    def settings(self):
+        import native_pdf
+
+        return {"renderer": self.name, "page": [native_pdf.PAGE_WIDTH, native_pdf.PAGE_HEIGHT],
+                "margin": native_pdf.MARGIN, "styles": native_pdf.STYLES}
+
+
+class HangingRenderer(NativeRenderer):
+    """Test double: hangs in ``stage`` like a stuck Word, then renders natively.
+
+    The hang is a child process that sleeps for ``seconds``; it is registered
+    with the watchdog (``render_watchdog.kill_with``), which kills it when the
+    stage limit passes, exactly as it kills a stuck WINWORD.  The first
+    ``hangs`` renders hang (every render when None), the rest behave.
+    """
+
+    name = "hang"
+
+    def __init__(self, stage="paste", hangs=None, seconds=3600):
+        self.stage = stage
+        self.hangs = hangs
+        self.seconds = seconds
+        self._lock = threading.Lock()
+
+    def _hang(self):
+        import subprocess
+        from render_watchdog import deadline, kill_with
+
+        with self._lock:
+            if self.hangs is not None:
+                if self.hangs <= 0:
+                    return
+                self.hangs -= 1
+        process = subprocess.Popen([sys.executable, "-c", f"import time; time.sleep({self.seconds})"])
+        with kill_with(process.kill), deadline(self.stage):
+            if process.wait() != 0:
+                raise Exception(f"Renderer process exited with status {process.returncode}")
+
+    def render_snapshot(self, snapshot, outfile, empty_text, failed_text):
+        self._hang()
+        return super().render_snapshot(snapshot, outfile, empty_text, failed_text)
+
+    def render_file(self, input_path, outfile):
+        self._hang()
+        super().render_file(input_path, outfile)
+
+    def settings(self):
+        return dict(super().settings(), renderer=self.name)
+
+
+def _server_client(**options):
+    from render_server import RenderClient
+
+    return RenderClient(**options)
+
+
+RENDERERS = {
+    WordRenderer.name: WordRenderer,
+    NativeRenderer.name: NativeRenderer,
+    HangingRenderer.name: HangingRenderer,
+    "server": _server_client,
+}
+
+
+def default_renderer_name():
+    return os.environ.get("CLIP2PDF_RENDERER") or ("word" if os.name == 'nt' else "native")
+
+
+def get_renderer(name=None, **options):
+    """Create the renderer called ``name`` (defaults to ``CLIP2PDF_RENDERER``)"""
+    if name is None:
+        name = default_renderer_name()
+    try:
+        return RENDERERS[name](**options)
+    except KeyError:
+        raise ValueError(f"Unknown renderer '{name}', expected one of: {', '.join(RENDERERS)}")
@@ -0,0 +1,174 @@
+"""Retention manager: keep generated PDFs within a byte and file-count budget.
+
+Every paste leaves files behind: a working-document directory per document
+(``manifest.DOCUMENTS_DIR``) and, from ``create_pdf``, loose PDFs in
+``pdf_output.OUTPUT_DIR``.  Both directories belong to this app alone;
+nothing outside them is ever touched.  ``RetentionManager``
+sweeps them on a background thread and deletes least recently used
+documents until both budgets hold again (down to 90%, so a sweep is not
+needed after every paste).  It never deletes
+
+* a document a live session has registered with ``keep`` (sessions renew
+  the registration on every rerun; silent for ``CLIP2PDF_RETENTION_SESSION_TTL``
+  seconds, default 3600, counts as gone),
+* anything modified in the last ``MIN_AGE`` seconds, which may still be
+  being rendered.
+
+Configuration: ``CLIP2PDF_RETENTION_MB`` (default 2048) and
+``CLIP2PDF_RETENTION_FILES`` (default 5000) - 0 disables that budget -
+and ``CLIP2PDF_RETENTION_INTERVAL``, seconds between sweeps (default 300).
+"""
+import os, time, shutil, threading
+
+from metrics import span, REGISTRY
+from manifest import DOCUMENTS_DIR
+from pdf_output import OUTPUT_DIR, lock_path
+
+MAX_BYTES = int(float(os.environ.get("CLIP2PDF_RETENTION_MB", "2048")) * 1024 * 1024)
+MAX_FILES = int(os.environ.get("CLIP2PDF_RETENTION_FILES", "5000"))
+SWEEP_INTERVAL = float(os.environ.get("CLIP2PDF_RETENTION_INTERVAL", "300"))
+SESSION_TTL = float(os.environ.get("CLIP2PDF_RETENTION_SESSION_TTL", "3600"))
+MIN_AGE = 120           # seconds; younger documents may still be being written
+
+
+class RetentionManager:
+    """Evicts least recently used documents to stay within the budgets"""
+
+    def __init__(self, documents_dir=DOCUMENTS_DIR, loose_dir=OUTPUT_DIR,
+                 max_bytes=MAX_BYTES, max_files=MAX_FILES, interval=SWEEP_INTERVAL,
+                 session_ttl=SESSION_TTL, min_age=MIN_AGE):
+        self.documents_dir = documents_dir
+        self.loose_dir = loose_dir
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.interval = interval
+        self.session_ttl = session_ttl
+        self.min_age = min_age
+        self._sessions = {}             # session id -> (real path, last seen)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Sweep every ``interval`` seconds (and on ``request_sweep``) in the background"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+
+    def request_sweep(self):
+        """Ask the background thread for a sweep now, without waiting for it"""
+        self._wake.set()
+
+    def keep(self, session, path):
+        """Protect ``path`` (a document directory or PDF) as ``session``'s live document"""
+        with self._lock:
+            if path:
+                self._sessions[session] = (os.path.realpath(path), time.time())
+            else:
+                self._sessions.pop(session, None)
+        if path:
+            try:
+                os.utime(path)          # viewed now: most recently used once released
+            except OSError:
+                pass
+
+    def release(self, session):
+        self.keep(session, None)
+
+    def protected(self):
+        """Real paths of the documents of live sessions"""
+        now = time.time()
+        with self._lock:
+            for session, (path, seen) in list(self._sessions.items()):
+                if now - seen > self.session_ttl:
+                    del self._sessions[session]
+            return {path for path, _ in self._sessions.values()}
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.sweep()
+            except Exception as sweep_error:
+                print(f"Retention sweep failed: {sweep_error}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def documents(self):
+        """``[(last used, bytes, files, path)]`` for every document under management"""
+        documents = []
+        if os.path.isdir(self.documents_dir):
+            for entry in os.scandir(self.documents_dir):
+                if entry.is_dir(follow_symlinks=False):
+                    documents.append(_directory_usage(entry.path))
+        if self.loose_dir and os.path.isdir(self.loose_dir):
+            for entry in os.scandir(self.loose_dir):
+                # Finished, temporary and half-written PDFs; lock files go with their PDF
+                if entry.is_file(follow_symlinks=False) and entry.name.endswith(".pdf"):
+                    stat = entry.stat()
+                    documents.append((max(stat.st_mtime, stat.st_atime), stat.st_size, 1, entry.path))
+        return documents
+
+    def sweep(self):
+        """Evict until within budget; returns ``(documents removed, bytes freed)``"""
+        with span("retention") as s:
+            documents = self.documents()
+            total_bytes = sum(size for _, size, _, _ in documents)
+            total_files = sum(files for _, _, files, _ in documents)
+            s.set(bytes=total_bytes, files=total_files)
+            if not self._over(total_bytes, total_files, 1.0):
+                return 0, 0
+
+            protected = self.protected()
+            now = time.time()
+            removed = freed = 0
+            for used, size, files, path in sorted(documents):
+                if not self._over(total_bytes, total_files, 0.9):
+                    break
+                if os.path.realpath(path) in protected or now - used < self.min_age:
+                    continue
+                try:
+                    if os.path.isdir(path):
+                        shutil.rmtree(path)
+                    else:
+                        os.remove(path)
+                        if os.path.exists(lock_path(path)):
+                            os.remove(lock_path(path))
+                except OSError as remove_error:
+                    print(f"Could not evict {path}: {remove_error}")
+                    continue
+                total_bytes -= size
+                total_files -= files
+                removed += 1
+                freed += size
+            s.set(removed=removed, freed=freed)
+        if removed:
+            REGISTRY.inc("clip2pdf_retention_evicted_total", removed, help="Documents evicted by retention")
+            REGISTRY.inc("clip2pdf_retention_freed_bytes_total", freed, help="Bytes freed by retention")
+            print(f"Retention: evicted {removed} document(s), freed {freed:,} bytes")
+        return removed, freed
+
+    def _over(self, total_bytes, total_files, fraction):
+        return ((self.max_bytes and total_bytes > self.max_bytes * fraction)
+                or (self.max_files and total_files > self.max_files * fraction))
+
+
+def _directory_usage(path):
+    """``(last used, bytes, files, path)`` of a document directory"""
+    used = os.stat(path).st_mtime
+    size = files = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                stat = os.stat(os.path.join(dirpath, filename))
+            except OSError:
+                continue                # removed while we looked
+            size += stat.st_size
+            files += 1
+            used = max(used, stat.st_mtime, stat.st_atime)
+    return used, size, files, path
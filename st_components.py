@@ -0,0 +1,34 @@
+"""Custom Streamlit components shipped with the app (see ``components/``).
+
+Each component is a single static ``index.html`` speaking Streamlit's
+component message protocol directly, so there is no frontend build step.
+"""
+import os
+import streamlit.components.v1 as components
+
+_COMPONENTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "components")
+
+# pdfjs-dist "build" directory; point this at a local copy for offline hosts
+PDFJS_BASE = os.environ.get("CLIP2PDF_PDFJS_URL", "https://cdn.jsdelivr.net/npm/pdfjs-dist@3.11.174/build")
+
+_pdf_viewer = components.declare_component("pdf_viewer", path=os.path.join(_COMPONENTS_DIR, "pdf_viewer"))
+_paste_listener = components.declare_component("paste_listener", path=os.path.join(_COMPONENTS_DIR, "paste_listener"))
+
+
+def pdf_viewer(url, height=800, key=None):
+    """In-browser pdf.js viewer that fetches ``url`` by byte range and only
+    renders the pages scrolled into view"""
+    return _pdf_viewer(url=url, height=height, pdfjs_base=PDFJS_BASE, key=key, default=None)
+
+
+def paste_listener(status="", send_payload=False, max_bytes=20 * 1024 * 1024, key=None):
+    """Page-wide Ctrl+V listener; returns the last paste event or None.
+
+    The event is ``{"id", "ts", "formats"}`` and is delivered over the
+    websocket without reloading the page.  With ``send_payload`` the
+    browser's clipboard content comes along in ``formats`` (text as str,
+    pictures as base64).  The same event is returned on every rerun until the
+    next paste, so callers compare ``id`` with the last one they handled.
+    """
+    return _paste_listener(status=status, send_payload=send_payload, max_bytes=max_bytes,
+                           key=key, default=None)
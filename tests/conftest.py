@@ -0,0 +1,36 @@
+import os, sys
+
+# The app is a set of top-level modules run from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("CLIP2PDF_LOG", "0")
+
+
+def make_pdf(path, labels, xref_stream=False):
+    """Write a PDF with one page per label, the label as its text.
+
+    With ``xref_stream`` the file uses a cross-reference stream and object
+    streams instead of a classic xref table.
+    """
+    import pikepdf
+    from native_pdf import write_pdf
+
+    parts = []
+    with pikepdf.new() as pdf:
+        for index, label in enumerate(labels):
+            part = f"{path}.{index}.part"
+            write_pdf([("h1", label)], part)
+            parts.append(pikepdf.open(part))
+            pdf.pages.extend(parts[-1].pages)
+        mode = pikepdf.ObjectStreamMode.generate if xref_stream else pikepdf.ObjectStreamMode.disable
+        pdf.save(path, object_stream_mode=mode)
+    for index, part in enumerate(parts):
+        part.close()
+        os.remove(f"{path}.{index}.part")
+    return str(path)
+
+
+def page_labels(path):
+    """The text of every page of ``path``, in order"""
+    from pypdf import PdfReader
+
+    return [page.extract_text().strip() for page in PdfReader(path).pages]
@@ -0,0 +1,72 @@
+import shutil
+
+import pytest
+
+pikepdf = pytest.importorskip("pikepdf")
+
+from conftest import make_pdf, page_labels
+from manifest import FragmentDocument
+
+
+def add(document, tmp_path, label, mode="append", index=None):
+    path = document.new_fragment_path()
+    shutil.copyfile(make_pdf(tmp_path / f"{label}.pdf", [label]), path)
+    document.add(path, mode, index)
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@pytest.fixture
+def document(tmp_path):
+    document = FragmentDocument.create("test", root=str(tmp_path / "documents"))
+    add(document, tmp_path, "A")
+    add(document, tmp_path, "B")
+    return document
+
+
+def test_assemble_builds_then_reuses(document):
+    outfile = document.assemble()
+    assert page_labels(outfile) == ["A", "B"]
+    before = read(outfile)
+
+    assert document.assemble() == outfile
+    assert read(outfile) == before
+
+
+def test_additions_at_the_ends_extend_the_assembly(document, tmp_path):
+    outfile = document.assemble()
+    before = read(outfile)
+
+    add(document, tmp_path, "C")
+    add(document, tmp_path, "Z", "prepend")
+    document.assemble()
+
+    assert read(outfile).startswith(before)         # extended in place
+    with pikepdf.open(outfile) as pdf:
+        assert pdf.check_pdf_syntax() == []
+    assert page_labels(outfile) == ["Z", "A", "B", "C"]
+
+
+def test_insert_in_the_middle_rebuilds(document, tmp_path):
+    outfile = document.assemble()
+    before = read(outfile)
+
+    add(document, tmp_path, "M", "insert", 1)
+    document.assemble()
+
+    assert not read(outfile).startswith(before)
+    with pikepdf.open(outfile) as pdf:
+        assert pdf.check_pdf_syntax() == []
+    assert page_labels(outfile) == ["A", "M", "B"]
+
+
+def test_assembly_of_a_reloaded_document(document, tmp_path):
+    document.assemble()
+    # Another session adds to the same document
+    other = FragmentDocument.load(document.directory)
+    add(other, tmp_path, "C")
+
+    assert page_labels(document.assemble()) == ["A", "B", "C"]
@@ -0,0 +1,30 @@
+import time
+
+import pytest
+
+from native_pdf import _wrap, text_width, write_pdf
+
+
+def test_wrap_breaks_long_token_quickly():
+    token = "A" * 10000
+    started = time.perf_counter()
+    lines = _wrap(token, "F1", 11, 400)
+    assert time.perf_counter() - started < 0.5
+    assert "".join(lines) == token
+    assert all(text_width(line, "F1", 11) <= 400 for line in lines)
+
+
+def test_wrap_keeps_words_and_breaks_only_overlong_ones():
+    lines = _wrap("short words " + "x" * 300 + " tail", "F1", 11, 200)
+    assert lines[0] == "short words"
+    assert lines[-1].endswith(" tail")
+    assert "".join(lines[1:]).replace(" tail", "") == "x" * 300
+
+
+def test_write_pdf_with_list_bullets(tmp_path):
+    pikepdf = pytest.importorskip("pikepdf")
+    outfile = tmp_path / "out.pdf"
+    write_pdf([("h1", "Title"), ("li", "item"), ("p", "y" * 5000)], str(outfile))
+    with pikepdf.open(outfile) as pdf:
+        assert pdf.check_pdf_syntax() == []
+        assert b"(\x95)" in pdf.pages[0].Contents.read_bytes()
@@ -0,0 +1,70 @@
+import pytest
+
+pikepdf = pytest.importorskip("pikepdf")
+
+from conftest import make_pdf, page_labels
+from pdf_incremental import append_incremental, merge_files, resource_index
+
+
+def check_syntax(path):
+    with pikepdf.open(path) as pdf:
+        assert pdf.check_pdf_syntax() == []
+
+
+@pytest.mark.parametrize("xref_stream", [False, True])
+@pytest.mark.parametrize("mode, expected", [
+    ("append", ["A1", "A2", "B1", "B2"]),
+    ("prepend", ["B1", "B2", "A1", "A2"]),
+])
+def test_append_incremental(tmp_path, mode, expected, xref_stream):
+    existing = make_pdf(tmp_path / "existing.pdf", ["A1", "A2"], xref_stream=xref_stream)
+    fragment = make_pdf(tmp_path / "fragment.pdf", ["B1", "B2"])
+    with open(existing, "rb") as f:
+        original = f.read()
+    assert (b"/XRef" in original) == xref_stream
+
+    assert append_incremental(existing, fragment, mode) == 2
+
+    with open(existing, "rb") as f:
+        assert f.read().startswith(original)        # an update, not a rewrite
+    check_syntax(existing)
+    assert page_labels(existing) == expected
+
+
+def test_repeated_updates_keep_order(tmp_path):
+    existing = make_pdf(tmp_path / "existing.pdf", ["A"], xref_stream=True)
+    for label, mode in (("B", "append"), ("Z", "prepend"), ("C", "append")):
+        append_incremental(existing, make_pdf(tmp_path / f"{label}.pdf", [label]), mode)
+    check_syntax(existing)
+    assert page_labels(existing) == ["Z", "A", "B", "C"]
+
+
+def font_objects(path):
+    with pikepdf.open(path) as pdf:
+        return [{font.objgen for font in page.Resources.Font.values()} for page in pdf.pages]
+
+
+@pytest.mark.parametrize("indexed", [False, True])
+def test_shared_fonts_are_not_copied_again(tmp_path, indexed):
+    existing = make_pdf(tmp_path / "existing.pdf", ["A"])
+    fragment = make_pdf(tmp_path / "fragment.pdf", ["B"])
+    shared = resource_index(existing) if indexed else None
+
+    append_incremental(existing, fragment, "append", shared)
+
+    check_syntax(existing)
+    fonts = font_objects(existing)
+    assert (fonts[0] == fonts[1]) == indexed
+
+
+def test_merge_files(tmp_path):
+    first = make_pdf(tmp_path / "first.pdf", ["A1", "A2"], xref_stream=True)
+    second = make_pdf(tmp_path / "second.pdf", ["B1"])
+    outfile = str(tmp_path / "merged.pdf")
+    shared = {}
+
+    assert merge_files([first, second], outfile, shared) == 3
+
+    check_syntax(outfile)
+    assert page_labels(outfile) == ["A1", "A2", "B1"]
+    assert shared
@@ -0,0 +1,113 @@
+import time, threading
+
+from render_jobs import JobQueue, QUEUED, RUNNING, DONE, FAILED, CANCELLED, FINISHED
+
+
+def test_finished_is_set_before_final_state():
+    queue = JobQueue(workers=1)
+    release = threading.Event()
+    job = queue.submit(lambda job: release.wait(5))
+    seen = []
+
+    def poll():
+        while job.state not in FINISHED:
+            pass
+        seen.append(job.finished)
+
+    poller = threading.Thread(target=poll)
+    poller.start()
+    release.set()
+    poller.join(5)
+    queue.shutdown()
+    assert job.state == DONE
+    assert seen and seen[0] is not None
+    assert job.elapsed >= 0
+
+
+def wait_finished(job, timeout=5):
+    deadline = time.time() + timeout
+    while job.state not in FINISHED and time.time() < deadline:
+        time.sleep(0.005)
+    return job.state
+
+
+def test_job_runs_through_queued_running_done():
+    queue = JobQueue(workers=1)
+    started, release = threading.Event(), threading.Event()
+
+    def fn(job):
+        started.set()
+        release.wait(5)
+        return "result"
+
+    blocker = queue.submit(fn, key="doc")
+    waiting = queue.submit(lambda job: "second", key="doc")
+    assert started.wait(5)
+    assert blocker.state == RUNNING
+    assert waiting.state == QUEUED              # same key: behind the running job
+    release.set()
+    assert wait_finished(blocker) == DONE and blocker.result == "result"
+    assert wait_finished(waiting) == DONE and waiting.result == "second"
+    queue.shutdown()
+
+
+def test_failed_job_keeps_its_error():
+    queue = JobQueue(workers=1)
+
+    def fn(job):
+        raise ValueError("boom")
+
+    job = queue.submit(fn)
+    assert wait_finished(job) == FAILED
+    assert job.error == "boom"
+    queue.shutdown()
+
+
+def test_cancel_before_start_and_at_a_checkpoint():
+    queue = JobQueue(workers=1)
+    started, release = threading.Event(), threading.Event()
+
+    def fn(job):
+        started.set()
+        release.wait(5)
+        job.check_cancelled()
+        return "added"
+
+    running = queue.submit(fn, key="doc")
+    queued = queue.submit(lambda job: "never", key="doc")
+    assert started.wait(5)
+    assert queue.cancel(queued.id) and queue.cancel(running.id)
+    release.set()
+    assert wait_finished(running) == CANCELLED
+    assert wait_finished(queued) == CANCELLED and queued.result is None
+    assert not queue.cancel(running.id)         # already finished
+    queue.shutdown()
+
+
+def test_cancel_after_the_last_checkpoint_is_done():
+    queue = JobQueue(workers=1)
+    started, release = threading.Event(), threading.Event()
+
+    def fn(job):
+        job.check_cancelled()
+        started.set()
+        release.wait(5)
+        return "added"
+
+    job = queue.submit(fn)
+    assert started.wait(5)
+    queue.cancel(job.id)
+    release.set()
+    assert wait_finished(job) == DONE and job.result == "added"
+    queue.shutdown()
+
+
+def test_jobs_of_one_key_run_in_submission_order():
+    queue = JobQueue(workers=4)
+    order = []
+    jobs = [queue.submit(lambda job, i=i: (time.sleep(0.01 * (5 - i)), order.append(i)), key="doc")
+            for i in range(5)]
+    for job in jobs:
+        assert wait_finished(job) == DONE
+    assert order == list(range(5))
+    queue.shutdown()
@@ -0,0 +1,34 @@
+import threading
+
+from render_server import FairQueue
+
+
+def test_sessions_take_turns():
+    queue = FairQueue()
+    for item in ("a1", "a2", "a3"):
+        queue.put("a", item)
+    queue.put("b", "b1")
+    queue.put("c", "c1")
+    queue.put("b", "b2")
+
+    assert [queue.get() for _ in range(6)] == ["a1", "b1", "c1", "a2", "b2", "a3"]
+    assert queue.depths() == {}
+
+
+def test_session_returning_goes_to_the_back():
+    queue = FairQueue()
+    queue.put("a", "a1")
+    queue.put("b", "b1")
+    assert queue.get() == "a1"
+    queue.put("a", "a2")
+    assert [queue.get(), queue.get()] == ["b1", "a2"]
+
+
+def test_close_releases_waiting_consumers():
+    queue = FairQueue()
+    results = []
+    consumer = threading.Thread(target=lambda: results.append(queue.get()))
+    consumer.start()
+    queue.close()
+    consumer.join(5)
+    assert results == [None]
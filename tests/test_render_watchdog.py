@@ -0,0 +1,73 @@
+import time
+
+import pytest
+
+from renderers import Renderer, RENDERED
+from render_watchdog import CircuitBreaker, CircuitOpen
+
+
+class FlakyRenderer(Renderer):
+    name = "flaky"
+
+    def __init__(self):
+        self.fail = True
+        self.calls = 0
+
+    def render(self, outfile, empty_text, failed_text):
+        self.calls += 1
+        if self.fail:
+            raise Exception("render failed")
+        return RENDERED
+
+
+def render(breaker):
+    return breaker.render("out.pdf", "empty", "failed")
+
+
+def test_breaker_opens_half_opens_and_closes():
+    renderer = FlakyRenderer()
+    breaker = CircuitBreaker(renderer, failures=2, cooldown=0.05)
+
+    for _ in range(2):
+        with pytest.raises(Exception, match="render failed"):
+            render(breaker)
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpen):
+        render(breaker)
+    assert renderer.calls == 2                  # rejected without calling the renderer
+
+    time.sleep(0.06)
+    assert breaker.state == "half-open"
+    renderer.fail = False
+    assert render(breaker) == RENDERED          # the trial succeeds
+    assert breaker.state == "closed"
+
+
+def test_failed_trial_reopens_for_longer():
+    renderer = FlakyRenderer()
+    breaker = CircuitBreaker(renderer, failures=1, cooldown=0.1)
+
+    with pytest.raises(Exception, match="render failed"):
+        render(breaker)
+    time.sleep(0.11)
+    with pytest.raises(Exception, match="render failed"):
+        render(breaker)                         # the trial fails
+    assert breaker.state == "open"
+    time.sleep(0.12)
+    assert breaker.state == "open"              # cooldown doubled to 0.2s
+    time.sleep(0.15)
+    assert breaker.state == "half-open"
+
+
+def test_success_resets_the_failure_count():
+    renderer = FlakyRenderer()
+    breaker = CircuitBreaker(renderer, failures=2, cooldown=10)
+
+    with pytest.raises(Exception):
+        render(breaker)
+    renderer.fail = False
+    render(breaker)
+    renderer.fail = True
+    with pytest.raises(Exception):
+        render(breaker)
+    assert breaker.state == "closed"
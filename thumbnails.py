@@ -0,0 +1,119 @@
+"""On-disk cache of rasterized PDF pages for the paginated viewer.
+
+Pages are rendered on demand, one PNG per (document hash, page, DPI), so the
+viewer only pays for the pages it actually shows and a re-shown page is a
+file read.  The cache directory is capped in size; the least recently used
+images are evicted first (a hit refreshes the file's mtime).
+
+Rasterizing uses PyMuPDF when installed (``pip install pymupdf``) and
+falls back to poppler's ``pdftoppm``.
+"""
+import os, shutil, hashlib, tempfile, threading, subprocess
+from functools import lru_cache
+
+CACHE_DIR = os.path.join(tempfile.gettempdir(), "clip2pdf_thumbnails")
+MAX_CACHE_BYTES = int(os.environ.get("CLIP2PDF_THUMB_CACHE_MB", "256")) * 1024 * 1024
+
+# Zoom levels offered by the viewer, in DPI
+ZOOM_LEVELS = {"small": 36, "medium": 72, "large": 144}
+
+
+def _pymupdf():
+    try:
+        import pymupdf
+        return pymupdf
+    except ImportError:
+        try:
+            import fitz  # older PyMuPDF releases
+            return fitz
+        except ImportError:
+            return None
+
+
+def rasterizer_available():
+    return _pymupdf() is not None or shutil.which("pdftoppm") is not None
+
+
+@lru_cache(maxsize=256)
+def document_hash(path, mtime_ns, size):
+    """SHA-256 of the file's content, computed once per (path, mtime, size)"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ThumbnailCache:
+    """Size-capped directory of page images"""
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._total = None              # bytes in the cache, counted lazily
+
+    def pages(self, pdf_path, doc_hash, page_indexes, dpi):
+        """PNG paths for ``page_indexes`` (0-based), rendering the missing ones"""
+        paths = {i: self._image_path(doc_hash, i, dpi) for i in page_indexes}
+        missing = []
+        for i, path in paths.items():
+            if os.path.exists(path):
+                os.utime(path)          # mark as recently used
+            else:
+                missing.append(i)
+        if missing:
+            self._render(pdf_path, missing, dpi, paths)
+            self._evict(keep=set(paths.values()))
+        return [paths[i] for i in page_indexes]
+
+    def _image_path(self, doc_hash, page_index, dpi):
+        return os.path.join(self.directory, f"{doc_hash[:32]}_p{page_index + 1}_{dpi}dpi.png")
+
+    def _render(self, pdf_path, page_indexes, dpi, paths):
+        pymupdf = _pymupdf()
+        added = 0
+        if pymupdf is not None:
+            with pymupdf.open(pdf_path) as doc:
+                for i in page_indexes:
+                    tmp = paths[i] + ".tmp.png"
+                    doc.load_page(i).get_pixmap(dpi=dpi).save(tmp)
+                    os.replace(tmp, paths[i])
+                    added += os.path.getsize(paths[i])
+        else:
+            for i in page_indexes:
+                prefix = paths[i][:-len(".png")] + ".tmp"
+                subprocess.run(["pdftoppm", "-png", "-r", str(dpi), "-f", str(i + 1),
+                                "-l", str(i + 1), "-singlefile", pdf_path, prefix],
+                               check=True, capture_output=True, timeout=60)
+                os.replace(prefix + ".png", paths[i])
+                added += os.path.getsize(paths[i])
+        with self._lock:
+            if self._total is not None:
+                self._total += added
+
+    def _evict(self, keep=()):
+        """Delete least recently used images until under the cap, except ``keep``"""
+        with self._lock:
+            if self._total is not None and self._total <= self.max_bytes:
+                return
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and entry.name.endswith(".png"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            # Least recently used first, down to 90% so eviction is not run per render
+            target = self.max_bytes * 0.9 if total > self.max_bytes else total
+            for _, size, path in sorted(entries):
+                if total <= target:
+                    break
+                if path in keep:
+                    continue
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+            self._total = total
@@ -1,157 +1,254 @@
 from os.path import isfile
-import streamlit as st, base64, pathlib, os
+import streamlit as st, base64, pathlib, os, time, uuid
+import streamlit.components.v1 as components
+from renderers import get_renderer, default_renderer_name
+from render_cache import cached
+from render_watchdog import guarded
+from clipboard_capture import capture, from_browser, ClipboardWatcher
+from pdf_builder import add_clipboard_fragment
+from manifest import FragmentDocument, MANIFEST_NAME
+from catalog import Catalog
+from pdf_optimize import LINEARIZE
+from pdf_info import file_key, read_pdf_info
+from pdf_server import FileServer
+from retention import RetentionManager
+from render_jobs import JobQueue, QUEUED, RUNNING, DONE, FAILED, FINISHED
+from st_components import pdf_viewer, paste_listener
+from thumbnails import ThumbnailCache, ZOOM_LEVELS, document_hash, rasterizer_available
 
-def create_pdf(prefix="clipboard", mode="new", existing_pdf_path=None):
-    import os, tempfile, datetime, win32com.client, pythoncom  # pip install pywin32
+# Parsed documents kept across reruns; entries are small (no PDF bytes)
+PDF_INFO_CACHE_ENTRIES = int(os.environ.get("CLIP2PDF_INFO_CACHE_ENTRIES", "64"))
+# Render the browser's clipboard (sent with the paste event) instead of the server's
+BROWSER_CLIPBOARD = os.environ.get("CLIP2PDF_BROWSER_CLIPBOARD", "0") == "1"
 
-    # Initialize COM
-    pythoncom.CoInitialize()
+
+@st.cache_resource
+def get_shared_renderer():
+    """Rendering backend (and its warm Word pool) shared by every session"""
+    return cached(guarded(get_renderer()))
+
+
+def session_renderer():
+    """Renderer for this session's pastes.
+
+    In-process backends are shared by every session.  With the render server
+    (``CLIP2PDF_RENDERER=server``) each session gets its own client, so the
+    server can take turns between sessions.
+    """
+    if default_renderer_name() != "server":
+        return get_shared_renderer()
+    if 'renderer' not in st.session_state:
+        st.session_state.renderer = cached(guarded(get_renderer("server", session=st.session_state.session_id)))
+    return st.session_state.renderer
+
+
+@st.cache_resource
+def get_file_server():
+    """HTTP route serving generated PDFs from disk (Range/ETag/sendfile)"""
+    try:
+        return FileServer()
+    except OSError as e:
+        # Configured port taken (e.g. a second app instance): use any free one
+        print(f"File server port unavailable ({e}), using an ephemeral port")
+        return FileServer(port=0)
+
+
+@st.cache_resource
+def get_catalog():
+    """Persistent SQLite/FTS5 catalog of every generated document"""
+    return Catalog()
+
+
+@st.cache_resource
+def get_job_queue():
+    """Background render workers shared by every session"""
+    return JobQueue()
+
+
+@st.cache_resource
+def get_retention():
+    """Background eviction of old documents; live sessions' documents are kept"""
+    return RetentionManager().start()
+
+
+@st.cache_resource
+def get_thumbnail_cache():
+    """Size-capped on-disk cache of rendered page images"""
+    return ThumbnailCache()
+
+
+@st.cache_data(max_entries=PDF_INFO_CACHE_ENTRIES, show_spinner=False)
+def cached_pdf_info(path, mtime_ns, size):
+    """``read_pdf_info`` memoized on (path, mtime, size), least recently used evicted first"""
+    return read_pdf_info(path)
+
+
+def current_document():
+    """The session's working document, or None before the first paste"""
+    directory = st.session_state.get('document_dir')
+    if directory and isfile(os.path.join(directory, MANIFEST_NAME)):
+        document = FragmentDocument.load(directory)
+        if document.fragments:
+            return document
+    return None
+
+
+def run_paste_job(job, directory, mode, index, renderer, catalog, snapshot=None):
+    """Background job: render a clipboard snapshot into the document at ``directory``"""
+    # Load the manifest here: earlier jobs of this document may have changed it
+    document = FragmentDocument.load(directory)
+    add_clipboard_fragment(document, mode, renderer, index, checkpoint=job.check_cancelled,
+                           snapshot=snapshot)
     
+    # Record the document; its new fragment's text is indexed in the background
     try:
-        wdFormatPDF = 17                       # constant for PDF export
-        word = win32com.client.Dispatch("Word.Application")
-        word.Visible = False                   # keep UI hidden
-        
-        if mode == "new" or not existing_pdf_path or not os.path.exists(existing_pdf_path):
-            # Create new PDF
-            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"{prefix}_{timestamp}.pdf"
-            outfile = os.path.join(tempfile.gettempdir(), filename)
-            
-            doc = word.Documents.Add()           # blank document
-            
-            # Check if clipboard has content
-            try:
-                doc.Content.Paste()                  # paste *as Word sees it* (text + pictures)
-                content_length = len(doc.Content.Text)
-                print(f"Content pasted, length: {content_length}")
-                
-                if content_length <= 1:  # Empty or just paragraph mark
-                    # Add some default text if clipboard is empty
-                    doc.Content.Text = "No content found in clipboard. This is a test PDF."
-                    
-            except Exception as paste_error:
-                print(f"Paste error: {paste_error}")
-                # Add default text if paste fails
-                doc.Content.Text = "Failed to paste clipboard content. This is a test PDF."
-            
-            doc.ExportAsFixedFormat(outfile, wdFormatPDF)
-            doc.Close(False)
-            
-        else:
-            # For append/prepend modes, create a new merged PDF with unique name
-            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"{prefix}_{mode}_{timestamp}.pdf"
-            outfile = os.path.join(tempfile.gettempdir(), filename)
-            
-            # Create temporary PDF with new clipboard content
-            temp_timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            temp_filename = f"temp_clipboard_{temp_timestamp}.pdf"
-            temp_pdf_path = os.path.join(tempfile.gettempdir(), temp_filename)
-            
-            # Create new document with clipboard content
-            doc = word.Documents.Add()
-            try:
-                doc.Content.Paste()
-                content_length = len(doc.Content.Text)
-                print(f"New content pasted, length: {content_length}")
-                
-                if content_length <= 1:  # Empty or just paragraph mark
-                    doc.Content.Text = "No new content found in clipboard."
-                    
-            except Exception as paste_error:
-                print(f"Paste error: {paste_error}")
-                doc.Content.Text = "Failed to paste new clipboard content."
-            
-            doc.ExportAsFixedFormat(temp_pdf_path, wdFormatPDF)
-            doc.Close(False)
-            
-            # Verify temporary PDF was created
-            if not os.path.exists(temp_pdf_path) or os.path.getsize(temp_pdf_path) == 0:
-                raise Exception("Failed to create temporary PDF with new content")
-            
-            # Now merge the PDFs using pypdf
-            try:
-                from pypdf import PdfReader, PdfWriter
-            except ImportError:
-                try:
-                    from PyPDF2 import PdfReader, PdfWriter
-                except ImportError:
-                    raise ImportError("Please install pypdf or PyPDF2: pip install pypdf")
-            
-            # Validate existing PDF
-            if not os.path.exists(existing_pdf_path) or os.path.getsize(existing_pdf_path) == 0:
-                raise Exception("Existing PDF file is invalid or empty")
-            
-            # Create merged PDF
-            writer = PdfWriter()
-            
-            try:
-                if mode == "prepend":
-                    # Add new content first, then existing content
-                    print("Adding new content first (prepend mode)")
-                    new_reader = PdfReader(temp_pdf_path)
-                    for i, page in enumerate(new_reader.pages):
-                        writer.add_page(page)
-                        print(f"Added new page {i+1}")
-                    
-                    print("Adding existing content")
-                    existing_reader = PdfReader(existing_pdf_path)
-                    for i, page in enumerate(existing_reader.pages):
-                        writer.add_page(page)
-                        print(f"Added existing page {i+1}")
-                else:  # append
-                    # Add existing content first, then new content
-                    print("Adding existing content first (append mode)")
-                    existing_reader = PdfReader(existing_pdf_path)
-                    for i, page in enumerate(existing_reader.pages):
-                        writer.add_page(page)
-                        print(f"Added existing page {i+1}")
-                    
-                    print("Adding new content")
-                    new_reader = PdfReader(temp_pdf_path)
-                    for i, page in enumerate(new_reader.pages):
-                        writer.add_page(page)
-                        print(f"Added new page {i+1}")
-                
-                # Save merged PDF
-                with open(outfile, 'wb') as output_file:
-                    writer.write(output_file)
-                
-                # Verify merged PDF was created successfully
-                if not os.path.exists(outfile) or os.path.getsize(outfile) == 0:
-                    raise Exception("Failed to create merged PDF")
-                
-                print(f"Merged PDF created successfully: {outfile}")
-                
-            except Exception as merge_error:
-                print(f"PDF merge error: {merge_error}")
-                raise Exception(f"Failed to merge PDFs: {merge_error}")
-            
-            finally:
-                # Clean up temporary file
-                try:
-                    if os.path.exists(temp_pdf_path):
-                        os.remove(temp_pdf_path)
-                        print("Temporary PDF cleaned up")
-                except Exception as cleanup_error:
-                    print(f"Warning: Could not clean up temporary file: {cleanup_error}")
-        
-        word.Quit()
-        print("Saved:", outfile)
-        return outfile
-        
-    except Exception as e:
-        # Ensure Word is closed even if there's an error
+        catalog.index_document_async(document, mode)
+    except Exception as catalog_error:
+        print(f"Could not record document in catalog: {catalog_error}")
+    return document.name
+
+
+def submit_paste(prefix, mode, index=None, snapshot=None):
+    """Queue rendering a clipboard snapshot (taken now if not given) into the session's document"""
+    if snapshot is None:
+        # Capture right away: the clipboard may change before a worker is free
+        try:
+            snapshot = capture()
+        except Exception as capture_error:
+            print(f"Clipboard capture failed ({capture_error}), rendering the live clipboard")
+    
+    # Pastes only render a fragment and edit the manifest; nothing is merged here
+    existing_document = current_document() is not None
+    mode = mode if existing_document else "append"
+    directory = st.session_state.document_dir
+    if not existing_document and not (directory and isfile(os.path.join(directory, MANIFEST_NAME))):
+        directory = FragmentDocument.create(prefix).directory
+        st.session_state.document_dir = directory
+    
+    # Rendering runs on a background worker; the page polls for the result
+    action = {'append': 'Append', 'prepend': 'Prepend'}.get(mode, 'Insert') if existing_document else 'Create'
+    renderer = session_renderer()
+    job = get_job_queue().submit(
+        lambda job: run_paste_job(job, directory, mode, index,
+                                  renderer, get_catalog(), snapshot),
+        description=f"{action} {os.path.basename(directory)}",
+        key=directory)
+    st.session_state.jobs.append(job.id)
+    get_retention().request_sweep()     # make room in the background if over budget
+    return job
+
+
+def session_watcher(enabled):
+    """Start or stop this session's clipboard watcher; returns it while enabled.
+
+    A watcher left idle (the session went away, see ``clipboard_capture.WATCH_IDLE``) stops
+    itself; it is replaced if the session comes back.
+    """
+    watcher = st.session_state.get('clipboard_watcher')
+    if enabled and (watcher is None or watcher.stopped):
+        watcher = ClipboardWatcher()
+        watcher.start()
+        st.session_state.clipboard_watcher = watcher
+    elif not enabled and watcher is not None:
+        watcher.stop()
+        st.session_state.clipboard_watcher = watcher = None
+    return watcher
+
+
+def watch_clipboard():
+    """Watch mode: append every new clipboard snapshot to the working document"""
+    watcher = st.session_state.get('clipboard_watcher')
+    if watcher is None:
+        return
+    snapshots = watcher.drain()
+    prefix = st.session_state.get('pdf_prefix', '').strip() or "document"
+    for snapshot in snapshots:
         try:
-            word.Quit()
-        except:
-            pass
-        print(f"Error in create_pdf: {e}")
-        raise e
-    finally:
-        # Clean up COM
-        pythoncom.CoUninitialize()
+            submit_paste(prefix, "append", snapshot=snapshot)
+        except Exception as e:
+            st.error(f"Error creating PDF: {str(e)}")
+    if snapshots:
+        st.rerun()                      # show the new jobs
+
+
+def linearize_in_background(document):
+    """Queue linearizing the assembled document (``CLIP2PDF_LINEARIZE``), once per version of it"""
+    if LINEARIZE == "off":
+        return
+    version = (document.directory, os.path.getsize(document.output_path))
+    if st.session_state.get('linearize_requested') == version:
+        return
+    st.session_state.linearize_requested = version
+    # Same key as the pastes: runs between them, never inside one
+    get_job_queue().submit(lambda job: document.linearize(),
+                           description=f"Linearize {document.name}", key=document.directory)
+
+
+def report_finished_jobs():
+    """Show the outcome of this session's finished jobs once, then forget them"""
+    pending = []
+    for job in get_job_queue().jobs(st.session_state.jobs):
+        if job.state == DONE:
+            st.success(f"{job.description}: done ({job.elapsed:.1f}s)")
+        elif job.state == FAILED:
+            st.error(f"Error creating PDF: {job.error}")
+        elif job.state not in FINISHED:
+            pending.append(job.id)
+    st.session_state.jobs = pending
+
+
+def show_jobs():
+    """Queued and running jobs of this session, with a cancel button each"""
+    jobs = get_job_queue().jobs(st.session_state.jobs)
+    if any(job.state in FINISHED for job in jobs):
+        st.rerun()                      # a job finished: refresh the whole page
+    for job in jobs:
+        status_col, cancel_col = st.columns([4, 1])
+        with status_col:
+            icon = "⏳" if job.state == QUEUED else "⚙️"
+            note = " (cancelling)" if job.cancel_requested else ""
+            st.info(f"{icon} {job.description}: {job.state}{note}, {job.elapsed:.0f}s")
+        with cancel_col:
+            if job.state in (QUEUED, RUNNING) and not job.cancel_requested:
+                if st.button("Cancel", key=f"cancel_job_{job.id}"):
+                    get_job_queue().cancel(job.id)
+                    st.rerun()
+
+
+# Poll the job list and the clipboard watcher in place where Streamlit supports fragments
+if hasattr(st, "fragment"):
+    show_jobs = st.fragment(run_every=1.0)(show_jobs)
+    watch_clipboard = st.fragment(run_every=1.0)(watch_clipboard)
+
+
+def show_page_viewer(path, page_count):
+    """Paginated page thumbnails; only the pages on screen are rasterized"""
+    if not rasterizer_available():
+        st.info("💡 Install PyMuPDF (`pip install pymupdf`) or poppler to see page thumbnails")
+        return
+    
+    st.markdown("**Pages:**")
+    zoom_col, nav_col = st.columns(2)
+    with zoom_col:
+        zoom = st.select_slider("Zoom", options=list(ZOOM_LEVELS), value="small", key="thumb_zoom")
+    per_row = {"small": 4, "medium": 3, "large": 1}[zoom]
+    per_view = per_row * 3
+    views = max(1, (page_count + per_view - 1) // per_view)
+    with nav_col:
+        view = st.number_input(
+            f"Page group (of {views})",
+            min_value=1,
+            max_value=views,
+            value=1,
+            step=1,
+            key=f"thumb_view_{per_view}_{views}"
+        ) - 1
+    
+    indexes = list(range(view * per_view, min((view + 1) * per_view, page_count)))
+    images = get_thumbnail_cache().pages(path, document_hash(*file_key(path)), indexes, ZOOM_LEVELS[zoom])
+    for row in range(0, len(indexes), per_row):
+        for column, i, image in zip(st.columns(per_row), indexes[row:row + per_row], images[row:row + per_row]):
+            column.image(image, caption=f"Page {i + 1}")
 
 
 def show_pdf(path: str | pathlib.Path):
@@ -167,144 +264,70 @@ def show_pdf(path: str | pathlib.Path):
             st.error("PDF file is empty")
             return
         
-        with open(path, "rb") as f:
-            pdf_bytes = f.read()
-        
-        # Validate PDF content
-        if len(pdf_bytes) == 0:
-            st.error("PDF file contains no data")
-            return
-        
         # Extract filename from path
         filename = os.path.basename(path)
         
+        # Parsed once per file version, reruns reuse the cached result
+        info = cached_pdf_info(*file_key(path))
+        
+        # The file is streamed from disk by the file server; no PDF bytes
+        # are held in the session
+        pdf_url = get_file_server().register(path)
+        
         # Method 1: Download button (always works)
-        st.download_button(
-            label="📥 Download PDF",
-            data=pdf_bytes,
-            file_name=filename,
-            mime="application/pdf",
-            key=f"download_{filename}"
-        )
+        st.link_button("📥 Download PDF", f"{pdf_url}?download=1")
         
         st.markdown("### PDF Preview")
+        if info["valid"]:
+            preview_mode = st.radio(
+                "Preview:",
+                options=["In-page viewer", "Browser viewer", "Page thumbnails"],
+                index=0,
+                horizontal=True,
+                key="preview_mode",
+                help="In-page viewer: pdf.js renders visible pages in your browser\n"
+                     "Browser viewer: your browser's built-in PDF viewer\n"
+                     "Page thumbnails: pages rasterized on the server"
+            )
+            if preview_mode == "In-page viewer":
+                # Versioned URL so the component reloads when the file changes
+                pdf_viewer(f"{pdf_url}?v={os.stat(path).st_mtime_ns}", height=800, key="pdf_viewer")
+            elif preview_mode == "Browser viewer":
+                # The browser's viewer fetches the file with Range requests
+                components.iframe(pdf_url, height=800, scrolling=True)
+            elif info["pages"]:
+                try:
+                    show_page_viewer(path, info["pages"])
+                except Exception as viewer_error:
+                    st.warning(f"Could not render page thumbnails: {viewer_error}")
         
         # Method 2: Use a simplified approach - just show the first few KB as text preview
         # and provide links to open externally
         try:
             # Check if it's a valid PDF by looking at the header
-            pdf_header = pdf_bytes[:10]
-            if pdf_header.startswith(b'%PDF-'):
+            if info["valid"]:
                 st.success("✅ Valid PDF file detected")
                 
-                # Try to extract text from first page for preview
-                try:
-                    from pypdf import PdfReader
-                    import io
-                    reader = PdfReader(io.BytesIO(pdf_bytes))
-                    if len(reader.pages) > 0:
-                        first_page_text = reader.pages[0].extract_text()
-                        if first_page_text.strip():
-                            st.markdown("**Text Content Preview (First Page):**")
-                            # Show first 500 characters
-                            preview_text = first_page_text[:500]
-                            if len(first_page_text) > 500:
-                                preview_text += "..."
-                            st.text(preview_text)
-                        else:
-                            st.info("PDF contains no extractable text (may be image-based)")
+                # Text preview of the first page
+                if info["preview_error"]:
+                    st.warning(f"Could not extract text preview: {info['preview_error']}")
+                elif info["pages"]:
+                    if info["preview"].strip():
+                        st.markdown("**Text Content Preview (First Page):**")
+                        st.text(info["preview"])
                     else:
-                        st.warning("PDF appears to have no pages")
-                except Exception as text_error:
-                    st.warning(f"Could not extract text preview: {text_error}")
+                        st.info("PDF contains no extractable text (may be image-based)")
+                else:
+                    st.warning("PDF appears to have no pages")
                 
-                # Create buttons to open PDF externally
+                # The in-page viewer replaces opening the PDF in an external application
                 st.markdown("**Open PDF:**")
-                col1, col2, col3 = st.columns(3)
+                col1, col2 = st.columns(2)
                 
                 with col1:
-                    if st.button("📄 Open with Default", key="open_default"):
-                        try:
-                            # Use os.startfile to open with default application
-                            os.startfile(str(path))
-                            st.success("PDF opened with default application")
-                        except Exception as e:
-                            st.error(f"Could not open PDF: {e}")
+                    st.link_button("🌐 Open in Browser Tab", pdf_url)
                 
                 with col2:
-                    if st.button("🌐 Force Browser", key="open_browser"):
-                        try:
-                            import webbrowser
-                            import tempfile
-                            import shutil
-                            import urllib.parse
-                            
-                            # Copy to a temp file with .pdf extension for browser access
-                            temp_dir = tempfile.gettempdir()
-                            safe_filename = filename.replace(' ', '_').replace('(', '').replace(')', '')
-                            temp_pdf = os.path.join(temp_dir, f"browser_{safe_filename}")
-                            
-                            # Copy the file
-                            shutil.copy2(path, temp_pdf)
-                            st.info(f"Copied PDF to: {temp_pdf}")
-                            
-                            # Create proper file URL
-                            temp_pdf_escaped = temp_pdf.replace('\\', '/')
-                            file_url = f"file:///{temp_pdf_escaped}"
-                            
-                            # Make the URL clickable in new tab
-                            st.markdown(f"**Opening URL:** <a href='{file_url}' target='_blank'>Click here to open PDF</a>", unsafe_allow_html=True)
-                            st.code(file_url)
-                            
-                            # Try to open in browser
-                            opened = False
-                            
-                            # Method 1: Try default browser first
-                            try:
-                                webbrowser.open(file_url, new=2)  # new=2 opens in new tab
-                                st.success("PDF opened in default browser")
-                                opened = True
-                            except Exception as e1:
-                                st.warning(f"Default browser failed: {e1}")
-                            
-                            # Method 2: Try Chrome specifically
-                            if not opened:
-                                try:
-                                    chrome = webbrowser.get('chrome')
-                                    chrome.open(file_url, new=2)
-                                    st.success("PDF opened in Chrome")
-                                    opened = True
-                                except Exception as e2:
-                                    st.warning(f"Chrome failed: {e2}")
-                            
-                            # Method 3: Try Edge specifically  
-                            if not opened:
-                                try:
-                                    edge = webbrowser.get('edge')
-                                    edge.open(file_url, new=2)
-                                    st.success("PDF opened in Edge")
-                                    opened = True
-                                except Exception as e3:
-                                    st.warning(f"Edge failed: {e3}")
-                            
-                            # Method 4: Try system default
-                            if not opened:
-                                try:
-                                    os.startfile(temp_pdf)
-                                    st.success("PDF opened with system default")
-                                    opened = True
-                                except Exception as e4:
-                                    st.warning(f"System default failed: {e4}")
-                            
-                            if not opened:
-                                st.error("Could not open PDF in any browser")
-                                st.code(f"Manual file path: {temp_pdf}")
-                                    
-                        except Exception as e:
-                            st.error(f"Error in browser opening: {str(e)}")
-                            st.code(f"Original file path: {str(path)}")
-                
-                with col3:
                     if st.button("📂 File Location", key="open_location"):
                         try:
                             import subprocess
@@ -359,18 +382,15 @@ def show_pdf(path: str | pathlib.Path):
         st.text(f"Location: {path}")
         st.text(f"Size: {file_size:,} bytes")
         
-        # Try to extract basic PDF info
-        try:
-            from pypdf import PdfReader
-            reader = PdfReader(path)
-            st.text(f"Pages: {len(reader.pages)}")
-            if reader.metadata:
-                if '/Title' in reader.metadata:
-                    st.text(f"Title: {reader.metadata['/Title']}")
-                if '/Author' in reader.metadata:
-                    st.text(f"Author: {reader.metadata['/Author']}")
-        except Exception as info_error:
-            st.text(f"Could not extract PDF info: {info_error}")
+        # Basic PDF info, from the same cached parse
+        if info["pages_error"]:
+            st.text(f"Could not extract PDF info: {info['pages_error']}")
+        elif info["pages"] is not None:
+            st.text(f"Pages: {info['pages']}")
+            if info["title"]:
+                st.text(f"Title: {info['title']}")
+            if info["author"]:
+                st.text(f"Author: {info['author']}")
             
     except Exception as e:
         st.error(f"Error displaying PDF: {str(e)}")
@@ -386,32 +406,48 @@ st.title("PDF Viewer")
 # Initialize session state
 if 'pdf_path' not in st.session_state:
     st.session_state.pdf_path = None
+if 'document_dir' not in st.session_state:
+    st.session_state.document_dir = None
+if 'jobs' not in st.session_state:
+    st.session_state.jobs = []
+if 'last_paste_id' not in st.session_state:
+    st.session_state.last_paste_id = None
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex[:12]
 
-# JavaScript for keyboard shortcut detection
-keyboard_js = """
-<script>
-document.addEventListener('keydown', function(event) {
-    if (event.ctrlKey && event.key === 'v') {
-        event.preventDefault();
-        
-        // Add query parameter and reload page
-        const url = new URL(window.location);
-        url.searchParams.set('ctrl_v', 'true');
-        window.location.href = url.toString();
-    }
-});
-</script>
-"""
+document = current_document()
 
-st.markdown(keyboard_js, unsafe_allow_html=True)
-
-# Check if Ctrl+V was pressed (using query params)
-query_params = st.query_params
-ctrl_v_triggered = 'ctrl_v' in query_params and query_params['ctrl_v'] == 'true'
+# Sidebar: full-text search over every PDF generated so far
+with st.sidebar:
+    st.markdown("### Search past PDFs")
+    search_text = st.text_input("Search text:", key="catalog_search", placeholder="Words to find")
+    if search_text.strip():
+        try:
+            results = get_catalog().search(search_text)
+        except Exception as search_error:
+            results = []
+            st.error(f"Search failed: {search_error}")
+        if not results:
+            st.info("No matches")
+        for i, result in enumerate(results):
+            st.markdown(f"**{result['name']}** — page {result['page']}")
+            st.caption(result['snippet'])
+            if os.path.isdir(result['path']) and st.button("Open", key=f"open_result_{i}"):
+                st.session_state.document_dir = result['path']
+                st.rerun()
+    
+    st.markdown("### Watch mode")
+    watch_enabled = st.checkbox("Watch clipboard", key="watch_clipboard",
+                                help="Append every new clipboard content to the PDF automatically")
+    session_watcher(watch_enabled)
 
+# Ctrl+V anywhere on the page arrives as a component event, without a page reload
+paste_event = paste_listener(status="Press Ctrl+V anywhere on the page to paste your clipboard",
+                             send_payload=BROWSER_CLIPBOARD, key="paste_listener")
+# The component keeps returning its last event: only act on a new one
+ctrl_v_triggered = bool(paste_event) and paste_event.get("id") != st.session_state.last_paste_id
 if ctrl_v_triggered:
-    # Clear the query parameter to avoid retriggering
-    st.query_params.clear()
+    st.session_state.last_paste_id = paste_event["id"]
 
 # Create columns for controls
 col1, col2, col3 = st.columns([2, 1, 1])
@@ -421,19 +457,29 @@ with col1:
     pdf_prefix = st.text_input(
         "PDF filename prefix:",
         value="NotebookLM",
+        key="pdf_prefix",
         placeholder="Enter filename prefix",
         help="The PDF will be saved as: prefix_timestamp.pdf"
     )
 
 with col2:
-    # Radio buttons for append/prepend mode (only show if PDF exists)
-    if st.session_state.pdf_path and isfile(st.session_state.pdf_path):
+    # Radio buttons for append/prepend/insert mode (only show if a document exists)
+    insert_index = None
+    if document:
         pdf_mode = st.radio(
             "Content mode:",
-            options=["append", "prepend"],
+            options=["append", "prepend", "insert"],
             index=0,
-            help="Append: Add new content to end\nPrepend: Add new content to beginning"
+            help="Append: Add new content to end\nPrepend: Add new content to beginning\nInsert: Add new content before a given paste"
         )
+        if pdf_mode == "insert":
+            insert_index = st.number_input(
+                "Insert before paste #",
+                min_value=1,
+                max_value=len(document.fragments) + 1,
+                value=len(document.fragments),
+                step=1
+            ) - 1
     else:
         pdf_mode = "new"
         st.write("")  # Empty space when no PDF exists
@@ -442,7 +488,7 @@ with col3:
     # Add some spacing to align button with text input
     st.write("")  # Empty line for spacing
     # Button to create PDF from clipboard (also triggered by Ctrl+V)
-    if st.session_state.pdf_path and isfile(st.session_state.pdf_path):
+    if document:
         button_text = "📋 Add to PDF (Ctrl+V)"
     else:
         button_text = "📋 Create PDF (Ctrl+V)"
@@ -453,28 +499,37 @@ if create_pdf_clicked or ctrl_v_triggered:
     # Use the prefix from the text input, or default if empty
     prefix = pdf_prefix.strip() if pdf_prefix.strip() else "document"
     
-    # Determine the mode and existing PDF path
-    existing_pdf = st.session_state.pdf_path if st.session_state.pdf_path and isfile(st.session_state.pdf_path) else None
-    mode = pdf_mode if existing_pdf else "new"
-    
     try:
-        with st.spinner(f"{'Adding content to' if existing_pdf else 'Creating'} PDF from clipboard..."):
-            pdf_path = create_pdf(prefix, mode, existing_pdf)
-            st.session_state.pdf_path = pdf_path
-        
-        if existing_pdf:
-            st.success(f"Content {'appended to' if mode == 'append' else 'prepended to'} PDF: {os.path.basename(pdf_path)}")
-        else:
-            st.success(f"PDF created successfully: {os.path.basename(pdf_path)}")
-        st.rerun()
+        snapshot = None
+        if ctrl_v_triggered and paste_event.get("formats"):
+            # The browser sent its clipboard: render that rather than the server's
+            snapshot = from_browser(paste_event["formats"], paste_event.get("ts"))
+        submit_paste(prefix, pdf_mode, insert_index, snapshot)
     except Exception as e:
         st.error(f"Error creating PDF: {str(e)}")
 
+report_finished_jobs()
+show_jobs()
+watch_clipboard()
+
+# The session's document is never evicted while the session is alive
+get_retention().keep(st.session_state.session_id, st.session_state.document_dir)
+
+# Assemble the working document only now that it has to be shown
+st.session_state.pdf_path = None
+if document:
+    try:
+        st.session_state.pdf_path = document.assemble()
+    except Exception as e:
+        st.error(f"Error assembling PDF: {str(e)}")
+    else:
+        linearize_in_background(document)
+
 # Display PDF if one exists
 if st.session_state.pdf_path and isfile(st.session_state.pdf_path):
     # Debug information
     file_size = os.path.getsize(st.session_state.pdf_path)
-    st.info(f"📄 PDF loaded: {os.path.basename(st.session_state.pdf_path)} ({file_size:,} bytes)")
+    st.info(f"📄 PDF loaded: {os.path.basename(st.session_state.pdf_path)} ({file_size:,} bytes, {len(document.fragments)} paste(s))")
     
     if file_size > 0:
         show_pdf(st.session_state.pdf_path)
@@ -495,3 +550,8 @@ else:
     </div>
     '''
     st.markdown(empty_viewer, unsafe_allow_html=True)
+
+# Without fragments, poll by rerunning the page while jobs are in flight or watching
+if (st.session_state.jobs or st.session_state.get('clipboard_watcher')) and not hasattr(st, "fragment"):
+    time.sleep(1.0)
+    st.rerun()
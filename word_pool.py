@@ -0,0 +1,201 @@
+"""Pool of warm Word.Application instances used to render clipboard content.
+
+Starting WINWORD is by far the slowest part of a paste, so instead of
+Dispatch/Quit per request we keep a few instances running.  Every instance
+lives on its own STA thread (COM objects must stay on the thread that
+created them), keeps a blank template document open, and is recycled after
+a number of jobs or as soon as it stops answering.  Jobs run under the
+render watchdog: an instance stuck past a stage limit has its WINWORD
+process terminated and is replaced.
+"""
+import os, queue, signal, threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from metrics import span
+from render_watchdog import kill_with, RenderTimeout
+
+WD_FORMAT_PDF = 17                      # constant for PDF export
+
+DEFAULT_POOL_SIZE = int(os.environ.get("CLIP2PDF_WORD_POOL_SIZE", "2"))
+DEFAULT_MAX_JOBS = int(os.environ.get("CLIP2PDF_WORD_MAX_JOBS", "50"))
+
+
+class WordPool:
+    """Hands out warm Word instances, one job at a time per instance.
+
+    Jobs are callables ``fn(word, doc)`` where ``doc`` is the instance's blank
+    template document, already cleared.  They run on the instance's STA thread
+    and their result (or exception) is delivered through a Future.
+    """
+
+    def __init__(self, size=DEFAULT_POOL_SIZE, max_jobs=DEFAULT_MAX_JOBS):
+        self.size = max(1, size)
+        self.max_jobs = max(1, max_jobs)
+        self._jobs = queue.Queue()
+        self._longest = 0               # longest backstop of any job so far
+        self._workers = [_WordWorker(self, i) for i in range(self.size)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, fn, started=None) -> Future:
+        """Queue ``fn(word, doc)`` for the next idle Word instance.
+
+        ``started`` (a ``threading.Event``) is set when an instance picks the
+        job up.
+        """
+        future = Future()
+        self._jobs.put((fn, future, started))
+        return future
+
+    def run(self, fn, timeout=None):
+        """Run ``fn(word, doc)`` on a pooled instance and wait for its result.
+
+        ``timeout`` is a backstop for when the watchdog could not kill a
+        stuck instance; the job is abandoned and ``RenderTimeout`` raised.
+        It counts from when an instance picks the job up, so time spent
+        queued behind other jobs is not held against it.  Waiting for an
+        instance is bounded by the backstops of the jobs ahead, in case
+        every instance is stuck.
+        """
+        started = threading.Event()
+        future = self.submit(fn, started)
+        if timeout is not None:
+            self._longest = max(self._longest, timeout)
+            # Jobs ahead: the others queued, and one on every (possibly busy) instance
+            ahead = max(0, self._jobs.qsize() - 1)
+            queue_wait = (-(-ahead // self.size) + 1) * self._longest
+            if not started.wait(queue_wait) and future.cancel():
+                raise RenderTimeout(f"No Word instance was free within {queue_wait:g}s")
+        try:
+            return future.result(timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise RenderTimeout(f"Word did not finish within {timeout:g}s")
+
+    def shutdown(self):
+        """Quit every Word instance once the queued jobs are done"""
+        for _ in self._workers:
+            self._jobs.put(None)
+        for worker in self._workers:
+            worker.join()
+
+
+class _WordWorker(threading.Thread):
+    """One STA thread owning one Word.Application instance"""
+
+    def __init__(self, pool, index):
+        super().__init__(name=f"word-pool-{index}", daemon=True)
+        self.pool = pool
+        self.word = None
+        self.doc = None
+        self.pid = None                 # WINWORD process, for the watchdog
+        self.jobs_done = 0
+
+    def run(self):
+        import pythoncom  # pip install pywin32
+
+        with span("com_init", worker=self.name):
+            pythoncom.CoInitialize()
+        try:
+            self._warm_up()
+            while True:
+                job = self.pool._jobs.get()
+                if job is None:
+                    break
+                fn, future, started = job
+                if not future.set_running_or_notify_cancel():
+                    continue
+                if started is not None:
+                    started.set()
+                try:
+                    if self.word is None:
+                        self._start()
+                    self.doc.Content.Delete()   # reuse the template document
+                    with kill_with(self._kill):
+                        result = fn(self.word, self.doc)
+                except BaseException as e:
+                    future.set_exception(e)
+                    if not self._alive():
+                        print(f"{self.name}: Word instance crashed, recycling")
+                        self._stop()
+                        self._warm_up()
+                        continue
+                else:
+                    future.set_result(result)
+
+                self.jobs_done += 1
+                if self.jobs_done >= self.pool.max_jobs:
+                    print(f"{self.name}: recycling Word after {self.jobs_done} jobs")
+                    self._stop()
+                    self._warm_up()
+        finally:
+            self._stop()
+            pythoncom.CoUninitialize()
+
+    def _start(self):
+        import win32com.client
+
+        # DispatchEx always starts a separate WINWORD process, so a crash in
+        # one instance never takes down the others
+        with span("dispatch", worker=self.name):
+            self.word = win32com.client.DispatchEx("Word.Application")
+            self.word.Visible = False           # keep UI hidden
+            self.word.DisplayAlerts = 0         # wdAlertsNone, never block on dialogs
+            self.doc = self.word.Documents.Add()  # blank template document
+            self.pid = _process_id(self.word)
+        self.jobs_done = 0
+        print(f"{self.name}: Word instance started (pid {self.pid})")
+
+    def _warm_up(self):
+        # Start the next instance right away so the following job finds it
+        # ready; if Word refuses to start the job itself retries
+        try:
+            self._start()
+        except Exception as e:
+            print(f"{self.name}: could not start Word: {e}")
+            self._stop()
+
+    def _alive(self):
+        try:
+            self.doc.Content.Text           # any round-trip to the server will do
+            return True
+        except Exception:
+            return False
+
+    def _kill(self):
+        """Terminate the WINWORD process (called by the watchdog, from its thread)"""
+        if self.pid is None:
+            raise Exception("process ID of the Word instance unknown")
+        os.kill(self.pid, signal.SIGTERM)       # TerminateProcess on Windows
+
+    def _stop(self):
+        if self.word is None:
+            return
+        try:
+            self.doc.Close(False)
+        except Exception:
+            pass
+        try:
+            self.word.Quit()
+        except Exception:
+            # Hung or already dead: make sure it does not linger as an orphan
+            if self.pid is not None:
+                try:
+                    self._kill()
+                except OSError:
+                    pass
+        self.word = None
+        self.doc = None
+        self.pid = None
+
+
+def _process_id(word):
+    """PID of the WINWORD process behind ``word``, or None if it cannot be told"""
+    try:
+        import win32process
+
+        # Window.Hwnd exists from Word 2013; every document has a window, even hidden
+        return win32process.GetWindowThreadProcessId(word.ActiveWindow.Hwnd)[1]
+    except Exception as pid_error:
+        print(f"Could not get the Word process ID ({pid_error}), hung instances cannot be killed")
+        return None